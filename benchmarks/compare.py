@@ -0,0 +1,136 @@
+"""
+Compare benchmark results to a baseline and flag regressions.
+
+Results of the same benchmark script are matched by their names in ``results``, and a metric is compared for each of them.
+Times are regressions if they are higher than the baseline by more than ``--threshold``, and ``throughput`` is a regression if it is lower.
+The command exits with code 1 if there are regressions, so that it can be used to check changes.
+
+Example
+-------
+>>> python benchmarks/components.py --output baseline.json
+>>> python benchmarks/components.py --output current.json
+>>> python benchmarks/compare.py baseline.json current.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('median', 'p50', 'p95', 'p99', 'mean', 'min', 'max', 'throughput')
+
+def _flatten(results, prefix=''):
+    """
+    Flatten nested results into names and their dictionaries of metrics.
+
+    Parameters
+    ----------
+    results : dict
+        Results of a benchmark, where dictionaries with any of ``METRICS`` are leaves.
+    prefix : str
+        Name of the parent results.
+
+    Returns
+    -------
+    dict
+        Dictionary of names, joined by ``.``, and their dictionaries of metrics.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    out = {}
+    for k, v in results.items():
+        name = f'{prefix}.{k}' if prefix else k
+        if isinstance(v, dict):
+            if any(m in v for m in METRICS):
+                out[name] = v
+            out.update(_flatten({k2: v2 for k2, v2 in v.items() if isinstance(v2, dict)}, prefix=name))
+    return out
+
+def compare(baseline, current, metric=None, threshold=0.1):
+    """
+    Compare benchmark results to a baseline.
+
+    Parameters
+    ----------
+    baseline : dict
+        Baseline results from a benchmark script.
+    current : dict
+        Current results from the same benchmark script.
+    metric : str or None
+        One of ``METRICS`` to compare. If ``None``, ``median`` is used if available, otherwise ``p50``, otherwise ``mean``.
+    threshold : float
+        Relative change beyond which a result is flagged, such as ``0.1`` for 10%.
+
+    Returns
+    -------
+    list(dict)
+        Comparisons with keys ``name``, ``metric``, ``baseline``, ``current``, ``change`` (relative), and ``status`` (``regression``, ``improvement``, or ``ok``).
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    baseline_results = _flatten(baseline.get('results', {}))
+    current_results = _flatten(current.get('results', {}))
+    out = []
+    for name, current_metrics in current_results.items():
+        baseline_metrics = baseline_results.get(name)
+        if baseline_metrics is None:
+            continue
+
+        # (compare_metric) Choose metric and skip missing values
+        name_metric = metric or next((m for m in ('median', 'p50', 'mean') if m in current_metrics), None)
+        baseline_value = baseline_metrics.get(name_metric)
+        current_value = current_metrics.get(name_metric)
+        if not baseline_value or current_value is None:
+            continue
+
+        # (compare_change) Flag changes beyond the threshold, where higher throughput is better
+        change = (current_value - baseline_value) / baseline_value
+        worse = -change if name_metric == 'throughput' else change
+        status = 'regression' if worse > threshold else 'improvement' if worse < -threshold else 'ok'
+        out.append(dict(name=name, metric=name_metric, baseline=baseline_value, current=current_value, change=change, status=status))
+    return out
+
+def run():
+    """
+    Runs the benchmark comparison.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (run_args) Parse arguments
+    parser = argparse.ArgumentParser(description='Compare benchmark results to a baseline and flag regressions')
+    parser.add_argument('baseline', type=str, help='path of json file with baseline results')
+    parser.add_argument('current', type=str, help='path of json file with current results of the same benchmark')
+    parser.add_argument('--metric', type=str, default=None, choices=METRICS, help='metric to compare, defaults to median, p50, or mean')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change beyond which results are flagged, e.g. 0.1 for 10%%')
+    parser.add_argument('--json', dest='json', action='store_true', help='print comparisons as json')
+    args = parser.parse_args()
+
+    # (run_compare) Load and compare results
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get('benchmark') != current.get('benchmark'):
+        raise ValueError(f'Cannot compare results of benchmark {baseline.get("benchmark")} to {current.get("benchmark")}')
+    comparisons = compare(baseline, current, metric=args.metric, threshold=args.threshold)
+
+    # (run_output) Print comparisons and exit with an error if there are regressions
+    if args.json:
+        print(json.dumps(comparisons, indent=2))
+    else:
+        width = max([len(c['name']) for c in comparisons] + [4])
+        print(f'{"name":<{width}}  {"metric":<10}  {"baseline":>12}  {"current":>12}  {"change":>8}  status')
+        for c in comparisons:
+            print(f'{c["name"]:<{width}}  {c["metric"]:<10}  {c["baseline"]:>12.6g}  {c["current"]:>12.6g}  {c["change"]:>+8.1%}  {c["status"]}')
+    regressions = [c for c in comparisons if c['status'] == 'regression']
+    if regressions:
+        print(f'{len(regressions)} regressions beyond {args.threshold:.0%}', file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    run()
\ No newline at end of file
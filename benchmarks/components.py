@@ -0,0 +1,235 @@
+"""
+Micro-benchmarks of the building blocks of ``msdss_users_api``.
+
+Each component is called in a loop that is calibrated to run for at least ``--min_time`` seconds, and the loop is repeated ``--repeat`` times.
+Results are printed as JSON with the ``min``, ``median``, and ``mean`` seconds for one call, so that a run can be compared to a baseline with ``benchmarks/compare.py``.
+
+Components:
+
+* ``password_hash`` and ``password_verify``: :func:`msdss_users_api.hashing.hash_password` and :func:`msdss_users_api.hashing.verify_and_update_password`
+* ``jwt_encode``, ``jwt_decode``, ``cookie_encode``, and ``cookie_decode``: tokens of the JSON Web Token (JWT) and cookie authentication backends
+* ``user_db_get`` and ``user_db_get_by_email``: user lookups through the ``SQLAlchemyUserDatabase`` adapter of the app
+* ``create_fastapi_users_objects``: build time of :func:`msdss_users_api.tools.create_fastapi_users_objects`
+* ``get_users_router``: build time of :func:`msdss_users_api.routers.get_users_router`
+
+Example
+-------
+>>> python benchmarks/components.py --output baseline.json
+>>> python benchmarks/components.py --output current.json
+>>> python benchmarks/compare.py baseline.json current.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from common import *
+from fastapi_users.jwt import decode_jwt
+from msdss_users_api.hashing import hash_password, verify_and_update_password
+from msdss_users_api.migrations import check_schema
+from msdss_users_api.routers import get_users_router
+from msdss_users_api.tools import create_fastapi_users_objects
+
+COMPONENTS = (
+    'password_hash',
+    'password_verify',
+    'jwt_encode',
+    'jwt_decode',
+    'cookie_encode',
+    'cookie_decode',
+    'user_db_get',
+    'user_db_get_by_email',
+    'create_fastapi_users_objects',
+    'get_users_router'
+)
+
+def _create_objects(database):
+    """
+    Create FastAPI Users objects with benchmark secrets.
+
+    Parameters
+    ----------
+    database : :class:`msdss_base_database:msdss_base_database.core.Database`
+        Database of the seeded users.
+
+    Returns
+    -------
+    dict
+        Objects from :func:`msdss_users_api.tools.create_fastapi_users_objects`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    out = create_fastapi_users_objects(
+        user_manager_settings=dict(
+            reset_password_token_secret=BENCHMARK_SECRETS['reset_password_token_secret'],
+            verification_token_secret=BENCHMARK_SECRETS['verification_token_secret']
+        ),
+        jwt_settings=dict(secret=BENCHMARK_SECRETS['jwt_secret']),
+        cookie_settings=dict(secret=BENCHMARK_SECRETS['cookie_secret']),
+        database=database
+    )
+    return out
+
+async def _time(func, repeat=5, min_time=0.2):
+    """
+    Time a function or coroutine function with a loop calibrated to run for at least ``min_time`` seconds.
+
+    Parameters
+    ----------
+    func : func
+        Function without arguments to time. If it returns an awaitable, the awaitable is awaited.
+    repeat : int
+        Number of times to repeat the loop.
+    min_time : float
+        Minimum number of seconds for one loop.
+
+    Returns
+    -------
+    dict
+        A dictionary of the ``number`` of calls in each loop, the number of loops in ``repeat``, and the ``min``, ``median``, and ``mean`` seconds for one call.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (_time_loop) Time a loop of calls
+    async def loop(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            result = func()
+            if asyncio.iscoroutine(result):
+                await result
+        return time.perf_counter() - start
+
+    # (_time_calibrate) Double the number of calls until the loop takes long enough
+    number = 1
+    while True:
+        seconds = await loop(number)
+        if seconds >= min_time:
+            break
+        number = number * 2 if seconds <= 0 else max(number * 2, int(number * min_time / seconds))
+
+    # (_time_repeat) Repeat the loop
+    times = [await loop(number) / number for _ in range(repeat)]
+    out = dict(
+        number=number,
+        repeat=repeat,
+        min=min(times),
+        median=statistics.median(times),
+        mean=statistics.mean(times)
+    )
+    return out
+
+async def _run_async(database, users, components, repeat=5, min_time=0.2):
+    """
+    Run the micro-benchmarks of the components.
+
+    Parameters
+    ----------
+    database : :class:`msdss_base_database:msdss_base_database.core.Database`
+        Database of the seeded users.
+    users : int
+        Number of seeded users.
+    components : list(str)
+        Names of components to benchmark. See ``COMPONENTS``.
+    repeat : int
+        Number of times to repeat the loop of each component.
+    min_time : float
+        Minimum number of seconds for one loop.
+
+    Returns
+    -------
+    dict
+        Results of each component. See :func:`_time`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (_run_async_objects) Create objects and connect to the database
+    fastapi_users_objects = _create_objects(database)
+    async_database = fastapi_users_objects['databases']['async_database']
+    get_user_db = fastapi_users_objects['dependencies']['get_user_db']
+    jwt = fastapi_users_objects['auth']['jwt']
+    cookie = fastapi_users_objects['auth']['cookie']
+    await async_database.connect()
+    try:
+
+        # (_run_async_user) Get a seeded user and its tokens
+        user_db = await get_user_db().__anext__()
+        emails = [get_email(random.randrange(users)) for _ in range(100)]
+        user = await user_db.get_by_email(emails[0])
+        ids = [(await user_db.get_by_email(email)).id for email in emails[:20]]
+        hashed_password = hash_password(BENCHMARK_PASSWORD)
+        jwt_token = await jwt._generate_token(user)
+        cookie_token = await cookie._generate_token(user)
+
+        # (_run_async_components) Define calls of each component
+        calls = dict(
+            password_hash=lambda: hash_password(BENCHMARK_PASSWORD),
+            password_verify=lambda: verify_and_update_password(BENCHMARK_PASSWORD, hashed_password),
+            jwt_encode=lambda: jwt._generate_token(user),
+            jwt_decode=lambda: decode_jwt(jwt_token, jwt.secret, jwt.token_audience),
+            cookie_encode=lambda: cookie._generate_token(user),
+            cookie_decode=lambda: decode_jwt(cookie_token, cookie.secret, cookie.token_audience),
+            user_db_get=lambda: user_db.get(random.choice(ids)),
+            user_db_get_by_email=lambda: user_db.get_by_email(random.choice(emails)),
+            create_fastapi_users_objects=lambda: _create_objects(database),
+            get_users_router=lambda: get_users_router(fastapi_users_objects)
+        )
+
+        # (_run_async_time) Time each component
+        out = {}
+        for name in components:
+            out[name] = await _time(calls[name], repeat=repeat, min_time=min_time)
+    finally:
+        await async_database.disconnect()
+    return out
+
+def run():
+    """
+    Runs the component micro-benchmarks.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (run_args) Parse arguments
+    parser = argparse.ArgumentParser(description='Micro-benchmark the building blocks of the users api')
+    parser.add_argument('--only', type=str, nargs='+', default=list(COMPONENTS), choices=COMPONENTS, help='components to benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times to repeat the loop of each component')
+    parser.add_argument('--min_time', type=float, default=0.2, help='minimum number of secs for one loop of calls')
+    parser.add_argument('--users', type=int, default=1000, help='number of users to seed for lookups, existing seeded users are reused')
+    parser.add_argument('--database_url', type=str, default=None, help='sqlalchemy url of the database, defaults to a sqlite file in the temp folder')
+    parser.add_argument('--output', type=str, default=None, help='path of json file to save results, defaults to stdout only')
+    args = parser.parse_args()
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'msdss_users_benchmark.db')
+
+    # (run_seed) Migrate schema and seed users
+    database = create_database(database_url)
+    database_engine = database._connection
+    check_schema(database_engine)
+    seed_users(database_engine, args.users)
+
+    # (run_benchmark) Time components
+    results = asyncio.run(_run_async(database, args.users, args.only, repeat=args.repeat, min_time=args.min_time))
+
+    # (run_output) Print and save results
+    out = dict(
+        benchmark='components',
+        **get_metadata(),
+        database=database_engine.url.get_backend_name(),
+        results=results
+    )
+    write_results(out, output=args.output)
+
+if __name__ == '__main__':
+    run()
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Benchmark the database connections used by one worker for each database backend of ``msdss_users_api``.
+
+For each backend, a users API app is started in this process and sent concurrent authenticated requests.
+Connections are counted on the database server (PostgreSQL or MySQL) with a separate monitoring connection before and during the requests,
+so that the peak number of connections used by the worker can be compared between backends. Results are printed as JSON.
+
+The database is set with the same environment variables as ``msdss-users``. For other databases, such as SQLite,
+only the connections reported by the connection pools of the app are included.
+
+Example
+-------
+>>> python benchmarks/connections.py --requests 500 --concurrency 50 --output connections.json
+"""
+import argparse
+import asyncio
+import contextlib
+import httpx
+import sqlalchemy
+import time
+
+from common import *
+from fastapi import FastAPI
+from fastapi_users.manager import UserNotExists
+from msdss_base_database import Database
+from msdss_users_api import UsersAPI
+from msdss_users_api.models import UserCreate
+
+BENCHMARK_EMAIL = 'benchmark-connections@example.com'
+
+def _count_server_connections(monitor_engine):
+    """
+    Count connections to the current database on the database server, excluding the monitoring connection.
+
+    Parameters
+    ----------
+    monitor_engine : :func:`sqlalchemy:sqlalchemy.create_engine`
+        SQLAlchemy engine used only for monitoring.
+
+    Returns
+    -------
+    int or None
+        Number of connections, or ``None`` if the database does not report connections.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    queries = dict(
+        postgresql='SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()',
+        mysql='SELECT count(*) FROM information_schema.processlist WHERE db = DATABASE() AND id <> CONNECTION_ID()'
+    )
+    query = queries.get(monitor_engine.url.get_backend_name())
+    if query is None:
+        return None
+    with monitor_engine.connect() as connection:
+        out = connection.execute(sqlalchemy.text(query)).scalar()
+    return out
+
+async def _get_token(app):
+    """
+    Create the benchmark user if needed and log in to get a JSON Web Token (JWT) for it.
+
+    Parameters
+    ----------
+    app : :class:`msdss_users_api.core.UsersAPI`
+        Started users API app.
+
+    Returns
+    -------
+    str
+        Access token of the benchmark user.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (_get_token_user) Create user
+    dependencies = app.misc['fastapi_users_objects']['dependencies']
+    async with contextlib.asynccontextmanager(dependencies['get_user_db'])() as user_db:
+        async with contextlib.asynccontextmanager(dependencies['get_user_manager'])(user_db) as user_manager:
+            try:
+                await user_manager.get_by_email(BENCHMARK_EMAIL)
+            except UserNotExists:
+                await user_manager.create(UserCreate(email=BENCHMARK_EMAIL, password=BENCHMARK_PASSWORD))
+
+    # (_get_token_login) Log in
+    async with httpx.AsyncClient(app=app.api, base_url='http://benchmark') as client:
+        response = await client.post('/auth/jwt/login', data=dict(username=BENCHMARK_EMAIL, password=BENCHMARK_PASSWORD))
+        response.raise_for_status()
+    out = response.json()['access_token']
+    return out
+
+async def _run_backend(backend, monitor_engine, requests=200, concurrency=20, pool_settings={}):
+    """
+    Run the benchmark for a database backend.
+
+    Parameters
+    ----------
+    backend : str
+        Backend passed to :class:`msdss_users_api.core.UsersAPI`.
+    monitor_engine : :func:`sqlalchemy:sqlalchemy.create_engine`
+        SQLAlchemy engine used only for monitoring.
+    requests : int
+        Number of authenticated requests to send.
+    concurrency : int
+        Number of requests to send at the same time.
+    pool_settings : dict
+        Connection pool settings passed to :class:`msdss_users_api.core.UsersAPI`.
+
+    Returns
+    -------
+    dict
+        Results of the benchmark for the backend.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (_run_backend_start) Start app
+    baseline = await asyncio.to_thread(_count_server_connections, monitor_engine)
+    database = Database()
+    app = UsersAPI(
+        database=database,
+        pool_settings=pool_settings,
+        backend=backend,
+        load_env=False,
+        api=FastAPI(),
+        **BENCHMARK_SECRETS
+    )
+    await app.api.router.startup()
+    token = await _get_token(app)
+
+    # (_run_backend_monitor) Sample server connections while sending requests
+    samples = []
+    done = asyncio.Event()
+    async def monitor():
+        while not done.is_set():
+            samples.append(await asyncio.to_thread(_count_server_connections, monitor_engine))
+            await asyncio.sleep(0.05)
+
+    # (_run_backend_requests) Send concurrent requests
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = {}
+    async with httpx.AsyncClient(app=app.api, base_url='http://benchmark', headers={'Authorization': f'Bearer {token}'}) as client:
+        async def request():
+            async with semaphore:
+                response = await client.get('/users/me')
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        monitor_task = asyncio.create_task(monitor())
+        start = time.perf_counter()
+        await asyncio.gather(*[request() for _ in range(requests)])
+        seconds = time.perf_counter() - start
+        done.set()
+        await monitor_task
+
+    # (_run_backend_pools) Get client side pool sizes
+    async_database = app.misc['fastapi_users_objects']['databases']['async_database']
+    sync_pool = database._connection.pool
+    pool_stats = async_database.get_stats()
+    sync_connections = sync_pool.checkedin() + sync_pool.checkedout() if hasattr(sync_pool, 'checkedin') else None
+
+    # (_run_backend_return) Stop app and return results
+    await app.api.router.shutdown()
+    database._connection.dispose()
+    samples = [s for s in samples if s is not None]
+    peak = max(samples) if samples else None
+    out = dict(
+        requests=requests,
+        concurrency=concurrency,
+        seconds=seconds,
+        statuses=statuses,
+        server_connections_baseline=baseline,
+        server_connections_peak=peak,
+        server_connections_used=peak - baseline if peak is not None and baseline is not None else None,
+        sync_pool_connections=sync_connections,
+        async_pool=pool_stats
+    )
+    return out
+
+def run():
+    """
+    Runs the connections benchmark.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (run_args) Parse arguments
+    parser = argparse.ArgumentParser(description='Benchmark database connections used per worker for each backend')
+    parser.add_argument('--backends', type=str, nargs='+', default=['databases', 'sqlalchemy'], choices=['databases', 'sqlalchemy'], help='backends to benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='number of authenticated requests to send')
+    parser.add_argument('--concurrency', type=int, default=20, help='number of requests to send at the same time')
+    parser.add_argument('--pool_min_size', type=int, default=None, help='min number of connections of the async pool')
+    parser.add_argument('--pool_max_size', type=int, default=None, help='max number of connections of the async pool')
+    parser.add_argument('--output', type=str, default=None, help='path of json file to save results, defaults to stdout only')
+    args = parser.parse_args()
+    pool_settings = {k: v for k, v in dict(min_size=args.pool_min_size, max_size=args.pool_max_size).items() if v is not None}
+
+    # (run_backends) Run each backend with a separate monitoring engine
+    monitor_database = Database()
+    monitor_engine = sqlalchemy.create_engine(monitor_database._connection.url, poolclass=sqlalchemy.pool.NullPool)
+    monitor_database._connection.dispose()
+    results = {}
+    for backend in args.backends:
+        results[backend] = asyncio.run(_run_backend(backend, monitor_engine, requests=args.requests, concurrency=args.concurrency, pool_settings=pool_settings))
+
+    # (run_output) Print and save results
+    out = dict(
+        benchmark='connections',
+        **get_metadata(),
+        database=monitor_engine.url.get_backend_name(),
+        results=results
+    )
+    write_results(out, output=args.output)
+
+if __name__ == '__main__':
+    run()
\ No newline at end of file
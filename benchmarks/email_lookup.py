@@ -0,0 +1,195 @@
+"""
+Benchmark email lookups and logins of ``msdss_users_api`` on a large users table.
+
+Users are seeded in batches with one shared password hash, using mixed case emails, into the database of ``--database_url`` or the database set with the same
+environment variables as ``msdss-users`` (e.g. SQLite or PostgreSQL). Lookups by email are then timed with the ``lower(email)`` comparison of ``fastapi-users`` and with the indexed
+``email_normalized`` column, followed by logins through ``/auth/jwt/login``. Results are printed as JSON with times in seconds.
+
+Example
+-------
+>>> python benchmarks/email_lookup.py --users 1000000 --lookups 2000 --logins 50 --output email_lookup.json
+"""
+import argparse
+import asyncio
+import httpx
+import random
+import time
+
+from common import *
+from fastapi import FastAPI
+from fastapi_users.db import SQLAlchemyUserDatabase
+from msdss_users_api import UsersAPI
+from msdss_users_api.adapters import UserDatabase
+from msdss_users_api.migrations import check_schema
+from msdss_users_api.models import UserDB, UserTable
+from msdss_users_api.pool import PooledDatabase
+
+async def _time_lookups(async_database, users, lookups):
+    """
+    Time lookups of random seeded users by differently cased emails with ``lower(email)`` and with ``email_normalized``.
+
+    Parameters
+    ----------
+    async_database : :class:`msdss_users_api.pool.PooledDatabase`
+        Connected async database.
+    users : int
+        Number of seeded users.
+    lookups : int
+        Number of lookups for each method.
+
+    Returns
+    -------
+    dict
+        Latencies of each method. See :func:`common.summarize`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    table = UserTable.__table__
+    adapters = dict(
+        lower_email=SQLAlchemyUserDatabase(UserDB, async_database, table),
+        email_normalized=UserDatabase(UserDB, async_database, table)
+    )
+    emails = [get_email(random.randrange(users)).upper() for _ in range(lookups)]
+    out = {}
+    for name, user_db in adapters.items():
+        times = []
+        for email in emails:
+            start = time.perf_counter()
+            user = await user_db.get_by_email(email)
+            times.append(time.perf_counter() - start)
+            assert user is not None, f'User {email} was not found'
+        out[name] = summarize(times)
+    return out
+
+async def _time_logins(database, users, logins):
+    """
+    Time logins of random seeded users through ``/auth/jwt/login``.
+
+    Parameters
+    ----------
+    database : :class:`msdss_base_database:msdss_base_database.core.Database`
+        Database of the seeded users.
+    users : int
+        Number of seeded users.
+    logins : int
+        Number of logins.
+
+    Returns
+    -------
+    dict
+        Latencies of logins. See :func:`common.summarize`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    app = UsersAPI(
+        database=database,
+        load_env=False,
+        api=FastAPI(),
+        **BENCHMARK_SECRETS
+    )
+    await app.api.router.startup()
+    times = []
+    try:
+        async with httpx.AsyncClient(app=app.api, base_url='http://benchmark') as client:
+            for _ in range(logins):
+                email = get_email(random.randrange(users)).lower()
+                start = time.perf_counter()
+                response = await client.post('/auth/jwt/login', data=dict(username=email, password=BENCHMARK_PASSWORD))
+                times.append(time.perf_counter() - start)
+                response.raise_for_status()
+    finally:
+        await app.api.router.shutdown()
+    out = summarize(times)
+    return out
+
+async def _run_async(database, users, lookups, logins):
+    """
+    Run the lookup and login benchmarks.
+
+    Parameters
+    ----------
+    database : :class:`msdss_base_database:msdss_base_database.core.Database`
+        Database of the seeded users.
+    users : int
+        Number of seeded users.
+    lookups : int
+        Number of lookups for each method.
+    logins : int
+        Number of logins.
+
+    Returns
+    -------
+    dict
+        Results of the lookup and login benchmarks.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    async_database = PooledDatabase(str(database._connection.url))
+    await async_database.connect()
+    try:
+        lookup_results = await _time_lookups(async_database, users, lookups)
+    finally:
+        await async_database.disconnect()
+    out = dict(
+        get_by_email=lookup_results,
+        login=await _time_logins(database, users, logins) if logins > 0 else None
+    )
+    return out
+
+def run():
+    """
+    Runs the email lookup benchmark.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (run_args) Parse arguments
+    parser = argparse.ArgumentParser(description='Benchmark email lookups and logins on a large users table')
+    parser.add_argument('--users', type=int, default=1000000, help='number of users to seed, existing seeded users are reused')
+    parser.add_argument('--lookups', type=int, default=1000, help='number of email lookups for each method')
+    parser.add_argument('--logins', type=int, default=50, help='number of logins, which include password verification')
+    parser.add_argument('--batch_size', type=int, default=10000, help='number of users to insert at a time when seeding')
+    parser.add_argument('--database_url', type=str, default=None, help='sqlalchemy url of the database, defaults to the database set by environment variables')
+    parser.add_argument('--cleanup', dest='cleanup', action='store_true', help='delete seeded users after the benchmark')
+    parser.add_argument('--output', type=str, default=None, help='path of json file to save results, defaults to stdout only')
+    args = parser.parse_args()
+
+    # (run_seed) Migrate schema and seed users
+    database = create_database(args.database_url)
+    database_engine = database._connection
+    check_schema(database_engine)
+    start = time.perf_counter()
+    seeded = seed_users(database_engine, args.users, batch_size=args.batch_size)
+    seed_seconds = time.perf_counter() - start
+
+    # (run_benchmark) Time lookups and logins
+    try:
+        results = asyncio.run(_run_async(database, args.users, args.lookups, args.logins))
+    finally:
+        if args.cleanup:
+            table = UserTable.__table__
+            with database_engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.email_normalized.like('bench.email.%')))
+
+    # (run_output) Print and save results
+    out = dict(
+        benchmark='email_lookup',
+        **get_metadata(),
+        database=database_engine.url.get_backend_name(),
+        users=args.users,
+        seeded=seeded,
+        seed_seconds=seed_seconds,
+        results=results
+    )
+    write_results(out, output=args.output)
+
+if __name__ == '__main__':
+    run()
\ No newline at end of file
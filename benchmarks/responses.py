@@ -0,0 +1,188 @@
+"""
+Benchmark the CPU time of ``GET /users/me`` with and without fast responses.
+
+The users app is created in this process once for each mode, and requests are passed to it one at a time as ASGI calls without a network or HTTP client, so that the CPU time of each request is the time spent by the app.
+Results are printed as JSON with the ``min``, ``median``, and ``mean`` CPU and wall seconds for one request in each mode, and the ``savings`` of fast responses as a fraction of the default CPU time.
+
+Modes:
+
+* ``default``: responses are validated against the ``User`` response model and encoded with ``json``
+* ``fast``: responses are encoded with ``orjson`` without validating them again, see parameter ``fast_responses`` of :class:`msdss_users_api.core.UsersAPI`
+
+Users are looked up from the database for each request unless ``--stateless`` is set, which leaves only token decoding and the response to time.
+
+Example
+-------
+>>> python benchmarks/responses.py --requests 2000 --output responses.json
+>>> python benchmarks/responses.py --stateless
+"""
+import argparse
+import asyncio
+import httpx
+import os
+import statistics
+import tempfile
+import time
+
+from common import *
+from fastapi import FastAPI
+from msdss_users_api import UsersAPI
+from msdss_users_api.migrations import check_schema
+
+MODES = ('default', 'fast')
+
+async def _get(app, path, headers):
+    """
+    Send a ``GET`` request to an ASGI app without a network.
+
+    Parameters
+    ----------
+    app : :class:`fastapi:fastapi.FastAPI`
+        App to send the request to.
+    path : str
+        Path of the request.
+    headers : dict
+        Headers of the request.
+
+    Returns
+    -------
+    int
+        Status code of the response.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    scope = dict(
+        type='http',
+        asgi=dict(version='3.0'),
+        http_version='1.1',
+        method='GET',
+        scheme='http',
+        path=path,
+        raw_path=path.encode(),
+        root_path='',
+        query_string=b'',
+        headers=[(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        client=('127.0.0.1', 50000),
+        server=('benchmark', 80)
+    )
+    messages = []
+    async def receive():
+        return dict(type='http.request', body=b'', more_body=False)
+    async def send(message):
+        messages.append(message)
+    await app(scope, receive, send)
+    out = messages[0]['status']
+    return out
+
+async def _time_mode(database, fast_responses, requests=1000, repeat=5, stateless=False):
+    """
+    Time ``GET /users/me`` requests of a seeded user in one mode.
+
+    Parameters
+    ----------
+    database : :class:`msdss_base_database:msdss_base_database.core.Database`
+        Database of the seeded users.
+    fast_responses : bool
+        Whether to create the app with fast responses or not.
+    requests : int
+        Number of requests in each repeat.
+    repeat : int
+        Number of times to repeat the requests.
+    stateless : bool
+        Whether to create the app with stateless tokens or not.
+
+    Returns
+    -------
+    dict
+        A dictionary of the ``requests``, ``repeat``, and the ``min``, ``median``, and ``mean`` seconds of ``cpu`` and ``wall`` time for one request.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    app = UsersAPI(
+        database=database,
+        load_env=False,
+        api=FastAPI(),
+        stateless=stateless,
+        fast_responses=fast_responses,
+        **BENCHMARK_SECRETS
+    )
+    await app.api.router.startup()
+    try:
+        async with httpx.AsyncClient(app=app.api, base_url='http://benchmark') as client:
+
+            # (_time_mode_token) Log in a seeded user and warm up
+            response = await client.post('/auth/jwt/login', data=dict(username=get_email(0).lower(), password=BENCHMARK_PASSWORD))
+            response.raise_for_status()
+            headers = {'Authorization': 'Bearer ' + response.json()['access_token']}
+            for _ in range(min(requests, 50)):
+                status = await _get(app.api, '/users/me', headers)
+                if status != 200:
+                    raise RuntimeError(f'GET /users/me returned status {status}')
+
+            # (_time_mode_repeat) Time cpu and wall seconds of the requests
+            cpu = []
+            wall = []
+            for _ in range(repeat):
+                start_cpu = time.process_time()
+                start_wall = time.perf_counter()
+                for _ in range(requests):
+                    await _get(app.api, '/users/me', headers)
+                cpu.append((time.process_time() - start_cpu) / requests)
+                wall.append((time.perf_counter() - start_wall) / requests)
+    finally:
+        await app.api.router.shutdown()
+    out = dict(
+        requests=requests,
+        repeat=repeat,
+        cpu=dict(min=min(cpu), median=statistics.median(cpu), mean=statistics.mean(cpu)),
+        wall=dict(min=min(wall), median=statistics.median(wall), mean=statistics.mean(wall))
+    )
+    return out
+
+def run():
+    """
+    Runs the response benchmark.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (run_args) Parse arguments
+    parser = argparse.ArgumentParser(description='Benchmark the cpu time of GET /users/me with and without fast responses')
+    parser.add_argument('--requests', type=int, default=1000, help='number of requests in each repeat')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times to repeat the requests of each mode')
+    parser.add_argument('--stateless', dest='stateless', action='store_true', help='trust user attributes in tokens instead of looking up users for each request')
+    parser.add_argument('--database_url', type=str, default=None, help='sqlalchemy url of the database, defaults to a sqlite file in the temp folder')
+    parser.add_argument('--output', type=str, default=None, help='path of json file to save results, defaults to stdout only')
+    args = parser.parse_args()
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'msdss_users_benchmark.db')
+
+    # (run_seed) Migrate schema and seed a user
+    database = create_database(database_url)
+    database_engine = database._connection
+    check_schema(database_engine)
+    seed_users(database_engine, 1)
+
+    # (run_benchmark) Time each mode
+    results = {}
+    for mode in MODES:
+        results[mode] = asyncio.run(_time_mode(database, mode == 'fast', requests=args.requests, repeat=args.repeat, stateless=args.stateless))
+    results['savings'] = 1 - results['fast']['cpu']['median'] / results['default']['cpu']['median']
+
+    # (run_output) Print and save results
+    out = dict(
+        benchmark='responses',
+        **get_metadata(),
+        database=database_engine.url.get_backend_name(),
+        stateless=args.stateless,
+        results=results
+    )
+    write_results(out, output=args.output)
+
+if __name__ == '__main__':
+    run()
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+Benchmark cold start times of ``msdss_users_api``.
+
+Each statement is run in a new Python process so that nothing is cached between runs.
+Results are printed as JSON with times in seconds, so that they can be saved and compared between versions.
+
+Example
+-------
+>>> python benchmarks/startup.py --runs 20 --output startup.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+STATEMENTS = dict(
+    import_package='import msdss_users_api',
+    import_cli='import msdss_users_api.cli',
+    import_core='import msdss_users_api.core',
+    cli_help='import sys; sys.argv = ["msdss-users", "--help"]; from msdss_users_api.cli import run; run()'
+)
+
+def _time_statement(statement, runs=10):
+    """
+    Time a Python statement in new processes.
+
+    Parameters
+    ----------
+    statement : str
+        Python statement to run with ``python -c``.
+    runs : int
+        Number of processes to run.
+
+    Returns
+    -------
+    dict
+        A dictionary of the ``min``, ``median``, ``mean``, and ``max`` times in seconds, and the number of ``runs``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    out = dict(
+        runs=runs,
+        min=min(times),
+        median=statistics.median(times),
+        mean=statistics.mean(times),
+        max=max(times)
+    )
+    return out
+
+def run():
+    """
+    Runs the startup benchmark.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+
+    # (run_args) Parse arguments
+    parser = argparse.ArgumentParser(description='Benchmark import and msdss-users --help times')
+    parser.add_argument('--runs', type=int, default=10, help='number of processes to run for each statement')
+    parser.add_argument('--only', type=str, nargs='+', default=list(STATEMENTS), choices=list(STATEMENTS), help='statements to benchmark')
+    parser.add_argument('--output', type=str, default=None, help='path of json file to save results, defaults to stdout only')
+    args = parser.parse_args()
+
+    # (run_baseline) Time an empty interpreter so it can be subtracted from results
+    results = dict(python=_time_statement('pass', runs=args.runs))
+    for name in args.only:
+        results[name] = _time_statement(STATEMENTS[name], runs=args.runs)
+
+    # (run_output) Print and save results
+    out = dict(
+        benchmark='startup',
+        python_version=platform.python_version(),
+        platform=platform.platform(),
+        results=results
+    )
+    text = json.dumps(out, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+if __name__ == '__main__':
+    run()
\ No newline at end of file
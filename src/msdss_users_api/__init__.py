@@ -1,2 +1,31 @@
-from .core import *
-from .env import UsersDotEnv
\ No newline at end of file
+import importlib
+
+__all__ = ['UsersAPI', 'UsersDotEnv']
+
+def __getattr__(name):
+    """
+    Import attributes of the package on first access, so that importing the package or a submodule such as :mod:`msdss_users_api.cli` does not load the users API until it is used.
+
+    Parameters
+    ----------
+    name : str
+        Name of the attribute, such as ``UsersAPI`` from :mod:`msdss_users_api.core` or ``UsersDotEnv`` from :mod:`msdss_users_api.env`.
+
+    Return
+    ------
+    any
+        The attribute from :mod:`msdss_users_api.env` or :mod:`msdss_users_api.core`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    if name.startswith('__'):
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if name == 'UsersDotEnv':
+        from .env import UsersDotEnv as out
+    else:
+        core = importlib.import_module('.core', __name__)
+        out = getattr(core, name)
+    globals()[name] = out
+    return out
\ No newline at end of file
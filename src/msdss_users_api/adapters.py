@@ -0,0 +1,659 @@
+import base64
+import datetime
+import hashlib
+import itertools
+import json
+import secrets
+import sqlalchemy
+import uuid
+
+from fastapi_users.db import SQLAlchemyUserDatabase
+
+from .defaults import *
+
+def _decode_cursor(cursor):
+    """
+    Decode a cursor from :meth:`msdss_users_api.adapters.UserDatabase.get_page`.
+
+    Parameters
+    ----------
+    cursor : str
+        Opaque cursor for the next page of users.
+
+    Returns
+    -------
+    tuple
+        The name of the column users are ordered by and its value for the last user of the previous page.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.adapters import _decode_cursor, _encode_cursor
+
+        cursor = _encode_cursor('email_normalized', 'test@example.com')
+        print(_decode_cursor(cursor))
+    """
+    try:
+        key, value = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid cursor {cursor}')
+    if key not in ('id', 'email_normalized') or not isinstance(value, str):
+        raise ValueError(f'Invalid cursor {cursor}')
+    return key, value
+
+def _encode_cursor(key, value):
+    """
+    Encode a cursor for :meth:`msdss_users_api.adapters.UserDatabase.get_page`.
+
+    Parameters
+    ----------
+    key : str
+        The name of the column users are ordered by, one of ``id`` or ``email_normalized``.
+    value : str
+        Value of the column for the last user of the page.
+
+    Returns
+    -------
+    str
+        Opaque cursor for the next page of users.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.adapters import _encode_cursor
+
+        cursor = _encode_cursor('email_normalized', 'test@example.com')
+        print(cursor)
+    """
+    out = base64.urlsafe_b64encode(json.dumps([key, str(value)]).encode('utf-8')).decode('ascii')
+    return out
+
+def hash_token(token):
+    """
+    Hash an opaque token for storage and lookup.
+
+    * Tokens are random with enough entropy that a fast SHA-256 hash is safe, unlike passwords which need a slow hash
+
+    Parameters
+    ----------
+    token : str
+        Token to hash.
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-256 hash of ``token``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.adapters import hash_token
+
+        print(hash_token('opaque-token'))
+    """
+    out = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    return out
+
+def normalize_email(email):
+    """
+    Normalize an email for case insensitive lookups with the ``email_normalized`` column of :class:`msdss_users_api.models.UserTable`.
+
+    Parameters
+    ----------
+    email : str
+        Email to normalize.
+
+    Returns
+    -------
+    str
+        Email without surrounding whitespace and in lower case.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.adapters import normalize_email
+
+        print(normalize_email(' Test@Example.com'))
+    """
+    out = email.strip().lower()
+    return out
+
+class RefreshTokenDatabase:
+    """
+    Database adapter for long-lived opaque refresh tokens, stored as hashes in a :class:`msdss_users_api.models.RefreshTokenTable`.
+
+    * Exchanging a token fetches the token and its user with one query on the primary key index, without any password hashing
+    * If ``rotate`` is ``True``, each exchange revokes the token and returns a new one. Exchanging a revoked token is treated as reuse of a stolen token and revokes all tokens of its user
+    * Rotation locks the token row before revoking it, so of two concurrent exchanges of the same token only one gets a new token and the other is treated as reuse
+    * Revoked tokens are kept until they expire so that reuse can be detected, and expired tokens are deleted in batches with :meth:`msdss_users_api.adapters.RefreshTokenDatabase.delete_expired`
+
+    Parameters
+    ----------
+    user_db_model : :class:`msdss_users_api.models.UserDB`
+        The user database model. See :class:`msdss_users_api.models.UserDB`.
+    database : :class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase`
+        Async database to run queries with.
+    tokens : :class:`sqlalchemy:sqlalchemy.schema.Table`
+        SQLAlchemy refresh tokens table. See :class:`msdss_users_api.models.RefreshTokenTable`.
+    users : :class:`sqlalchemy:sqlalchemy.schema.Table`
+        SQLAlchemy users table. See :class:`msdss_users_api.models.UserTable`.
+    lifetime_seconds : int
+        Number of seconds each refresh token is valid for.
+    rotate : bool
+        Whether to replace tokens with new ones each time they are exchanged or not.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.adapters import RefreshTokenDatabase
+        from msdss_users_api.models import RefreshTokenTable, UserDB, UserTable
+        from msdss_users_api.pool import PooledDatabase
+
+        database_engine = Database()._connection
+        async_database = PooledDatabase(str(database_engine.url))
+        refresh_token_db = RefreshTokenDatabase(UserDB, async_database, RefreshTokenTable.__table__, UserTable.__table__)
+    """
+    def __init__(
+        self,
+        user_db_model,
+        database,
+        tokens,
+        users,
+        lifetime_seconds=DEFAULT_REFRESH_TOKEN_SETTINGS['lifetime_seconds'],
+        rotate=DEFAULT_REFRESH_TOKEN_SETTINGS['rotate']):
+        self.user_db_model = user_db_model
+        self.database = database
+        self.tokens = tokens
+        self.users = users
+        self.lifetime_seconds = lifetime_seconds
+        self.rotate = rotate
+
+    async def create(self, user_id):
+        """
+        Create a refresh token for a user.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+
+        Returns
+        -------
+        str
+            The opaque refresh token. Only its hash is stored.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = secrets.token_urlsafe(32)
+        await self.database.execute(self.tokens.insert(), dict(
+            token_hash=hash_token(out),
+            user_id=user_id,
+            expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lifetime_seconds),
+            revoked=False
+        ))
+        return out
+
+    async def delete_expired(self, batch_size=DEFAULT_REFRESH_TOKEN_SETTINGS['batch_size']):
+        """
+        Delete expired refresh tokens in batches, so that each delete only holds locks on a few rows.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of tokens to delete in each query.
+
+        Returns
+        -------
+        int
+            Number of deleted tokens.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = 0
+        now = datetime.datetime.utcnow()
+        while True:
+            query = sqlalchemy.select(self.tokens.c.token_hash).where(self.tokens.c.expires_at < now).limit(batch_size)
+            token_hashes = [row['token_hash'] for row in await self.database.fetch_all(query)]
+            if token_hashes:
+                await self.database.execute(self.tokens.delete().where(self.tokens.c.token_hash.in_(token_hashes)))
+                out += len(token_hashes)
+            if len(token_hashes) < batch_size:
+                break
+        return out
+
+    async def exchange(self, token):
+        """
+        Exchange a refresh token for its user, rotating the token if ``rotate`` is ``True``.
+
+        Parameters
+        ----------
+        token : str
+            Refresh token to exchange.
+
+        Returns
+        -------
+        tuple or None
+            A tuple of the user (:class:`msdss_users_api.models.UserDB`) and the refresh token to use next (str), which is the same token if ``rotate`` is ``False``.
+            ``None`` if the token does not exist, expired, was revoked, or belongs to an inactive user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+
+        # (RefreshTokenDatabase_exchange_get) Get token and user with one indexed lookup
+        token_hash = hash_token(token)
+        query = (
+            sqlalchemy.select(self.tokens.c.expires_at, self.tokens.c.revoked, self.users)
+            .select_from(self.tokens.join(self.users, self.tokens.c.user_id == self.users.c.id))
+            .where(self.tokens.c.token_hash == token_hash)
+        )
+        row = await self.database.fetch_one(query)
+        if row is None:
+            return None
+
+        # (RefreshTokenDatabase_exchange_reuse) Revoke all tokens of the user if a revoked token is reused
+        if row['revoked']:
+            await self.revoke_user(row['id'])
+            return None
+
+        # (RefreshTokenDatabase_exchange_check) Reject expired tokens and inactive users
+        user = self.user_db_model(**{k: row[k] for k in self.user_db_model.__fields__ if k in self.users.c})
+        if row['expires_at'] <= datetime.datetime.utcnow() or not user.is_active:
+            return None
+
+        # (RefreshTokenDatabase_exchange_rotate) Claim the token with a locked read and a conditional revoke, treating a lost claim as reuse
+        if self.rotate:
+            async with self.database.transaction():
+                query = sqlalchemy.select(self.tokens.c.revoked).where(self.tokens.c.token_hash == token_hash).with_for_update()
+                revoked = await self.database.fetch_val(query)
+                if revoked is None or revoked:
+                    await self.revoke_user(user.id)
+                    return None
+                updated = await self.database.execute(
+                    self.tokens.update()
+                    .where(self.tokens.c.token_hash == token_hash)
+                    .where(self.tokens.c.revoked == False)
+                    .values(revoked=True)
+                )
+                if updated == 0:
+                    await self.revoke_user(user.id)
+                    return None
+                token = await self.create(user.id)
+        out = (user, token)
+        return out
+
+    async def revoke(self, token):
+        """
+        Revoke a refresh token.
+
+        Parameters
+        ----------
+        token : str
+            Refresh token to revoke.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self.database.execute(self.tokens.update().where(self.tokens.c.token_hash == hash_token(token)).values(revoked=True))
+
+    async def revoke_user(self, user_id):
+        """
+        Revoke all refresh tokens of a user, such as after a password change or a detected token reuse.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self.database.execute(self.tokens.update().where(self.tokens.c.user_id == user_id).values(revoked=True))
+
+    async def revoke_users(self, user_ids):
+        """
+        Revoke all refresh tokens of many users in one query, such as after deactivating them in bulk.
+
+        Parameters
+        ----------
+        user_ids : list(:class:`uuid.UUID`)
+            Ids of the users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if user_ids:
+            await self.database.execute(self.tokens.update().where(self.tokens.c.user_id.in_(user_ids)).values(revoked=True))
+
+class UserDatabase(SQLAlchemyUserDatabase):
+    """
+    Database adapter for users.
+
+    * Extends :class:`fastapi_users:fastapi_users.db.SQLAlchemyUserDatabase`
+    * If a ``user_cache`` is set, users fetched by id are served from the cache and writes invalidate the cached user
+    * Pages of users can be listed with keyset pagination using :meth:`msdss_users_api.adapters.UserDatabase.get_page`
+    * Flags of many users can be set with batched set-based updates using :meth:`msdss_users_api.adapters.UserDatabase.update_many`
+    * If the users table has an ``email_normalized`` column, writes fill it with :func:`msdss_users_api.adapters.normalize_email` and email lookups use its unique index instead of comparing ``lower(email)``
+
+    Parameters
+    ----------
+    user_db_model : :class:`msdss_users_api.models.UserDB`
+        The user database model. See :class:`msdss_users_api.models.UserDB`.
+    database : :class:`databases:databases.Database`
+        Async database object from ``databases``.
+    users : :class:`sqlalchemy:sqlalchemy.schema.Table`
+        SQLAlchemy users table. See :class:`msdss_users_api.models.UserTable`.
+    oauth_accounts : :class:`sqlalchemy:sqlalchemy.schema.Table` or None
+        SQLAlchemy OAuth accounts table.
+    user_cache : :class:`msdss_users_api.cache.UserCache` or None
+        Cache of users keyed by id. If ``None``, every lookup queries the database.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import databases
+
+        from msdss_base_database import Database
+        from msdss_users_api.adapters import UserDatabase
+        from msdss_users_api.cache import UserCache
+        from msdss_users_api.models import UserDB, UserTable
+
+        # Create async database
+        database_engine = Database()._connection
+        async_database = databases.Database(str(database_engine.url))
+
+        # Create a user db adapter with a cache
+        user_db = UserDatabase(UserDB, async_database, UserTable.__table__, user_cache=UserCache())
+    """
+    def __init__(
+        self,
+        user_db_model,
+        database,
+        users,
+        oauth_accounts=None,
+        user_cache=None):
+        super().__init__(user_db_model, database, users, oauth_accounts)
+        self.user_cache = user_cache
+
+    def _get_values(self, user):
+        """
+        Get the column values of a user, adding the normalized email if the users table has an ``email_normalized`` column.
+
+        Parameters
+        ----------
+        user : :class:`msdss_users_api.models.UserDB`
+            The user to get values for.
+
+        Returns
+        -------
+        dict
+            Column values of the user, without ``oauth_accounts``.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = user.dict(exclude={'oauth_accounts'})
+        if 'email_normalized' in self.users.c:
+            out['email_normalized'] = normalize_email(user.email)
+        return out
+
+    async def create(self, user):
+
+        # (UserDatabase_create_oauth) Use the default insert for users with oauth accounts
+        if hasattr(user, 'oauth_accounts'):
+            return await super().create(user)
+
+        # (UserDatabase_create_insert) Insert user with normalized email
+        await self.database.execute(self.users.insert(), self._get_values(user))
+        return user
+
+    async def get(self, id):
+
+        # (UserDatabase_get_cache) Return a copy of the cached user so callers can modify it
+        if self.user_cache is None:
+            return await super().get(id)
+        user = self.user_cache.get(id)
+        if user is not None:
+            return user.copy()
+
+        # (UserDatabase_get_db) Fetch and cache the user if no write happened during the fetch
+        generation = self.user_cache.get_generation()
+        out = await super().get(id)
+        if out is not None:
+            self.user_cache.set(id, out.copy(), generation=generation)
+        return out
+
+    async def get_by_email(self, email):
+        if 'email_normalized' not in self.users.c:
+            return await super().get_by_email(email)
+        query = self.users.select().where(self.users.c.email_normalized == normalize_email(email))
+        user = await self.database.fetch_one(query)
+        out = await self._make_user(user) if user else None
+        return out
+
+    async def get_page(
+        self,
+        limit=DEFAULT_USER_LIST_SETTINGS['limit'],
+        cursor=None,
+        is_active=None,
+        is_superuser=None,
+        is_verified=None,
+        email_prefix=None):
+        """
+        Get a page of users with keyset pagination, so that each page costs the same no matter how deep it is.
+
+        * Users are ordered by ``id``, or by ``email_normalized`` if ``email_prefix`` is set so that its index serves the prefix range
+        * Filters on ``is_active``, ``is_superuser``, and ``is_verified`` are served by the indexes added in migration 2 (see :data:`msdss_users_api.migrations.MIGRATIONS`)
+
+        Parameters
+        ----------
+        limit : int
+            Max number of users in the page.
+        cursor : str or None
+            Cursor returned with the previous page. If ``None``, the first page is returned.
+        is_active : bool or None
+            Only get users with this ``is_active`` value. If ``None``, do not filter on it.
+        is_superuser : bool or None
+            Only get users with this ``is_superuser`` value. If ``None``, do not filter on it.
+        is_verified : bool or None
+            Only get users with this ``is_verified`` value. If ``None``, do not filter on it.
+        email_prefix : str or None
+            Only get users with emails starting with this case insensitive prefix. If ``None``, do not filter on it.
+
+        Returns
+        -------
+        tuple
+            A list of :class:`msdss_users_api.models.UserDB` and the cursor of the next page, or ``None`` if there are no more users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+
+        # (UserDatabase_get_page_filter) Filter on flags and email range
+        table = self.users
+        key = 'email_normalized' if email_prefix else 'id'
+        query = table.select()
+        for column, value in (('is_active', is_active), ('is_superuser', is_superuser), ('is_verified', is_verified)):
+            if value is not None:
+                query = query.where(table.c[column] == value)
+        if email_prefix:
+            email_prefix = normalize_email(email_prefix)
+            query = query.where(table.c.email_normalized >= email_prefix).where(table.c.email_normalized < email_prefix + '\uffff')
+
+        # (UserDatabase_get_page_cursor) Continue after the last user of the previous page
+        if cursor:
+            cursor_key, cursor_value = _decode_cursor(cursor)
+            if cursor_key != key:
+                raise ValueError('Cursor does not match the email_prefix filter')
+            query = query.where(table.c[key] > (uuid.UUID(cursor_value) if key == 'id' else cursor_value))
+
+        # (UserDatabase_get_page_fetch) Fetch one more user than the limit to check for a next page
+        query = query.order_by(table.c[key]).limit(limit + 1)
+        rows = await self.database.fetch_all(query)
+        out = [await self._make_user(row) for row in rows[:limit]]
+        next_cursor = _encode_cursor(key, rows[limit - 1][key]) if len(rows) > limit else None
+        return out, next_cursor
+
+    async def update_many(
+        self,
+        values,
+        emails=None,
+        domain=None,
+        is_active=None,
+        is_superuser=None,
+        is_verified=None,
+        batch_size=DEFAULT_UPDATE_SETTINGS['batch_size'],
+        revocation=None,
+        refresh_token_db=None,
+        session_store=None):
+        """
+        Set ``is_active``, ``is_superuser``, or ``is_verified`` for all matching users with set-based updates in batches, so that each update only holds locks on a few rows.
+
+        * Each batch selects the ids of up to ``batch_size`` matching users whose values differ from ``values``, then updates them by primary key in one ``UPDATE``. Updated users no longer match, so batches repeat until none are left
+        * ``emails`` are read in chunks of ``batch_size`` and matched with the ``email_normalized`` index, so any number of emails can be given without holding them all in memory
+        * Updated users are invalidated in the ``user_cache`` if it is set
+        * If ``is_active`` is set to ``False``, the tokens, refresh tokens, and sessions of each batch of deactivated users are revoked after it is updated, as they would otherwise stay valid until they expire
+
+        Parameters
+        ----------
+        values : dict
+            Values to set, with keys ``is_active``, ``is_superuser``, or ``is_verified`` and bool values.
+        emails : iterable of str or None
+            Only update users with these case insensitive emails. If ``None``, do not filter on them.
+        domain : str or None
+            Only update users with emails in this case insensitive domain (e.g. ``example.com``). If ``None``, do not filter on it.
+        is_active : bool or None
+            Only update users with this ``is_active`` value. If ``None``, do not filter on it.
+        is_superuser : bool or None
+            Only update users with this ``is_superuser`` value. If ``None``, do not filter on it.
+        is_verified : bool or None
+            Only update users with this ``is_verified`` value. If ``None``, do not filter on it.
+        batch_size : int
+            Max number of users to update in each query.
+        revocation : :class:`msdss_users_api.revocation.RevocationList` or None
+            List of revoked tokens to revoke all tokens of deactivated users in. If ``None``, tokens stay valid until they expire.
+        refresh_token_db : :class:`msdss_users_api.adapters.RefreshTokenDatabase` or None
+            Refresh tokens to revoke all refresh tokens of deactivated users in. If ``None``, refresh tokens stay valid until they expire.
+        session_store : :class:`msdss_users_api.sessions.SessionStoreMixin` or None
+            Store of cookie sessions to delete all sessions of deactivated users from. If ``None``, sessions stay valid until they expire.
+
+        Returns
+        -------
+        int
+            Number of updated users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+
+        # (UserDatabase_update_many_values) Check values to set
+        table = self.users
+        if not values or any(k not in ('is_active', 'is_superuser', 'is_verified') for k in values):
+            raise ValueError('Values must set at least one of is_active, is_superuser, or is_verified')
+        values = {k: bool(v) for k, v in values.items()}
+
+        # (UserDatabase_update_many_filter) Filter on flags and domain, skipping users that already have the values
+        conditions = [sqlalchemy.or_(*[table.c[k] != v for k, v in values.items()])]
+        for column, value in (('is_active', is_active), ('is_superuser', is_superuser), ('is_verified', is_verified)):
+            if value is not None:
+                conditions.append(table.c[column] == value)
+        if domain:
+            conditions.append(table.c.email_normalized.endswith('@' + normalize_email(domain).lstrip('@'), autoescape=True))
+
+        # (UserDatabase_update_many_chunks) Split emails into chunks
+        if emails is None:
+            chunks = [None]
+        else:
+            emails = iter(emails)
+            chunks = iter(lambda: {normalize_email(email) for email in itertools.islice(emails, batch_size)}, set())
+
+        # (UserDatabase_update_many_revoke) Get objects to revoke deactivated users in
+        revokers = []
+        if values.get('is_active') is False:
+            if revocation is not None:
+                revokers.append(revocation.revoke_users)
+            if refresh_token_db is not None:
+                revokers.append(refresh_token_db.revoke_users)
+            if session_store is not None:
+                revokers.append(session_store.delete_users)
+
+        # (UserDatabase_update_many_run) Update batches of matching users by id
+        out = 0
+        for chunk in chunks:
+            chunk_conditions = conditions + ([table.c.email_normalized.in_(list(chunk))] if chunk is not None else [])
+            while True:
+                query = sqlalchemy.select([table.c.id]).where(sqlalchemy.and_(*chunk_conditions)).limit(batch_size)
+                ids = [row['id'] for row in await self.database.fetch_all(query)]
+                if ids:
+                    await self.database.execute(table.update().where(table.c.id.in_(ids)).values(**values))
+                    out += len(ids)
+                    if self.user_cache is not None:
+                        for id in ids:
+                            self.user_cache.invalidate(id)
+                    for revoke in revokers:
+                        await revoke(ids)
+                if len(ids) < batch_size:
+                    break
+        return out
+
+    async def update(self, user):
+
+        # (UserDatabase_update_write) Update user with normalized email, or with oauth accounts by default
+        if hasattr(user, 'oauth_accounts'):
+            out = await super().update(user)
+        else:
+            query = self.users.update().where(self.users.c.id == user.id).values(self._get_values(user))
+            await self.database.execute(query)
+            out = user
+
+        # (UserDatabase_update_cache) Invalidate cached user
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user.id)
+        return out
+
+    async def delete(self, user):
+        await super().delete(user)
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user.id)
\ No newline at end of file
@@ -0,0 +1,386 @@
+import contextvars
+import copy
+import jwt
+import secrets
+import time
+
+from fastapi import Request
+from fastapi_users.authentication import Authenticator, CookieAuthentication, JWTAuthentication
+from fastapi_users.jwt import decode_jwt, generate_jwt
+from fastapi_users.manager import UserNotExists
+from pydantic import UUID4
+
+from .defaults import *
+from .models import User
+
+_credentials = contextvars.ContextVar('msdss_users_credentials', default=None)
+_session_id = contextvars.ContextVar('msdss_users_session_id', default=None)
+
+def _record_credentials(scheme, name):
+    """
+    Copy a security scheme so that the credentials it reads are remembered for the request under the name of its backend.
+
+    * Every backend scheme is read for each authenticated request, but only backends before the one that authenticates the user are called,
+      so this lets the logout of a backend find its own token even if another backend authenticated the request
+
+    Parameters
+    ----------
+    scheme : :class:`fastapi:fastapi.security.base.SecurityBase`
+        Security scheme of the backend, such as :class:`fastapi:fastapi.security.OAuth2PasswordBearer` or :class:`fastapi:fastapi.security.APIKeyCookie`.
+    name : str
+        Name of the backend.
+
+    Returns
+    -------
+    :class:`fastapi:fastapi.security.base.SecurityBase`
+        Copy of ``scheme`` of the same class and OpenAPI model that also remembers credentials.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from fastapi.security import APIKeyCookie
+        from msdss_users_api.authentication import _record_credentials
+
+        scheme = _record_credentials(APIKeyCookie(name='fastapiusersauth', auto_error=False), 'cookie')
+        print(type(scheme).__mro__)
+    """
+    class RecordingScheme(type(scheme)):
+        async def __call__(self, request: Request):
+            out = await super().__call__(request)
+            _credentials.set(dict(_credentials.get() or {}, **{name: out}))
+            return out
+    out = copy.copy(scheme)
+    out.__class__ = RecordingScheme
+    return out
+
+class ClaimsAuthenticationMixin:
+    """
+    Mixin for JSON Web Token (JWT) based authentication backends that can carry user attributes as claims.
+
+    * If ``include_claims`` is ``True``, tokens also carry the user attributes in ``claims``
+    * If ``stateless`` is ``True``, tokens with all ``claims`` are trusted without a database lookup until they expire
+    * Tokens without claims are always checked against the database
+    * If ``metrics`` is set, token decoding is timed and token authentications are counted
+    * If ``revocation`` is set, tokens also carry an id (``jti``) and issue time (``iat``), revoked tokens are rejected even if stateless, and logging out revokes the token sent to that backend,
+      even if the request also carries a token of another backend. See :func:`msdss_users_api.authentication._record_credentials`
+
+    Attributes
+    ----------
+    claims : tuple(str)
+        User attributes to add to the token.
+    include_claims : bool
+        Whether to add ``claims`` to generated tokens or not.
+    metrics : :class:`msdss_users_api.metrics.Metrics` or None
+        Metrics to time token decoding and count token authentications in. If ``None``, nothing is recorded.
+    revocation : :class:`msdss_users_api.revocation.RevocationList` or None
+        List of revoked tokens to check tokens against. If ``None``, tokens are valid until they expire.
+    stateless : bool
+        Whether to build users from token claims instead of the database or not.
+    user_model : :class:`msdss_users_api.models.User`
+        Model used to build users from token claims.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    claims = ('email', 'is_active', 'is_superuser', 'is_verified')
+    include_claims = False
+    metrics = None
+    revocation = None
+    stateless = False
+    user_model = User
+
+    async def __call__(self, credentials, user_manager):
+        if credentials is None:
+            return None
+        out = await self._authenticate(credentials, user_manager)
+        if self.metrics:
+            self.metrics.authentication.inc(method='token', result='success' if out else 'failure')
+        return out
+
+    async def _authenticate(self, credentials, user_manager):
+
+        # (ClaimsAuthenticationMixin_authenticate_decode) Decode token once for both claims and database lookups
+        try:
+            data = self._decode_token(credentials)
+        except jwt.PyJWTError:
+            return None
+
+        # (ClaimsAuthenticationMixin_authenticate_revoked) Reject revoked tokens
+        if self.revocation is not None and await self.revocation.is_revoked(data):
+            return None
+
+        # (ClaimsAuthenticationMixin_authenticate_claims) Build user from signed claims without revalidating them if stateless
+        if self.stateless and all(k in data for k in self.claims):
+            try:
+                out = self.user_model.construct(
+                    id=UUID4(data['user_id']),
+                    **{k: data[k] for k in self.claims})
+            except (KeyError, TypeError, ValueError):
+                return None
+            return out
+
+        # (ClaimsAuthenticationMixin_authenticate_db) Check database for tokens without claims or if not stateless
+        user_id = data.get('user_id')
+        if user_id is None:
+            return None
+        try:
+            out = await user_manager.get(UUID4(user_id))
+        except (ValueError, UserNotExists):
+            return None
+        return out
+
+    def _decode_token(self, credentials):
+        if self.metrics:
+            with self.metrics.token_decode_duration.time(backend=self.name):
+                out = decode_jwt(credentials, self.secret, self.token_audience)
+        else:
+            out = decode_jwt(credentials, self.secret, self.token_audience)
+        return out
+
+    async def _generate_token(self, user):
+        data = {'user_id': str(user.id), 'aud': self.token_audience}
+        if self.include_claims:
+            data.update({k: getattr(user, k) for k in self.claims})
+        if self.revocation is not None:
+            data.update(jti=secrets.token_hex(16), iat=round(time.time(), 3))
+        out = generate_jwt(data, self.secret, self.lifetime_seconds)
+        return out
+
+    async def _revoke_token(self):
+        credentials = (_credentials.get() or {}).get(self.name)
+        if self.revocation is None or credentials is None:
+            return
+        try:
+            claims = self._decode_token(credentials)
+        except jwt.PyJWTError:
+            return
+        await self.revocation.revoke_token(claims)
+
+class ClaimsCookieAuthentication(ClaimsAuthenticationMixin, CookieAuthentication):
+    """
+    Cookie authentication that can carry user attributes as claims.
+
+    * Extends :class:`fastapi_users:fastapi_users.authentication.CookieAuthentication`
+    * See :class:`msdss_users_api.authentication.ClaimsAuthenticationMixin`
+
+    Parameters
+    ----------
+    include_claims : bool
+        Whether to add user attributes to generated tokens or not.
+    *args, **kwargs
+        Additional arguments passed to :class:`fastapi_users:fastapi_users.authentication.CookieAuthentication`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.authentication import ClaimsCookieAuthentication
+
+        cookie = ClaimsCookieAuthentication(secret='cookie-secret', include_claims=True) # CHANGE TO STRONG PHRASE
+    """
+    def __init__(self, *args, include_claims=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.include_claims = include_claims
+        self.scheme = _record_credentials(self.scheme, self.name)
+
+    async def get_logout_response(self, user, response, user_manager):
+        await self._revoke_token()
+        await super().get_logout_response(user, response, user_manager)
+
+class ClaimsJWTAuthentication(ClaimsAuthenticationMixin, JWTAuthentication):
+    """
+    JSON Web Token (JWT) authentication that can carry user attributes as claims.
+
+    * Extends :class:`fastapi_users:fastapi_users.authentication.JWTAuthentication`
+    * See :class:`msdss_users_api.authentication.ClaimsAuthenticationMixin`
+
+    * If ``refresh_token_db`` is set, login responses also include an opaque ``refresh_token``
+    * If ``revocation`` is set, ``logout`` can be enabled to revoke the token of the request
+
+    Parameters
+    ----------
+    include_claims : bool
+        Whether to add user attributes to generated tokens or not.
+    refresh_token_db : :class:`msdss_users_api.adapters.RefreshTokenDatabase` or None
+        Adapter to create refresh tokens at login with. If ``None``, logins only return an access token.
+    *args, **kwargs
+        Additional arguments passed to :class:`fastapi_users:fastapi_users.authentication.JWTAuthentication`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.authentication import ClaimsJWTAuthentication
+
+        jwt = ClaimsJWTAuthentication(secret='jwt-secret', lifetime_seconds=900, include_claims=True) # CHANGE TO STRONG PHRASE
+    """
+    def __init__(self, *args, include_claims=False, refresh_token_db=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.include_claims = include_claims
+        self.scheme = _record_credentials(self.scheme, self.name)
+        self.refresh_token_db = refresh_token_db
+
+    async def get_login_response(self, user, response, user_manager):
+        out = await super().get_login_response(user, response, user_manager)
+        if self.refresh_token_db is not None:
+            out['refresh_token'] = await self.refresh_token_db.create(user.id)
+        return out
+
+    async def get_logout_response(self, user, response, user_manager):
+        await self._revoke_token()
+
+class SessionCookieAuthentication(CookieAuthentication):
+    """
+    Cookie authentication with server-side sessions, where the cookie only holds a short opaque session id instead of a JSON Web Token (JWT).
+
+    * Extends :class:`fastapi_users:fastapi_users.authentication.CookieAuthentication`
+    * Checking a cookie is one lookup in ``store`` instead of a signature check, and cookies are much smaller than tokens
+    * Logging out deletes the session, so a stolen cookie stops working immediately instead of when it expires. Use the ``delete_user`` method of ``store`` to log out all sessions of a user
+    * If ``metrics`` is set, session authentications are counted
+
+    Parameters
+    ----------
+    store : :class:`msdss_users_api.sessions.MemorySessionStore` or :class:`msdss_users_api.sessions.SQLSessionStore` or :class:`msdss_users_api.sessions.KeyValueSessionStore`
+        Store of the sessions. See :mod:`msdss_users_api.sessions`.
+    secret : str or None
+        Unused, as session ids are not signed. Accepted so that cookie settings can be shared with :class:`msdss_users_api.authentication.ClaimsCookieAuthentication`.
+    lifetime_seconds : int or None
+        Number of seconds sessions and their cookies are valid for. If ``None``, the cookie lasts until the browser is closed and the session lasts for the default cookie lifetime.
+    *args, **kwargs
+        Additional arguments passed to :class:`fastapi_users:fastapi_users.authentication.CookieAuthentication`.
+
+    Attributes
+    ----------
+    metrics : :class:`msdss_users_api.metrics.Metrics` or None
+        Metrics to count session authentications in. If ``None``, nothing is recorded.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.authentication import SessionCookieAuthentication
+        from msdss_users_api.sessions import MemorySessionStore
+
+        cookie = SessionCookieAuthentication(MemorySessionStore(), lifetime_seconds=86400)
+    """
+    metrics = None
+
+    def __init__(self, store, secret=None, lifetime_seconds=DEFAULT_COOKIE_SETTINGS['lifetime_seconds'], *args, **kwargs):
+        super().__init__(secret, lifetime_seconds, *args, **kwargs)
+        self.store = store
+
+    async def __call__(self, credentials, user_manager):
+        if credentials is None:
+            return None
+        out = await self._authenticate(credentials, user_manager)
+        if self.metrics:
+            self.metrics.authentication.inc(method='session', result='success' if out else 'failure')
+        return out
+
+    async def _authenticate(self, credentials, user_manager):
+
+        # (SessionCookieAuthentication_authenticate_session) Look up session
+        user_id = await self.store.get(credentials)
+        if user_id is None:
+            return None
+
+        # (SessionCookieAuthentication_authenticate_user) Get user and remember session for logout
+        try:
+            out = await user_manager.get(user_id)
+        except UserNotExists:
+            return None
+        _session_id.set(credentials)
+        return out
+
+    async def get_login_response(self, user, response, user_manager):
+        session_id = await self.store.create(user.id, self.lifetime_seconds or DEFAULT_COOKIE_SETTINGS['lifetime_seconds'])
+        response.set_cookie(
+            self.cookie_name,
+            session_id,
+            max_age=self.lifetime_seconds,
+            path=self.cookie_path,
+            domain=self.cookie_domain,
+            secure=self.cookie_secure,
+            httponly=self.cookie_httponly,
+            samesite=self.cookie_samesite
+        )
+
+    async def get_logout_response(self, user, response, user_manager):
+        session_id = _session_id.get()
+        if session_id is not None:
+            await self.store.delete(session_id)
+        await super().get_logout_response(user, response, user_manager)
+
+def create_stateless_authenticator(backends, get_user_manager, user_model=User):
+    """
+    Create an authenticator that trusts user attributes in token claims instead of looking users up in the database.
+
+    Parameters
+    ----------
+    backends : list(:class:`fastapi_users:fastapi_users.authentication.BaseAuthentication`)
+        Authentication backends. Copies of backends extending :class:`msdss_users_api.authentication.ClaimsAuthenticationMixin` are made stateless,
+        while other backends are used as is.
+    get_user_manager : func
+        Function for the user manager dependency. See :func:`msdss_users_api.tools.create_user_manager_func`.
+    user_model : :class:`msdss_users_api.models.User`
+        Model used to build users from token claims.
+
+    Returns
+    -------
+    :class:`fastapi_users:fastapi_users.authentication.Authenticator`
+        Authenticator with stateless backends. Use its ``current_user`` method to get user dependencies.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.authentication import *
+        from msdss_users_api.tools import create_fastapi_users_objects
+
+        # Create backends that add claims to tokens
+        jwt = ClaimsJWTAuthentication(secret='jwt-secret', lifetime_seconds=900, include_claims=True) # CHANGE TO STRONG PHRASE
+        fastapi_users_objects = create_fastapi_users_objects(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret', # CHANGE TO STRONG PHRASE
+                verification_token_secret='verify-secret' # CHANGE TO STRONG PHRASE
+            ),
+            enable_cookie=False,
+            jwt=jwt
+        )
+
+        # Create a stateless authenticator
+        get_user_manager = fastapi_users_objects['dependencies']['get_user_manager']
+        authenticator = create_stateless_authenticator([jwt], get_user_manager)
+        current_active_user = authenticator.current_user(active=True)
+    """
+    stateless_backends = []
+    for backend in backends:
+        if isinstance(backend, ClaimsAuthenticationMixin):
+            backend = copy.copy(backend)
+            backend.stateless = True
+            backend.user_model = user_model
+        stateless_backends.append(backend)
+    out = Authenticator(stateless_backends, get_user_manager)
+    return out
\ No newline at end of file
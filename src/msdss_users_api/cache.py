@@ -0,0 +1,276 @@
+import collections
+import threading
+import time
+
+from .defaults import *
+
+class UserCache:
+    """
+    In-process cache of users keyed by user id with a time to live (TTL) and a least recently used (LRU) size limit.
+
+    * Entries are invalidated by :class:`msdss_users_api.adapters.UserDatabase` whenever a user is updated or deleted
+    * The cache is local to each process, so writes from other processes are only seen after ``ttl`` seconds
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of users to keep. The least recently used users are evicted first.
+    ttl : float
+        Number of seconds a cached user is valid for.
+
+    Attributes
+    ----------
+    max_size : int
+        Maximum number of users from parameter ``max_size``.
+    ttl : float
+        Time to live in seconds from parameter ``ttl``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.cache import UserCache
+        from pprint import pprint
+
+        cache = UserCache(max_size=2, ttl=60)
+
+        # Set and get users
+        cache.set('id-a', 'user-a')
+        cache.set('id-b', 'user-b')
+        cache.get('id-a')
+        cache.get('id-c')
+
+        # Evict least recently used
+        cache.set('id-c', 'user-c')
+
+        # Invalidate after a write
+        cache.invalidate('id-a')
+        pprint(cache.get_stats())
+    """
+    def __init__(
+        self,
+        max_size=DEFAULT_USER_CACHE_SETTINGS['max_size'],
+        ttl=DEFAULT_USER_CACHE_SETTINGS['ttl']):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def clear(self):
+        """
+        Remove all cached users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.cache import UserCache
+
+            cache = UserCache()
+            cache.set('id-a', 'user-a')
+            cache.clear()
+        """
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def get(self, key):
+        """
+        Get a cached user.
+
+        Parameters
+        ----------
+        key : str or :class:`uuid.UUID`
+            Id of the user.
+
+        Returns
+        -------
+        any or None
+            The cached user or ``None`` if it is not cached or has expired.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.cache import UserCache
+
+            cache = UserCache()
+            cache.set('id-a', 'user-a')
+            print(cache.get('id-a'))
+        """
+        key = str(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def get_generation(self):
+        """
+        Get a counter that changes on every invalidation.
+
+        Pass it to :meth:`msdss_users_api.cache.UserCache.set` so that a user read from the database before a concurrent write is not cached.
+
+        Returns
+        -------
+        int
+            The current invalidation generation.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.cache import UserCache
+
+            cache = UserCache()
+            generation = cache.get_generation()
+            cache.invalidate('id-a')
+            cache.set('id-a', 'stale-user-a', generation=generation)
+            print(cache.get('id-a'))
+        """
+        return self._generation
+
+    def get_stats(self):
+        """
+        Get cache statistics.
+
+        Returns
+        -------
+        dict
+            A dictionary with the following keys:
+
+            * ``size`` (int): number of cached users
+            * ``max_size`` (int): maximum number of cached users
+            * ``hits`` (int): number of lookups served from the cache
+            * ``misses`` (int): number of lookups not in the cache or expired
+            * ``hit_ratio`` (float): ratio of hits to all lookups
+            * ``evictions`` (int): number of users removed for the size limit
+            * ``expirations`` (int): number of users removed after their TTL
+            * ``invalidations`` (int): number of users removed after a write
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.cache import UserCache
+            from pprint import pprint
+
+            cache = UserCache()
+            cache.get('id-a')
+            pprint(cache.get_stats())
+        """
+        lookups = self._hits + self._misses
+        out = dict(
+            size=len(self._entries),
+            max_size=self.max_size,
+            hits=self._hits,
+            misses=self._misses,
+            hit_ratio=self._hits / lookups if lookups else 0.0,
+            evictions=self._evictions,
+            expirations=self._expirations,
+            invalidations=self._invalidations
+        )
+        return out
+
+    def invalidate(self, key):
+        """
+        Remove a cached user after it was written to.
+
+        Parameters
+        ----------
+        key : str or :class:`uuid.UUID`
+            Id of the user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.cache import UserCache
+
+            cache = UserCache()
+            cache.set('id-a', 'user-a')
+            cache.invalidate('id-a')
+            print(cache.get('id-a'))
+        """
+        key = str(key)
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def set(self, key, value, generation=None):
+        """
+        Cache a user.
+
+        Parameters
+        ----------
+        key : str or :class:`uuid.UUID`
+            Id of the user.
+        value : any
+            User to cache.
+        generation : int or None
+            Value of :meth:`msdss_users_api.cache.UserCache.get_generation` from before ``value`` was read.
+            If any invalidation happened since then, ``value`` may be stale and is not cached. If ``None``, ``value`` is always cached.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.cache import UserCache
+
+            cache = UserCache()
+            cache.set('id-a', 'user-a')
+            print(cache.get('id-a'))
+        """
+        key = str(key)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
\ No newline at end of file
@@ -1,13 +1,11 @@
 import argparse
 import ast
-import asyncio
+import contextlib
+import io
+import shlex
+import sys
 
 from getpass import getpass
-from msdss_base_database import Database, DatabaseDotEnv
-
-from .core import *
-from .env import *
-from .tools import *
 
 def _get_parser():
     """
@@ -49,6 +47,39 @@ def _get_parser():
     get_parser = subparsers.add_parser('get', help='get user attributes')
     get_parser.add_argument('email', type=str, help='email for user')
 
+    # (_get_parser_export) Add export command
+    export_parser = subparsers.add_parser('export', help='export users to a csv, jsonl, or parquet file')
+    export_parser.add_argument('--output', dest='path', type=str, default='-', help='path of file to write, defaults to stdout')
+    export_parser.add_argument('--format', type=str, default=None, choices=['csv', 'jsonl', 'parquet'], help='format of file, defaults to file extension or csv')
+    export_parser.add_argument('--batch_size', type=int, default=1000, help='number of users to fetch and write at a time')
+    export_parser.add_argument('--include_hashed_password', dest='include_hashed_password', action='store_true', help='include hashed passwords')
+
+    # (_get_parser_import) Add import command
+    import_parser = subparsers.add_parser('import', help='import users from a csv or jsonl file')
+    import_parser.add_argument('path', type=str, help='path of file with columns email, password or hashed_password, and optionally is_active, is_superuser, is_verified, or - for stdin')
+    import_parser.add_argument('--format', type=str, default=None, choices=['csv', 'jsonl'], help='format of file, defaults to file extension')
+    import_parser.add_argument('--batch_size', type=int, default=1000, help='number of users to hash and insert at a time')
+    import_parser.add_argument('--hash_workers', type=int, default=None, help='number of processes for hashing passwords, defaults to number of cpus')
+
+    # (_get_parser_migrate) Add migrate command
+    migrate_parser = subparsers.add_parser('migrate', help='apply pending schema migrations to the users tables')
+    migrate_parser.add_argument('--check', dest='check', action='store_true', help='only show the schema version and pending migrations')
+
+    # (_get_parser_cleanup) Add cleanup command
+    cleanup_parser = subparsers.add_parser('cleanup', help='delete expired refresh tokens')
+    cleanup_parser.add_argument('--batch_size', type=int, default=1000, help='number of tokens to delete in each query')
+
+    # (_get_parser_tune_hash) Add tune-hash command
+    tune_hash_parser = subparsers.add_parser('tune-hash', help='benchmark password hashing on this cpu and recommend a cost factor')
+    tune_hash_parser.add_argument('--hasher', type=str, default='bcrypt', choices=['bcrypt', 'argon2'], help='password hashing scheme to tune')
+    tune_hash_parser.add_argument('--memory_cost', type=int, default=19456, help='KiB of memory for each password hash with --hasher argon2')
+    tune_hash_parser.add_argument('--parallelism', type=int, default=1, help='threads for each password hash with --hasher argon2')
+    tune_hash_parser.add_argument('--target', type=float, default=0.05, help='target secs to verify a password')
+    tune_hash_parser.add_argument('--min_rounds', type=int, default=None, help='lowest cost factor to time and recommend, defaults to 4 for bcrypt and 1 for argon2')
+    tune_hash_parser.add_argument('--max_rounds', type=int, default=20, help='highest cost factor to time')
+    tune_hash_parser.add_argument('--samples', type=int, default=3, help='number of verifications to time for each cost factor')
+    tune_hash_parser.add_argument('--write', dest='write', action='store_true', help='save the hasher and recommended cost factor to env vars MSDSS_USERS_HASHER and MSDSS_USERS_HASH_ROUNDS in the .env file')
+
     # (_get_parser_delete) Add delete command
     delete_parser = subparsers.add_parser('delete', help='delete a user')
     delete_parser.add_argument('email', type=str, help='email of user to delete')
@@ -65,17 +96,77 @@ def _get_parser():
     update_parser.add_argument('--is_superuser', type=bool, default=None, help='set is_superuser attribute')
     update_parser.add_argument('--is_verified', type=bool, default=None, help='set is_verified attribute')
 
+    # (_get_parser_update_many) Add update-many command
+    update_many_parser = subparsers.add_parser('update-many', help='set is_active, is_superuser, or is_verified for many users with batched set-based updates')
+    update_many_parser.add_argument('--is_active', type=str, default=None, choices=['true', 'false'], help='set is_active attribute')
+    update_many_parser.add_argument('--is_superuser', type=str, default=None, choices=['true', 'false'], help='set is_superuser attribute')
+    update_many_parser.add_argument('--is_verified', type=str, default=None, choices=['true', 'false'], help='set is_verified attribute')
+    update_many_parser.add_argument('--emails', type=str, default=None, help='only update users in a file with one email per line, or - for stdin')
+    update_many_parser.add_argument('--domain', type=str, default=None, help='only update users with emails in this domain (e.g. example.com)')
+    update_many_parser.add_argument('--where_is_active', type=str, default=None, choices=['true', 'false'], help='only update users with this is_active attribute')
+    update_many_parser.add_argument('--where_is_superuser', type=str, default=None, choices=['true', 'false'], help='only update users with this is_superuser attribute')
+    update_many_parser.add_argument('--where_is_verified', type=str, default=None, choices=['true', 'false'], help='only update users with this is_verified attribute')
+    update_many_parser.add_argument('--batch_size', type=int, default=1000, help='max number of users to update in each query')
+
+    # (_get_parser_batch) Add batch command
+    batch_parser = subparsers.add_parser('batch', help='run register, get, update, reset, and delete commands from a file with one database connection')
+    batch_parser.add_argument('path', type=str, nargs='?', default='-', help='path of file with one command per line (e.g. register test@example.com msdss123), defaults to stdin')
+    batch_parser.add_argument('--concurrency', type=int, default=1, help='number of commands to run at the same time')
+    batch_parser.add_argument('--hash_workers', type=int, default=None, help='number of processes for hashing passwords if concurrency is more than 1, defaults to number of cpus')
+
     # (_get_parser_start) Add start command
     start_parser = subparsers.add_parser('start', help='start a users api server')
     start_parser.add_argument('--host', type=str, default='127.0.0.1', help='address to host server')
     start_parser.add_argument('--port', type=int, default=8000, help='port to host server')
     start_parser.add_argument('--log_level', type=str, default='info', help='level of verbose messages to display')
+    start_parser.add_argument('--workers', type=int, default=1, help='number of worker processes, each with its own connection and hashing pools')
+    start_parser.add_argument('--loop', type=str, default='auto', choices=['auto', 'asyncio', 'uvloop'], help='event loop, uvloop requires pip install msdss-users-api[server]')
+    start_parser.add_argument('--http', type=str, default='auto', choices=['auto', 'h11', 'httptools'], help='http parser, httptools requires pip install msdss-users-api[server]')
+    start_parser.add_argument('--timeout_keep_alive', type=int, default=5, help='secs to keep idle client connections open')
+    start_parser.add_argument('--backlog', type=int, default=2048, help='max number of connections waiting to be accepted')
+    start_parser.add_argument('--limit_max_requests', type=int, default=None, help='gracefully restart each worker after this many requests')
+    start_parser.add_argument('--limit_max_requests_jitter', type=int, default=0, help='max random number of requests added to --limit_max_requests for each worker (requires uvicorn>=0.41)')
+    start_parser.add_argument('--timeout_graceful_shutdown', type=int, default=30, help='secs to wait for open requests when stopping a worker')
     start_parser.add_argument('--set', metavar=('ROUTE', 'KEY', 'VALUE'), nargs=3, action='append', help='set route settings, where ROUTE is the route name (jwt, cookie, register etc), KEY is the setting name (e.g. path, _enable, etc), and VALUE is value for the setting')
     start_parser.add_argument('--jwt_lifetime', type=int, default=15 * 60, help='expiry time in secs for JWTs')
     start_parser.add_argument('--cookie_lifetime', type=int, default=30 * 86400, help='expiry time in secs for cookies')
+    start_parser.add_argument('--stateless', dest='stateless', action='store_true', help='trust user attributes in signed tokens instead of looking up users for each request')
+    start_parser.add_argument('--refresh_tokens', dest='refresh_tokens', action='store_true', help='return rotating refresh tokens from jwt logins, exchanged at /auth/jwt/refresh-token')
+    start_parser.add_argument('--refresh_token_lifetime', type=int, default=30 * 86400, help='expiry time in secs for --refresh_tokens')
+    start_parser.add_argument('--sessions', type=str, default=None, choices=['memory', 'sql', 'kv'], help='store cookie sessions server-side in memory, the users database, or a local key-value file shared by workers')
+    start_parser.add_argument('--session_path', type=str, default='./msdss_users_sessions.db', help='path of the key-value file for --sessions kv')
+    start_parser.add_argument('--revocation', dest='revocation', action='store_true', help='revoke tokens on logout and password changes, checked with in-memory bloom filters')
+    start_parser.add_argument('--revocation_sync_interval', type=float, default=5, help='secs between loading revocations of other workers for --revocation')
+    start_parser.add_argument('--hash_executor', type=str, default=None, choices=['thread', 'process'], help='hash passwords in a thread or process pool instead of the event loop')
+    start_parser.add_argument('--hash_workers', type=int, default=None, help='number of workers for --hash_executor, defaults to number of cpus')
+    start_parser.add_argument('--hash_rounds', type=int, default=None, help='cost factor of password hashes, rehashing other passwords at login, defaults to env var MSDSS_USERS_HASH_ROUNDS')
+    start_parser.add_argument('--hasher', type=str, default=None, choices=['bcrypt', 'argon2'], help='password hashing scheme, verifying both and rehashing others at login, defaults to env var MSDSS_USERS_HASHER or bcrypt')
+    start_parser.add_argument('--hash_memory_cost', type=int, default=None, help='KiB of memory for each password hash with --hasher argon2')
+    start_parser.add_argument('--hash_parallelism', type=int, default=None, help='threads for each password hash with --hasher argon2')
+    start_parser.add_argument('--user_cache_size', type=int, default=0, help='max number of authenticated users to cache in memory, 0 to disable')
+    start_parser.add_argument('--user_cache_ttl', type=float, default=60, help='expiry time in secs for cached users')
+    start_parser.add_argument('--throttle', dest='throttle', action='store_true', help='limit login attempts for each ip address and email before verifying passwords')
+    start_parser.add_argument('--throttle_ip_rate', type=float, default=1.0, help='login attempts each ip address regains per sec for --throttle, 0 to not limit ip addresses')
+    start_parser.add_argument('--throttle_ip_capacity', type=float, default=20, help='login attempts each ip address can make at once for --throttle')
+    start_parser.add_argument('--throttle_email_rate', type=float, default=0.1, help='login attempts each email regains per sec for --throttle, 0 to not limit emails')
+    start_parser.add_argument('--throttle_email_capacity', type=float, default=10, help='login attempts each email can make at once for --throttle')
+    start_parser.add_argument('--throttle_redis', type=str, default=None, help='redis url to share --throttle limits between workers, requires pip install msdss-users-api[redis]')
+    start_parser.add_argument('--fast_responses', dest='fast_responses', action='store_true', help='encode users responses with orjson without validating them again, requires pip install msdss-users-api[fast]')
+    start_parser.add_argument('--no_migrate', dest='migrate', action='store_false', help='fail instead of applying pending schema migrations at startup')
+    start_parser.add_argument('--db_backend', dest='backend', type=str, default='databases', choices=['databases', 'sqlalchemy'], help='run queries with databases, or queries and schema changes with one async sqlalchemy engine')
+    start_parser.add_argument('--pool_min_size', type=int, default=None, help='min number of database connections, opened at startup')
+    start_parser.add_argument('--pool_max_size', type=int, default=None, help='max number of database connections')
+    start_parser.add_argument('--pool_acquire_timeout', type=float, default=None, help='secs to wait for a free database connection')
+    start_parser.add_argument('--pool_recycle', type=float, default=None, help='secs after which database connections are replaced')
+    start_parser.add_argument('--pool_statement_cache_size', type=int, default=None, help='number of prepared statements cached per database connection')
+    start_parser.add_argument('--no_pool_warm_up', dest='pool_warm_up', action='store_false', help='do not open database connections at startup')
+    start_parser.add_argument('--metrics', dest='metrics', action='store_true', help='serve request latency, hashing, token, query, pool, and login metrics in prometheus text format')
+    start_parser.add_argument('--metrics_path', type=str, default='/metrics', help='path of the route serving --metrics')
+    start_parser.add_argument('--profiling', dest='profiling', action='store_true', help='profile requests with header X-Profile set to cprofile, tracemalloc, or tracemalloc-stop from superusers or with header X-Profile-Secret set to env var MSDSS_USERS_PROFILE_SECRET')
+    start_parser.add_argument('--profile_dir', type=str, default=None, help='folder to store --profiling reports in instead of returning them')
 
     # (_get_parser_file_key) Add file and key arguments to all commands
-    for p in [parser, register_parser, delete_parser, update_parser, get_parser, reset_parser, start_parser]:
+    for p in [parser, register_parser, delete_parser, update_parser, update_many_parser, get_parser, export_parser, import_parser, migrate_parser, cleanup_parser, tune_hash_parser, reset_parser, batch_parser, start_parser]:
         p.add_argument('--env_file', type=str, default='./.env', help='path of .env file')
         p.add_argument('--key_path', type=str, default=None, help='path of key file')
     
@@ -155,6 +246,130 @@ def _prompt_password():
         raise ValueError('Passwords do not match')
     return password
 
+async def _run_batch(path='-', concurrency=1, user_db_context_kwargs={}, user_manager_context_kwargs={}):
+    """
+    Runs ``msdss-users`` commands from a file in one event loop with one user manager and database connection.
+
+    * Each line is a ``register``, ``get``, ``update``, ``reset``, or ``delete`` command with the same arguments as the command line, and ``#`` starts a comment
+    * Passwords must be given for ``register`` and ``reset`` as they are not prompted for
+    * Each command prints its own result line, and failed commands print their line number and error to stderr
+    * Concurrent commands share the connection, so only password hashing and printing run at the same time
+    * Commands for the same email, in any case, run in the order of their lines even if they are concurrent
+
+    Parameters
+    ----------
+    path : str
+        Path of the file with commands, or ``-`` to read from standard input.
+    concurrency : int
+        Number of commands to run at the same time.
+    user_db_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+    user_manager_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+
+    Returns
+    -------
+    dict
+        Number of commands that succeeded in key ``succeeded`` and that failed in key ``failed``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.cli import _run_batch
+
+        # Create user manager secrets
+        kwargs = dict(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret',
+                verification_token_secret='verification-secret'
+            )
+        )
+
+        # Write and run commands
+        with open('commands.txt', 'w') as f:
+            f.write('register test@example.com msdss123\\n')
+            f.write('update test@example.com --is_verified True\\n')
+            f.write('delete test@example.com\\n')
+        results = await _run_batch('commands.txt', user_manager_context_kwargs=kwargs)
+    """
+    import asyncio
+    from .adapters import normalize_email
+    from .tools import _get_user_manager, delete_user, get_user, register_user, reset_user_password, update_user
+
+    # (_run_batch_setup) Setup commands, parser, and results
+    commands = dict(register=register_user, get=get_user, update=update_user, reset=reset_user_password, delete=delete_user)
+    parser = _get_parser()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    last_tasks = {}
+    out = dict(succeeded=0, failed=0)
+
+    # (_run_batch_fail) Count and print failures
+    def fail(line, error):
+        out['failed'] += 1
+        print(f'Line {line} failed: {error}', file=sys.stderr)
+
+    # (_run_batch_command) Run a command with the shared user manager
+    async def run_command(line, command, kwargs, user_manager, previous=None):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await commands[command](user_manager=user_manager, **kwargs)
+            out['succeeded'] += 1
+        except Exception as e:
+            fail(line, e)
+        finally:
+            semaphore.release()
+
+    # (_run_batch_run) Hold one connection for all commands, which concurrent tasks inherit
+    async with _get_user_manager(None, user_db_context_kwargs, user_manager_context_kwargs) as user_manager:
+        async with user_manager.user_db.database.connection():
+            with (contextlib.nullcontext(sys.stdin) if path == '-' else open(path, encoding='utf-8')) as f:
+                for line, text in enumerate(f, start=1):
+
+                    # (_run_batch_run_parse) Parse the line as a command
+                    try:
+                        args = shlex.split(text, comments=True)
+                        if not args:
+                            continue
+                        with contextlib.redirect_stderr(io.StringIO()):
+                            kwargs = vars(parser.parse_args(args))
+                    except (SystemExit, ValueError):
+                        fail(line, f'invalid command {text.strip()}')
+                        continue
+                    command = kwargs.pop('command')
+                    kwargs.pop('env_file')
+                    kwargs.pop('key_path')
+                    if command not in commands:
+                        fail(line, f'command {command} is not one of {", ".join(commands)}')
+                        continue
+                    if command in ('register', 'reset') and not (kwargs['email'] and kwargs['password']):
+                        fail(line, f'{command} requires an email and password')
+                        continue
+                    if command == 'get':
+                        kwargs['show'] = True
+                    if command == 'update':
+                        kwargs = {k:v for k, v in kwargs.items() if v}
+
+                    # (_run_batch_run_task) Run the command once there is room, after earlier commands for the same email
+                    await semaphore.acquire()
+                    email = normalize_email(kwargs['email'])
+                    task = asyncio.create_task(run_command(line, command, kwargs, user_manager, previous=last_tasks.get(email)))
+                    tasks.add(task)
+                    last_tasks[email] = task
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda t, email=email: last_tasks.pop(email) if last_tasks.get(email) is t else None)
+            await asyncio.gather(*tasks)
+
+    # (_run_batch_return) Show and return summary
+    print(f"Batch commands succeeded {out['succeeded']}, failed {out['failed']}")
+    return out
+
 def run():
     """
     Runs the ``msdss-users`` command.
@@ -187,6 +402,11 @@ def run():
 
     >>> msdss-users update test@example.com --is_verified True
 
+    Deactivate all users of a domain, or verify users in a file of emails, in batches:
+
+    >>> msdss-users update-many --is_active false --domain example.com
+    >>> msdss-users update-many --is_verified true --emails emails.txt
+
     Reset user password:
 
     >>> msdss-users reset test@example.com
@@ -195,9 +415,41 @@ def run():
 
     >>> msdss-users delete test@example.com
 
+    Import users from a csv or jsonl file:
+
+    >>> msdss-users import users.csv
+
+    Export users to a csv, jsonl, or parquet file:
+
+    >>> msdss-users export --output users.csv
+
+    Apply pending schema migrations:
+
+    >>> msdss-users migrate
+
+    Delete expired refresh tokens, such as from a scheduled job:
+
+    >>> msdss-users cleanup
+
+    Benchmark password hashing and save the cost factor meeting a 50 ms verify time to the .env file:
+
+    >>> msdss-users tune-hash --target 0.05 --write
+
+    Tune argon2id with 64 MiB of memory for each hash instead:
+
+    >>> msdss-users tune-hash --hasher argon2 --memory_cost 65536 --write
+
+    Run many commands from a file with one database connection:
+
+    >>> msdss-users batch commands.txt
+
     Start an API server:
 
     >>> msdss-users start
+
+    Start an API server with 4 worker processes on uvloop and httptools:
+
+    >>> msdss-users start --workers 4 --loop uvloop --http httptools
     """
 
     # (run_kwargs) Get arguments and command
@@ -211,9 +463,16 @@ def run():
         key_path=kwargs.pop('key_path')
     )
 
-    # (run_env_create) Create env objects
+    # (run_env_create) Create env objects, importing modules only after parsing so that help is fast
+    import asyncio
+    from .env import UsersDotEnv
     users_env = UsersDotEnv(**env_kwargs)
-    database = Database(env=DatabaseDotEnv(**env_kwargs))
+
+    # (run_database) Connect to the database only for commands that use it, as start creates its own in each worker and tune-hash only hashes
+    database = None
+    if command in ('register', 'get', 'export', 'import', 'migrate', 'cleanup', 'batch', 'delete', 'reset', 'update', 'update-many'):
+        from msdss_base_database import Database, DatabaseDotEnv
+        database = Database(env=DatabaseDotEnv(**env_kwargs))
 
     # (run_context) Create context args
     user_db_context_kwargs = dict(database=database)
@@ -223,6 +482,7 @@ def run():
     if command == 'register':
 
         # (run_command_register) Execute user register
+        from .tools import register_user
         kwargs['email'] = kwargs['email'] if kwargs['email'] else input('Email: ')
         kwargs['password'] = kwargs['password'] if kwargs['password'] else _prompt_password()
         asyncio.run(register_user(
@@ -234,6 +494,7 @@ def run():
     elif command == 'get':
 
         # (run_command_get) Execute user get
+        from .tools import get_user
         asyncio.run(get_user(
             show=True,
             user_db_context_kwargs=user_db_context_kwargs,
@@ -241,9 +502,105 @@ def run():
             **kwargs
         ))
 
+    elif command == 'export':
+
+        # (run_command_export) Execute user export
+        from .tools import export_users
+        asyncio.run(export_users(
+            user_db_context_kwargs=user_db_context_kwargs,
+            **kwargs
+        ))
+
+    elif command == 'import':
+
+        # (run_command_import) Execute user import
+        from .hashing import PasswordExecutor
+        from .tools import _get_env_hash_settings, import_users
+        if users_env.exists():
+            users_env.load()
+        hash_workers = kwargs.pop('hash_workers')
+        password_executor = PasswordExecutor('process', max_workers=hash_workers, hash_settings=_get_env_hash_settings(users_env))
+        try:
+            asyncio.run(import_users(
+                password_executor=password_executor,
+                user_db_context_kwargs=user_db_context_kwargs,
+                **kwargs
+            ))
+        finally:
+            password_executor.shutdown()
+
+    elif command == 'migrate':
+
+        # (run_command_migrate) Execute schema migrations
+        from .migrations import get_pending_migrations, get_schema_version, migrate_schema
+        database_engine = database._connection
+        print(f'Schema version {get_schema_version(database_engine)}')
+        if kwargs['check']:
+            for migration in get_pending_migrations(database_engine):
+                print(f'Pending migration {migration["version"]}: {migration["description"]}')
+        else:
+            applied = migrate_schema(database_engine, show=True)
+            print(f'Applied {len(applied)} migrations')
+
+    elif command == 'cleanup':
+
+        # (run_command_cleanup) Delete expired refresh tokens
+        from .tools import delete_expired_refresh_tokens
+        asyncio.run(delete_expired_refresh_tokens(
+            user_db_context_kwargs=user_db_context_kwargs,
+            **kwargs
+        ))
+
+    elif command == 'tune-hash':
+
+        # (run_command_tune_hash) Benchmark hash cost factors and save the recommendation if needed
+        from msdss_base_dotenv.tools import save_env_file, set_env_var
+        from .hashing import create_hash_settings, tune_hash_rounds
+        write = kwargs.pop('write')
+        hasher = kwargs.pop('hasher')
+        hasher_settings = dict(memory_cost=kwargs.pop('memory_cost'), parallelism=kwargs.pop('parallelism'))
+        hasher_settings = hasher_settings if hasher == 'argon2' else {}
+        kwargs['min_rounds'] = kwargs['min_rounds'] if kwargs['min_rounds'] is not None else 1 if hasher == 'argon2' else 4
+        result = tune_hash_rounds(hash_settings=create_hash_settings(hasher, **hasher_settings), **kwargs)
+        for rounds, seconds in result['timings'].items():
+            print(f'Rounds {rounds}: {seconds:.4f} secs')
+        print(f'Recommended {result["scheme"]} rounds {result["rounds"]} ({result["seconds"]:.4f} secs, target {result["target"]} secs)')
+        if not result['met']:
+            print(f'Rounds {result["rounds"]} is slower than the target, lower --min_rounds (or --memory_cost for argon2) or raise --target')
+        if write:
+            env_vars = dict(hasher=hasher, hash_rounds=result['rounds'], **{f'hash_{k}': v for k, v in hasher_settings.items()})
+            for k, value in env_vars.items():
+                name = users_env.mappings[k]
+                if users_env.exists():
+                    set_env_var(name, value, **env_kwargs)
+                else:
+                    save_env_file({name: str(value)}, **env_kwargs)
+                print(f'Saved {name}={value} to {env_kwargs["env_file"]}')
+            print('Passwords are rehashed when users log in')
+
+    elif command == 'batch':
+
+        # (run_command_batch) Execute commands from file, hashing passwords in processes if concurrent
+        from .hashing import PasswordExecutor
+        hash_workers = kwargs.pop('hash_workers')
+        password_executor = PasswordExecutor('process', max_workers=hash_workers) if kwargs['concurrency'] > 1 else None
+        user_manager_context_kwargs['user_manager_settings'] = dict(password_executor=password_executor)
+        try:
+            results = asyncio.run(_run_batch(
+                user_db_context_kwargs=user_db_context_kwargs,
+                user_manager_context_kwargs=user_manager_context_kwargs,
+                **kwargs
+            ))
+        finally:
+            if password_executor:
+                password_executor.shutdown()
+        if results['failed'] > 0:
+            sys.exit(1)
+
     elif command == 'delete':
 
         # (run_command_delete) Execute user delete
+        from .tools import delete_user
         asyncio.run(delete_user(
             user_db_context_kwargs=user_db_context_kwargs,
             user_manager_context_kwargs=user_manager_context_kwargs,
@@ -253,6 +610,7 @@ def run():
     elif command == 'reset':
 
         # (run_command_reset) Reset password for user
+        from .tools import reset_user_password
         kwargs['password'] = kwargs['password'] if kwargs['password'] else _prompt_password()
         asyncio.run(reset_user_password(
             user_db_context_kwargs=user_db_context_kwargs,
@@ -263,6 +621,7 @@ def run():
     elif command == 'update':
 
         # (run_command_update) Execute user update
+        from .tools import update_user
         kwargs = {k:v for k, v in kwargs.items() if v}
         asyncio.run(update_user(
             user_db_context_kwargs=user_db_context_kwargs,
@@ -270,25 +629,36 @@ def run():
             **kwargs
         ))
 
-    elif command == 'start':
-
-        # (run_command_start_env) Set env and database
-        kwargs['env'] = users_env
-        kwargs['database'] = database
+    elif command == 'update-many':
+
+        # (run_command_update_many) Execute batched update of users matching the filters
+        from .tools import update_users
+        flags = ['is_active', 'is_superuser', 'is_verified']
+        values = {k: kwargs.pop(k) for k in flags}
+        values = {k: v == 'true' for k, v in values.items() if v is not None}
+        filters = {k: kwargs.pop(f'where_{k}') for k in flags}
+        filters = {k: v == 'true' for k, v in filters.items() if v is not None}
+        if not values:
+            parser.error('update-many requires at least one of --is_active, --is_superuser, or --is_verified')
+        if not (kwargs['emails'] or kwargs['domain'] or filters):
+            parser.error('update-many requires at least one of --emails, --domain, --where_is_active, --where_is_superuser, or --where_is_verified')
+        path = kwargs.pop('emails')
+        with (contextlib.nullcontext(sys.stdin) if path == '-' else open(path, encoding='utf-8')) if path else contextlib.nullcontext() as f:
+            emails = (line.strip() for line in f if line.strip()) if f else None
+            asyncio.run(update_users(
+                values,
+                emails=emails,
+                user_db_context_kwargs=user_db_context_kwargs,
+                **filters,
+                **kwargs
+            ))
 
-        # (run_command_start_settings) Convert route settings
-        cli_route_settings = kwargs.pop('set', None)
-        kwargs['users_router_settings'] = dict(
-            route_settings=_parse_route_settings(cli_route_settings) if cli_route_settings else {}
-        )
+    elif command == 'start':
 
         # (run_command_start_serve) Extract server args
-        start_kwargs = dict(
-            host=kwargs.pop('host'),
-            port=kwargs.pop('port'),
-            log_level=kwargs.pop('log_level')
-        )
+        from .server import run_server
+        server_keys = ['host', 'port', 'log_level', 'workers', 'loop', 'http', 'timeout_keep_alive', 'backlog', 'limit_max_requests', 'limit_max_requests_jitter', 'timeout_graceful_shutdown']
+        server_kwargs = {k: kwargs.pop(k) for k in server_keys}
 
-        # (run_command_start) Execute users api server
-        app = UsersAPI(**kwargs)
-        app.start(**start_kwargs)
\ No newline at end of file
+        # (run_command_start) Execute users api server, creating the app in each worker
+        run_server(start_kwargs=dict(**env_kwargs, **kwargs), **server_kwargs)
\ No newline at end of file
@@ -1,11 +1,14 @@
 import databases
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from msdss_base_api import API
 from msdss_base_database import Database
 
 from .env import *
+from .metrics import *
 from .models import *
+from .profiling import *
 from .routers import *
 from .tools import *
 
@@ -34,14 +37,93 @@ class UsersAPI(API):
         Expiry time of JSON Web Tokens (JWTs) in seconds.
     cookie_lifetime : int
         Expiry time of cookies in seconds.
-    database : :class:`msdss_base_database:msdss_base_database.core.Database`
-        Database to use for managing users.
+    stateless : bool
+        Whether to add the ``email``, ``is_active``, ``is_superuser``, and ``is_verified`` user attributes to signed tokens,
+        so that :meth:`msdss_users_api.core.UsersAPI.get_current_user` checks them without a database lookup while the token is valid.
+        Attributes can be stale for at most ``jwt_lifetime`` (or ``cookie_lifetime``) seconds.
+    refresh_tokens : bool
+        Whether JWT logins also return a long-lived opaque refresh token or not, so that clients can keep ``jwt_lifetime`` short
+        and get new access tokens from ``POST /auth/jwt/refresh-token`` with one indexed lookup and no password hashing.
+        Tokens are stored as hashes, rotated on each use, and revoked for the whole user if a used token is reused.
+        Delete expired tokens regularly with ``msdss-users cleanup``. See :class:`msdss_users_api.adapters.RefreshTokenDatabase`.
+    refresh_token_lifetime : int
+        Number of seconds refresh tokens are valid for if ``refresh_tokens`` is ``True``.
+    sessions : str or None
+        Opt-in server-side sessions for the cookie route, where cookies only hold a short opaque session id that is looked up in a store and deleted on logout.
+        One of ``memory`` (in-process), ``sql`` (indexed table in the users database), or ``kv`` (local key-value file shared by workers on one machine).
+        Expired sessions are deleted in batches by a background task. If ``None``, cookies hold signed tokens. See :func:`msdss_users_api.tools.create_session_store`.
+    session_settings : dict
+        Keyword arguments passed to the session store, such as ``max_size``, ``path``, ``batch_size``, and ``cleanup_interval``.
+    revocation : bool
+        Whether to revoke tokens on logout (adding ``POST /auth/jwt/logout``) and all tokens of a user when their password is reset or changed, or not.
+        Tokens are checked against in-process Bloom filters of revoked token ids, so tokens that were not revoked need no database query, including in :meth:`msdss_users_api.core.UsersAPI.get_current_user` with ``stateless`` tokens.
+        Revocations by other workers apply within ``sync_interval`` seconds. See :class:`msdss_users_api.revocation.RevocationList`.
+    revocation_settings : dict
+        Keyword arguments passed to :class:`msdss_users_api.revocation.RevocationList`, such as ``capacity``, ``error_rate``, and ``sync_interval``.
+    hash_rounds : int or None
+        Cost factor of password hashes, such as recommended by ``msdss-users tune-hash``. Passwords stored with another cost are rehashed when their user logs in,
+        so the whole user base moves to a new cost without a batch job. The ``env`` variable overrides it. If ``None``, the default cost of ``passlib`` is used.
+        See :func:`msdss_users_api.hashing.get_hash_settings`.
+    hasher : str or None
+        Password hashing scheme, one of ``bcrypt`` or ``argon2``. Argon2id is memory-hard, so a high ``memory_cost`` with few ``rounds`` verifies more logins per core than ``bcrypt`` for the same resistance to guessing.
+        Hashes of both schemes keep working and are rehashed with ``hasher`` at login. The ``env`` variable overrides it. If ``None``, ``bcrypt`` is used with ``hash_rounds``.
+        See :func:`msdss_users_api.hashing.create_hash_settings`.
+    hasher_settings : dict
+        Keyword arguments passed to :func:`msdss_users_api.hashing.create_hash_settings` if ``hasher`` is set, such as ``memory_cost`` (KiB) and ``parallelism``. ``rounds`` defaults to ``hash_rounds``.
+    database : :class:`msdss_base_database:msdss_base_database.core.Database` or None
+        Database to use for managing users. If ``None``, one is created from environment variables.
     users_router_settings : dict
         Keyword arguments passed to :func:`msdss_users_api.routers.get_users_router` except ``fastapi_users_objects``.
+    password_executor : :class:`msdss_users_api.hashing.PasswordExecutor` or None
+        Executor pool to hash and verify passwords outside of the event loop, so that slow hashes do not stall other requests.
+        If ``None``, passwords are hashed on the event loop. Hash latency and queue depth are available from :meth:`msdss_users_api.hashing.PasswordExecutor.get_stats`.
+        The executor is shut down with the app, so that server workers with process pools exit cleanly when they are restarted.
+    user_cache : :class:`msdss_users_api.cache.UserCache` or None
+        Opt-in in-process cache of users keyed by id, so repeat requests from the same users skip the database lookup.
+        If ``None``, every authenticated request queries the database. Hits and misses are available from :meth:`msdss_users_api.cache.UserCache.get_stats`.
+    login_throttle : :class:`msdss_users_api.throttling.LoginThrottle` or None
+        Opt-in token bucket limits on login attempts for each ip address and email, rejecting throttled attempts with status ``429`` before any password is verified.
+        If ``None``, login attempts are not limited. See :func:`msdss_users_api.routers.get_users_router`.
+    fast_responses : bool
+        Whether the users routes encode responses with ``orjson`` and skip validating users that came from the database again, or not.
+        Requires ``pip install msdss-users-api[fast]``. See parameter ``fast_responses`` of :func:`msdss_users_api.routers.get_users_router`.
+    migrate : bool
+        Whether to apply pending schema migrations at construction if the database is behind or not.
+        If ``False``, the app fails to start until migrations are applied with ``msdss-users migrate``. See :func:`msdss_users_api.migrations.check_schema`.
+    pool_settings : dict
+        Keyword arguments passed to :class:`msdss_users_api.pool.PooledDatabase` to configure the async connection pool:
+
+        * ``min_size`` (int): minimum number of connections, opened at startup if ``warm_up`` is ``True``
+        * ``max_size`` (int): maximum number of connections
+        * ``acquire_timeout`` (float): seconds to wait for a free connection before failing
+        * ``recycle`` (float): seconds after which connections are replaced
+        * ``statement_cache_size`` (int): number of prepared statements cached per connection
+        * ``warm_up`` (bool): whether to open and check ``min_size`` connections at startup
+
+        Unset keys use the defaults of the database backend. Live pool statistics are available from :meth:`msdss_users_api.pool.PooledDatabase.get_stats`
+        on ``misc['fastapi_users_objects']['databases']['async_database']``.
+    backend : str
+        One of ``databases`` or ``sqlalchemy``. Use ``sqlalchemy`` to run user queries and schema changes through one async SQLAlchemy engine,
+        so that each worker keeps one connection pool instead of two. See :func:`msdss_users_api.tools.create_fastapi_users_objects`.
+    metrics : bool or :class:`msdss_users_api.metrics.Metrics`
+        Whether to serve in-process metrics in the Prometheus text format at ``metrics_path`` or not. If ``True``, a :class:`msdss_users_api.metrics.Metrics` is created.
+        Metrics include per-route request latency, time spent hashing passwords, decoding tokens, and running queries, pool utilization, and authentication successes and failures.
+        If ``False``, nothing is recorded and requests are not wrapped.
+    metrics_path : str
+        Path of the metrics route if ``metrics`` is set. The route is not authenticated, so restrict access to it from the network if needed.
+    profiling : bool
+        Whether to profile single requests on demand or not. Requests with header ``X-Profile`` set to ``cprofile``, ``tracemalloc``, or ``tracemalloc-stop`` are profiled
+        if they are authenticated as an active superuser or have header ``X-Profile-Secret`` set to ``profile_secret``. Other requests are not affected.
+        See :class:`msdss_users_api.profiling.ProfilingMiddleware`.
+    profile_secret : str or None
+        Secret that allows profiling requests without superuser authentication. Use a strong phrase (e.g. ``openssl rand -hex 32``).
+        If ``None``, the value will be taken from the environment variables if set, otherwise only superusers can profile requests. See parameter ``env``.
+    profiling_settings : dict
+        Keyword arguments passed to :class:`msdss_users_api.profiling.ProfilingMiddleware`, such as ``output_dir`` to store profiles instead of returning them.
     load_env : bool
         Whether to load variables from a file with environmental variables at ``env_file`` or not.
-    env : :class:`msdss_users_api.env.UsersDotEnv`
-        An object to set environment variables related to users configuration.
+    env : :class:`msdss_users_api.env.UsersDotEnv` or None
+        An object to set environment variables related to users configuration. If ``None``, a default :class:`msdss_users_api.env.UsersDotEnv` is created.
         These environment variables will overwrite the parameters above if they exist.
 
         By default, the related parameters above are assigned to each of the environment variables seen below if ``load_env`` is ``True``:
@@ -55,8 +137,8 @@ class UsersAPI(API):
             for k, v in defaults.items():
                 print(k + ' = ' + v)
 
-    api : :class:`fastapi:fastapi.FastAPI`
-        API object for creating routes.
+    api : :class:`fastapi:fastapi.FastAPI` or None
+        API object for creating routes. If ``None``, a new API object is created for each instance.
     *args, **kwargs
         Additional arguments passed to :class:`msdss_base_api:msdss_base_api.core.API`.
 
@@ -68,6 +150,9 @@ class UsersAPI(API):
         Dictionary of miscellaneous values:
 
         * ``fastapi_users_objects`` (dict): dict of values returned from :func:`msdss_users_api.tools.create_fastapi_users_objects`
+        * ``password_executor`` (:class:`msdss_users_api.hashing.PasswordExecutor`): executor pool from parameter ``password_executor``
+        * ``user_cache`` (:class:`msdss_users_api.cache.UserCache`): cache from parameter ``user_cache``
+        * ``metrics`` (:class:`msdss_users_api.metrics.Metrics` or None): metrics from parameter ``metrics``
 
     Author
     ------
@@ -100,15 +185,44 @@ class UsersAPI(API):
         verification_token_secret=None,
         cookie_lifetime=DEFAULT_COOKIE_SETTINGS['lifetime_seconds'],
         jwt_lifetime=DEFAULT_JWT_SETTINGS['lifetime_seconds'],
-        database=Database(),
+        stateless=False,
+        refresh_tokens=False,
+        refresh_token_lifetime=DEFAULT_REFRESH_TOKEN_SETTINGS['lifetime_seconds'],
+        sessions=None,
+        session_settings={},
+        revocation=False,
+        revocation_settings={},
+        hash_rounds=None,
+        hasher=None,
+        hasher_settings={},
+        database=None,
         users_router_settings={},
+        password_executor=None,
+        user_cache=None,
+        login_throttle=None,
+        fast_responses=False,
+        migrate=True,
+        pool_settings={},
+        backend='databases',
+        metrics=False,
+        metrics_path=DEFAULT_METRICS_SETTINGS['path'],
+        profiling=False,
+        profile_secret=None,
+        profiling_settings={},
         load_env=True,
-        env=UsersDotEnv(),
-        api=FastAPI(
+        env=None,
+        api=None,
+        *args, **kwargs):
+
+        # (UsersAPI_defaults) Create default database, env, and api objects
+        database = database if database is not None else Database()
+        env = env if env is not None else UsersDotEnv()
+        api = api if api is not None else FastAPI(
             title='MSDSS Users API',
             version='0.2.1'
-        ),
-        *args, **kwargs):
+        )
+        pool_settings = dict(pool_settings)
+        metrics = Metrics() if metrics is True else metrics or None
         super().__init__(api=api, *args, **kwargs)
         
         # (UsersAPI_env) Set env vars
@@ -118,6 +232,18 @@ class UsersAPI(API):
             jwt_secret = env.get('jwt_secret', jwt_secret)
             reset_password_token_secret = env.get('reset_password_token_secret', reset_password_token_secret)
             verification_token_secret = env.get('verification_token_secret', verification_token_secret)
+            profile_secret = env.get('profile_secret', profile_secret)
+            hash_rounds = env.get('hash_rounds', hash_rounds)
+            hasher = env.get('hasher', hasher)
+            hasher_settings = dict(hasher_settings)
+            for k in ('memory_cost', 'parallelism'):
+                value = env.get(f'hash_{k}')
+                if value is not None:
+                    hasher_settings[k] = int(value)
+            for k, convert in (('min_size', int), ('max_size', int), ('acquire_timeout', float), ('recycle', float), ('statement_cache_size', int)):
+                value = env.get(f'pool_{k}')
+                if value is not None:
+                    pool_settings[k] = convert(value)
 
         # (UsersAPI_manager) Setup manager settings
         fastapi_users_objects_settings = {}
@@ -135,38 +261,112 @@ class UsersAPI(API):
         fastapi_users_objects_settings['jwt_settings']['secret'] = jwt_secret
         fastapi_users_objects_settings['jwt_settings']['lifetime_seconds'] = jwt_lifetime
 
+        # (UsersAPI_stateless) Setup stateless tokens
+        fastapi_users_objects_settings['enable_stateless'] = stateless
+
+        # (UsersAPI_refresh) Setup refresh tokens
+        fastapi_users_objects_settings['enable_refresh_tokens'] = refresh_tokens
+        fastapi_users_objects_settings['refresh_token_settings'] = dict(lifetime_seconds=refresh_token_lifetime)
+
+        # (UsersAPI_sessions) Setup server-side cookie sessions
+        fastapi_users_objects_settings['sessions'] = sessions
+        fastapi_users_objects_settings['session_settings'] = session_settings
+
+        # (UsersAPI_revocation) Setup token revocation
+        fastapi_users_objects_settings['enable_revocation'] = revocation
+        fastapi_users_objects_settings['revocation_settings'] = revocation_settings
+
         # (UsersAPI_database) Setup database
         fastapi_users_objects_settings['database'] = database
 
+        # (UsersAPI_hashing) Setup password hashing pool and cost
+        fastapi_users_objects_settings['password_executor'] = password_executor
+        fastapi_users_objects_settings['hash_settings'] = get_hash_settings(hash_rounds, password_executor.hash_settings if password_executor else DEFAULT_HASH_SETTINGS) if hash_rounds is not None else None
+        if hasher is not None:
+            fastapi_users_objects_settings['hasher'] = hasher
+            fastapi_users_objects_settings['hasher_settings'] = dict(dict(rounds=hash_rounds), **hasher_settings)
+
+        # (UsersAPI_cache) Setup user cache
+        fastapi_users_objects_settings['user_cache'] = user_cache
+
+        # (UsersAPI_migrate) Setup schema migrations
+        fastapi_users_objects_settings['migrate'] = migrate
+
+        # (UsersAPI_pool) Setup async connection pool
+        fastapi_users_objects_settings['pool_settings'] = pool_settings
+        fastapi_users_objects_settings['backend'] = backend
+
+        # (UsersAPI_metrics) Setup metrics
+        fastapi_users_objects_settings['metrics'] = metrics
+
         # (Usersfastapi_users_objects) Create FastAPI Users objects
         fastapi_users_objects = create_fastapi_users_objects(**fastapi_users_objects_settings)
 
         # (UsersAPI_attr) Add attributes
-        self.misc = dict(fastapi_users_objects=fastapi_users_objects)
+        self.misc = dict(
+            fastapi_users_objects=fastapi_users_objects,
+            password_executor=password_executor,
+            user_cache=user_cache,
+            metrics=metrics
+        )
         self.users_api_database = database
 
         # (UsersAPI_router) Add users router
         users_router_settings['fastapi_users_objects'] = fastapi_users_objects
+        if login_throttle is not None:
+            users_router_settings['login_throttle'] = login_throttle
+        if fast_responses:
+            users_router_settings['fast_responses'] = fast_responses
         users_router = get_users_router(**users_router_settings)
         self.add_router(users_router)
 
+        # (UsersAPI_metrics_route) Add metrics route and request timing
+        if metrics:
+            self.api.add_middleware(MetricsMiddleware, metrics=metrics)
+            def get_metrics():
+                return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+            self.add_route('GET', metrics_path, get_metrics, include_in_schema=False)
+
+        # (UsersAPI_profiling) Add on demand request profiling
+        if profiling:
+            is_superuser = create_superuser_check(fastapi_users_objects)
+            self.api.add_middleware(ProfilingMiddleware, secret=profile_secret, authorize=is_superuser, **profiling_settings)
+
         # (UserAPI_startup) Setup app startup
         async_database = fastapi_users_objects['databases']['async_database']
+        session_store = fastapi_users_objects['auth']['session_store']
+        revocation_list = fastapi_users_objects['auth']['revocation_list']
         @self.event('startup')
         async def startup():
             await async_database.connect()
+            if session_store is not None:
+                session_store.start_cleanup()
+            if revocation_list is not None:
+                await revocation_list.sync()
+                revocation_list.start_sync()
 
         # (UserAPI_shutdown) Setup app shutdown
         @self.event('shutdown')
         async def shutdown():
+            if session_store is not None:
+                await session_store.stop_cleanup()
+                session_store.close()
+            if revocation_list is not None:
+                await revocation_list.stop_sync()
             await async_database.disconnect()
+            if password_executor is not None:
+                password_executor.shutdown()
 
-    def get_current_user(self, *args, **kwargs):
+    def get_current_user(self, *args, stateless=None, **kwargs):
         """
         Get a dependency function to retrieve the current authenticated user.
 
         Parameters
         ----------
+        stateless : bool or None
+            Whether to check the user attributes in the token claims instead of the database or not.
+            Only applies if the app was created with ``stateless=True``. If ``None``, the stateless setting of the app is used.
+            Stateless users are :class:`msdss_users_api.models.User` objects without a ``hashed_password``.
         *args, **kwargs
             Additional arguments passed to :meth:`fastapi_users:fastapi_users.FastAPIUsers.current_user`. See `current_user <https://fastapi-users.github.io/fastapi-users/usage/current-user/>`_.
 
@@ -208,5 +408,11 @@ class UsersAPI(API):
             # Try API at http://localhost:8000/docs
             # app.start()
         """
-        out = self.misc['fastapi_users_objects']['FastAPIUsers'].current_user(*args, **kwargs)
+        fastapi_users_objects = self.misc['fastapi_users_objects']
+        stateless_authenticator = fastapi_users_objects['auth']['stateless_authenticator']
+        stateless = stateless if stateless is not None else stateless_authenticator is not None
+        if stateless and stateless_authenticator:
+            out = stateless_authenticator.current_user(*args, **kwargs)
+        else:
+            out = fastapi_users_objects['FastAPIUsers'].current_user(*args, **kwargs)
         return out
\ No newline at end of file
@@ -4,7 +4,17 @@ DEFAULT_DOTENV_KWARGS = dict(
     cookie_secret='MSDSS_USERS_COOKIE_SECRET',
     jwt_secret='MSDSS_USERS_JWT_SECRET',
     reset_password_token_secret='MSDSS_USERS_RESET_PASSWORD_TOKEN_SECRET',
-    verification_token_secret='MSDSS_USERS_VERIFICATION_TOKEN_SECRET'
+    verification_token_secret='MSDSS_USERS_VERIFICATION_TOKEN_SECRET',
+    pool_min_size='MSDSS_USERS_POOL_MIN_SIZE',
+    pool_max_size='MSDSS_USERS_POOL_MAX_SIZE',
+    pool_acquire_timeout='MSDSS_USERS_POOL_ACQUIRE_TIMEOUT',
+    pool_recycle='MSDSS_USERS_POOL_RECYCLE',
+    pool_statement_cache_size='MSDSS_USERS_POOL_STATEMENT_CACHE_SIZE',
+    profile_secret='MSDSS_USERS_PROFILE_SECRET',
+    hash_rounds='MSDSS_USERS_HASH_ROUNDS',
+    hasher='MSDSS_USERS_HASHER',
+    hash_memory_cost='MSDSS_USERS_HASH_MEMORY_COST',
+    hash_parallelism='MSDSS_USERS_HASH_PARALLELISM'
 )
 
 DEFAULT_COOKIE_SETTINGS = dict(
@@ -52,6 +62,129 @@ DEFAULT_USERS_ROUTE_SETTINGS = dict(
         prefix='/users',
         tags=['users'],
         _enable=True,
-        _get_user=None
+        _get_user=None,
+        _enable_list=True
     )
+)
+
+DEFAULT_USER_LIST_SETTINGS = dict(
+    limit=100,
+    max_limit=1000
+)
+
+DEFAULT_HASH_SETTINGS = dict(
+    schemes=['bcrypt'],
+    deprecated='auto'
+)
+
+DEFAULT_ARGON2_SETTINGS = dict(
+    memory_cost=19456, # KiB (19 MiB)
+    time_cost=2,
+    parallelism=1
+)
+
+DEFAULT_HASH_TUNE_SETTINGS = dict(
+    target=0.05,
+    min_rounds=4,
+    max_rounds=20,
+    samples=3
+)
+
+DEFAULT_PASSWORD_EXECUTOR_SETTINGS = dict(
+    executor='thread',
+    max_workers=None,
+    latency_window=1000
+)
+
+DEFAULT_USER_CACHE_SETTINGS = dict(
+    max_size=10000,
+    ttl=60
+)
+
+DEFAULT_IMPORT_SETTINGS = dict(
+    batch_size=1000
+)
+
+DEFAULT_EXPORT_SETTINGS = dict(
+    batch_size=1000
+)
+
+DEFAULT_UPDATE_SETTINGS = dict(
+    batch_size=1000
+)
+
+DEFAULT_POOL_SETTINGS = dict(
+    min_size=None,
+    max_size=None,
+    acquire_timeout=None,
+    recycle=None,
+    statement_cache_size=None,
+    warm_up=True,
+    latency_window=1000
+)
+
+DEFAULT_METRICS_SETTINGS = dict(
+    path='/metrics',
+    prefix='msdss_users_',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+DEFAULT_PROFILING_SETTINGS = dict(
+    output_dir=None,
+    limit=30,
+    header='X-Profile',
+    secret_header='X-Profile-Secret',
+    categories=dict(
+        hashing=['passlib', 'bcrypt', 'argon2', 'msdss_users_api/hashing.py'],
+        database=['databases/', 'sqlalchemy', 'asyncpg', 'aiosqlite', 'aiomysql', 'psycopg', 'sqlite3', 'msdss_users_api/pool.py', 'msdss_users_api/adapters.py'],
+        tokens=['/jwt/', 'cryptography', 'fastapi_users/jwt.py'],
+        serialization=['pydantic', 'json', 'orjson', 'fastapi/encoders.py']
+    )
+)
+
+DEFAULT_THROTTLE_SETTINGS = dict(
+    ip_rate=1.0,
+    ip_capacity=20,
+    email_rate=0.1,
+    email_capacity=10,
+    shards=16,
+    max_keys=100000,
+    sweep_interval=60,
+    redis_url='redis://localhost:6379/0',
+    redis_prefix='msdss_users:throttle:'
+)
+
+DEFAULT_REFRESH_TOKEN_SETTINGS = dict(
+    lifetime_seconds=30 * 86400, # 30 days
+    rotate=True,
+    batch_size=1000
+)
+
+DEFAULT_SERVER_SETTINGS = dict(
+    workers=1,
+    loop='auto',
+    http='auto',
+    timeout_keep_alive=5,
+    backlog=2048,
+    limit_max_requests=None,
+    limit_max_requests_jitter=0,
+    timeout_graceful_shutdown=30,
+    start_args_env='MSDSS_USERS_START_ARGS'
+)
+
+DEFAULT_SESSION_SETTINGS = dict(
+    max_size=100000,
+    batch_size=1000,
+    cleanup_interval=60,
+    id_bytes=16,
+    path='./msdss_users_sessions.db'
+)
+
+DEFAULT_REVOCATION_SETTINGS = dict(
+    buckets=8,
+    capacity=10000,
+    error_rate=0.001,
+    sync_interval=5,
+    sync_overlap=5,
+    batch_size=1000
 )
\ No newline at end of file
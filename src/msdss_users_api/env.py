@@ -18,6 +18,26 @@ class UsersDotEnv(DotEnv):
         The environmental variable name for ``reset_password_token_secret``.
     verification_token_secret : str
         The environmental variable name for ``verification_token_secret``.
+    pool_min_size : str
+        The environmental variable name for ``min_size`` in ``pool_settings``.
+    pool_max_size : str
+        The environmental variable name for ``max_size`` in ``pool_settings``.
+    pool_acquire_timeout : str
+        The environmental variable name for ``acquire_timeout`` in ``pool_settings``.
+    pool_recycle : str
+        The environmental variable name for ``recycle`` in ``pool_settings``.
+    pool_statement_cache_size : str
+        The environmental variable name for ``statement_cache_size`` in ``pool_settings``.
+    profile_secret : str
+        The environmental variable name for ``profile_secret``.
+    hash_rounds : str
+        The environmental variable name for ``hash_rounds``, the cost factor of password hashes. See :func:`msdss_users_api.hashing.get_hash_settings`.
+    hasher : str
+        The environmental variable name for ``hasher``, the password hashing scheme. See :func:`msdss_users_api.hashing.create_hash_settings`.
+    hash_memory_cost : str
+        The environmental variable name for ``memory_cost`` in ``hasher_settings``.
+    hash_parallelism : str
+        The environmental variable name for ``parallelism`` in ``hasher_settings``.
     defaults : dict
         Default values for above parameters if they are not set.
     env_file : str
@@ -83,6 +103,16 @@ class UsersDotEnv(DotEnv):
         cookie_secret=DEFAULT_DOTENV_KWARGS['cookie_secret'],
         reset_password_token_secret=DEFAULT_DOTENV_KWARGS['reset_password_token_secret'],
         verification_token_secret=DEFAULT_DOTENV_KWARGS['verification_token_secret'],
+        pool_min_size=DEFAULT_DOTENV_KWARGS['pool_min_size'],
+        pool_max_size=DEFAULT_DOTENV_KWARGS['pool_max_size'],
+        pool_acquire_timeout=DEFAULT_DOTENV_KWARGS['pool_acquire_timeout'],
+        pool_recycle=DEFAULT_DOTENV_KWARGS['pool_recycle'],
+        pool_statement_cache_size=DEFAULT_DOTENV_KWARGS['pool_statement_cache_size'],
+        profile_secret=DEFAULT_DOTENV_KWARGS['profile_secret'],
+        hash_rounds=DEFAULT_DOTENV_KWARGS['hash_rounds'],
+        hasher=DEFAULT_DOTENV_KWARGS['hasher'],
+        hash_memory_cost=DEFAULT_DOTENV_KWARGS['hash_memory_cost'],
+        hash_parallelism=DEFAULT_DOTENV_KWARGS['hash_parallelism'],
         defaults=DEFAULT_DOTENV_KWARGS.get('defaults', {}),
         env_file=DEFAULT_DOTENV_KWARGS['env_file'],
         key_path=DEFAULT_DOTENV_KWARGS['key_path']):
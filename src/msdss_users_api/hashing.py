@@ -0,0 +1,605 @@
+import asyncio
+import collections
+import functools
+import json
+import os
+import statistics
+import time
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from passlib.context import CryptContext
+
+from .defaults import *
+
+@functools.lru_cache(maxsize=None)
+def _get_crypt_context(hash_settings):
+    """
+    Get a cached password hashing context for the current process.
+
+    Parameters
+    ----------
+    hash_settings : str
+        JSON string of keyword arguments passed to :class:`passlib:passlib.context.CryptContext`.
+
+    Returns
+    -------
+    :class:`passlib:passlib.context.CryptContext`
+        A password hashing context that is only created once per process for each unique ``hash_settings``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import json
+        from msdss_users_api.hashing import _get_crypt_context
+
+        context = _get_crypt_context(json.dumps(dict(schemes=['bcrypt'], deprecated='auto')))
+        print(context.schemes())
+    """
+    out = CryptContext(**json.loads(hash_settings))
+    return out
+
+def _run_timed(func, *args):
+    """
+    Run a function and time how long it took inside the worker.
+
+    Parameters
+    ----------
+    func : func
+        Function to run.
+    *args
+        Arguments passed to ``func``.
+
+    Returns
+    -------
+    tuple
+        A tuple of the result from ``func`` and the number of seconds it took to run.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import _run_timed
+
+        result, seconds = _run_timed(sum, [1, 2, 3])
+        print(result)
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    out = (result, time.perf_counter() - start)
+    return out
+
+def create_hash_settings(
+    hasher='bcrypt',
+    rounds=None,
+    memory_cost=DEFAULT_ARGON2_SETTINGS['memory_cost'],
+    parallelism=DEFAULT_ARGON2_SETTINGS['parallelism']):
+    """
+    Create password hashing settings for a hashing scheme, verifying hashes of all supported schemes.
+
+    * New passwords are hashed with ``hasher``, while hashes of the other schemes still verify and are rehashed with ``hasher`` when their user logs in,
+      so switching schemes keeps existing passwords working
+    * ``argon2`` hashes with Argon2id, which is memory-hard: raising ``memory_cost`` and lowering ``rounds`` trades memory for cpu time,
+      so each core verifies more passwords per second for the same resistance to guessing. It requires ``pip install msdss-users-api[argon2]``
+    * ``bcrypt`` uses little memory, and its cost doubles with each round
+
+    Parameters
+    ----------
+    hasher : str
+        One of ``bcrypt`` or ``argon2``.
+    rounds : int or str or None
+        Cost factor of ``hasher``: the log2 number of iterations for ``bcrypt``, or the number of passes over memory (time cost) for ``argon2``.
+        If ``None``, the ``passlib`` default is used for ``bcrypt`` and ``time_cost`` in :data:`msdss_users_api.defaults.DEFAULT_ARGON2_SETTINGS` for ``argon2``.
+    memory_cost : int or str
+        KiB of memory used by each ``argon2`` hash.
+    parallelism : int or str
+        Number of threads used by each ``argon2`` hash. Values above ``1`` lower the latency of one hash but not the number of hashes per second of a busy server.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for :class:`passlib:passlib.context.CryptContext`. See :func:`msdss_users_api.hashing.get_hash_settings`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import create_hash_settings
+        from pprint import pprint
+
+        pprint(create_hash_settings('argon2', rounds=2, memory_cost=65536))
+    """
+
+    # (create_hash_settings_schemes) Hash with hasher and verify other schemes
+    schemes = ['bcrypt', 'argon2']
+    if hasher not in schemes:
+        raise ValueError(f'Unsupported hasher {hasher}, must be one of bcrypt or argon2')
+    hash_settings = dict(schemes=[hasher] + [s for s in schemes if s != hasher], deprecated='auto')
+
+    # (create_hash_settings_argon2) Set argon2id memory, time, and parallelism
+    if hasher == 'argon2':
+        try:
+            import argon2
+        except ImportError:
+            raise ImportError('Argon2 hashing requires argon2-cffi, install it with pip install msdss-users-api[argon2]')
+        rounds = rounds if rounds is not None else DEFAULT_ARGON2_SETTINGS['time_cost']
+        hash_settings.update(
+            argon2__type='ID',
+            argon2__memory_cost=int(memory_cost),
+            argon2__parallelism=int(parallelism)
+        )
+
+    # (create_hash_settings_return) Set cost factor
+    out = get_hash_settings(rounds, hash_settings)
+    return out
+
+def get_hash_settings(rounds=None, hash_settings=DEFAULT_HASH_SETTINGS):
+    """
+    Get password hashing settings with a cost factor for the default scheme.
+
+    * The cost is set as the default, minimum, and maximum rounds of the scheme, so that hashes stored with any other cost need updating.
+      They are rehashed the next time their user logs in, see :meth:`msdss_users_api.managers.UserManager.verify_and_update_password`
+
+    Parameters
+    ----------
+    rounds : int or str or None
+        Cost factor of the first scheme in ``hash_settings``, such as ``12`` for ``bcrypt`` (``2^12`` iterations). If ``None``, ``hash_settings`` is returned as is.
+    hash_settings : dict
+        Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`.
+
+    Returns
+    -------
+    dict
+        A copy of ``hash_settings`` with the cost factor.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import get_hash_settings
+        from pprint import pprint
+
+        pprint(get_hash_settings(10))
+    """
+    out = dict(hash_settings)
+    if rounds is not None:
+        scheme = out['schemes'][0]
+        for k in ('default_rounds', 'min_rounds', 'max_rounds'):
+            out[f'{scheme}__{k}'] = int(rounds)
+    return out
+
+def hash_password(password, hash_settings=DEFAULT_HASH_SETTINGS):
+    """
+    Hash a password.
+
+    Parameters
+    ----------
+    password : str
+        Plain text password to hash.
+    hash_settings : dict
+        Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`.
+
+    Returns
+    -------
+    str
+        The hashed password.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import hash_password
+
+        hashed_password = hash_password('msdss123')
+        print(hashed_password)
+    """
+    context = _get_crypt_context(json.dumps(hash_settings, sort_keys=True))
+    out = context.hash(password)
+    return out
+
+def tune_hash_rounds(
+    target=DEFAULT_HASH_TUNE_SETTINGS['target'],
+    min_rounds=DEFAULT_HASH_TUNE_SETTINGS['min_rounds'],
+    max_rounds=DEFAULT_HASH_TUNE_SETTINGS['max_rounds'],
+    samples=DEFAULT_HASH_TUNE_SETTINGS['samples'],
+    hash_settings=DEFAULT_HASH_SETTINGS):
+    """
+    Benchmark password verification on this cpu to find the highest cost factor that meets a target latency.
+
+    * Costs are timed from ``min_rounds`` up, stopping at the first cost slower than ``target``, so a ``bcrypt`` cost above the recommendation (twice as slow) is timed at most once
+    * Verification times one core of an otherwise idle machine. Leave room for concurrent logins, or run the benchmark under a typical load
+
+    Parameters
+    ----------
+    target : float
+        Target seconds to verify a password.
+    min_rounds : int
+        Lowest cost factor to time and to recommend.
+    max_rounds : int
+        Highest cost factor to time.
+    samples : int
+        Number of verifications to time for each cost factor, using the median.
+    hash_settings : dict
+        Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`, whose first scheme is tuned.
+
+    Returns
+    -------
+    dict
+        A dictionary with the following keys:
+
+        * ``scheme`` (str): tuned scheme
+        * ``rounds`` (int): recommended cost factor, the highest meeting ``target`` or ``min_rounds`` if none does
+        * ``seconds`` (float): median seconds to verify a password at the recommended cost factor
+        * ``target`` (float): see parameter ``target``
+        * ``met`` (bool): whether the recommended cost factor meets ``target`` or not
+        * ``timings`` (dict): median seconds to verify a password for each timed cost factor
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import tune_hash_rounds
+        from pprint import pprint
+
+        pprint(tune_hash_rounds(target=0.05, max_rounds=12))
+    """
+    timings = {}
+    rounds = min_rounds
+    for candidate in range(min_rounds, max_rounds + 1):
+        candidate_settings = get_hash_settings(candidate, hash_settings)
+        hashed_password = hash_password('msdss-tune-hash', candidate_settings)
+        seconds = statistics.median(_run_timed(verify_and_update_password, 'msdss-tune-hash', hashed_password, candidate_settings)[1] for _ in range(samples))
+        timings[candidate] = seconds
+        if seconds > target:
+            break
+        rounds = candidate
+    out = dict(
+        scheme=hash_settings['schemes'][0],
+        rounds=rounds,
+        seconds=timings[rounds],
+        target=target,
+        met=timings[rounds] <= target,
+        timings=timings
+    )
+    return out
+
+def verify_and_update_password(password, hashed_password, hash_settings=DEFAULT_HASH_SETTINGS):
+    """
+    Verify a password and get a new hash if the stored hash uses outdated settings.
+
+    Parameters
+    ----------
+    password : str
+        Plain text password to verify.
+    hashed_password : str
+        Stored hash to verify ``password`` against.
+    hash_settings : dict
+        Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`.
+
+    Returns
+    -------
+    tuple
+        A tuple of whether the password is verified (bool) and an updated hash (str) or ``None`` if the hash does not need updating.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import hash_password, verify_and_update_password
+
+        hashed_password = hash_password('msdss123')
+        verified, updated_hash = verify_and_update_password('msdss123', hashed_password)
+        print(verified)
+    """
+    context = _get_crypt_context(json.dumps(hash_settings, sort_keys=True))
+    out = context.verify_and_update(password, hashed_password)
+    return out
+
+class PasswordExecutor:
+    """
+    Bounded executor pool for hashing and verifying passwords outside of the event loop.
+
+    Password hashing is CPU-bound and would otherwise block every other request on the same worker.
+
+    Parameters
+    ----------
+    executor : str or :class:`concurrent.futures.Executor`
+        One of ``thread`` (a :class:`concurrent.futures.ThreadPoolExecutor`) or ``process`` (a :class:`concurrent.futures.ProcessPoolExecutor`).
+        An existing executor object can also be passed, in which case it is not created or shut down by this object.
+    max_workers : int or None
+        Maximum number of workers for the pool. If ``None``, the number of CPUs is used.
+    latency_window : int
+        Number of most recent latencies to keep for calculating percentiles.
+    hash_settings : dict
+        Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`.
+        The default settings are:
+
+        .. jupyter-execute::
+            :hide-code:
+
+            from msdss_users_api.defaults import DEFAULT_HASH_SETTINGS
+            from pprint import pprint
+            pprint(DEFAULT_HASH_SETTINGS)
+
+    Attributes
+    ----------
+    executor : :class:`concurrent.futures.Executor`
+        Executor that runs the password hashing and verification.
+    max_workers : int
+        Maximum number of workers for the pool.
+    hash_settings : dict
+        Settings from parameter ``hash_settings``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.hashing import PasswordExecutor
+        from pprint import pprint
+
+        # Create a thread pool for hashing
+        password_executor = PasswordExecutor('thread', max_workers=2)
+
+        # Hash and verify a password
+        hashed_password = await password_executor.hash('msdss123')
+        verified, updated_hash = await password_executor.verify_and_update('msdss123', hashed_password)
+
+        # Get latency and queue depth stats
+        pprint(password_executor.get_stats())
+        password_executor.shutdown()
+    """
+    def __init__(
+        self,
+        executor=DEFAULT_PASSWORD_EXECUTOR_SETTINGS['executor'],
+        max_workers=DEFAULT_PASSWORD_EXECUTOR_SETTINGS['max_workers'],
+        latency_window=DEFAULT_PASSWORD_EXECUTOR_SETTINGS['latency_window'],
+        hash_settings=DEFAULT_HASH_SETTINGS):
+
+        # (PasswordExecutor_pool) Create the executor pool
+        self.max_workers = max_workers if max_workers else os.cpu_count() or 1
+        self._owns_executor = not isinstance(executor, Executor)
+        if executor == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='msdss-users-hash')
+        elif executor == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        elif isinstance(executor, Executor):
+            self.executor = executor
+            self.max_workers = getattr(executor, '_max_workers', self.max_workers)
+        else:
+            raise ValueError(f'Unsupported executor {executor}, must be one of thread, process, or a concurrent.futures.Executor')
+
+        # (PasswordExecutor_stats) Setup stats
+        self.hash_settings = hash_settings
+        self._pending = 0
+        self._completed = 0
+        self._errors = 0
+        self._latencies = collections.deque(maxlen=latency_window)
+        self._run_time_total = 0.0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    async def _run(self, func, *args):
+        """
+        Run a function in the executor pool and record its latency.
+
+        Parameters
+        ----------
+        func : func
+            Module level function to run, so that it can be sent to a process pool.
+        *args
+            Arguments passed to ``func``.
+
+        Returns
+        -------
+        any
+            Result of ``func``.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            out, run_time = await loop.run_in_executor(self.executor, _run_timed, func, *args)
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._pending -= 1
+        latency = time.perf_counter() - start
+        self._completed += 1
+        self._latencies.append(latency)
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        self._run_time_total += run_time
+        return out
+
+    async def hash(self, password, hash_settings=None):
+        """
+        Hash a password in the executor pool.
+
+        Parameters
+        ----------
+        password : str
+            Plain text password to hash.
+        hash_settings : dict or None
+            Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`. If ``None``, the ``hash_settings`` of the executor are used.
+
+        Returns
+        -------
+        str
+            The hashed password.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.hashing import PasswordExecutor
+
+            password_executor = PasswordExecutor()
+            hashed_password = await password_executor.hash('msdss123')
+            print(hashed_password)
+            password_executor.shutdown()
+        """
+        out = await self._run(hash_password, password, hash_settings or self.hash_settings)
+        return out
+
+    async def verify_and_update(self, password, hashed_password, hash_settings=None):
+        """
+        Verify a password in the executor pool. See :func:`msdss_users_api.hashing.verify_and_update_password`.
+
+        Parameters
+        ----------
+        password : str
+            Plain text password to verify.
+        hashed_password : str
+            Stored hash to verify ``password`` against.
+        hash_settings : dict or None
+            Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`. If ``None``, the ``hash_settings`` of the executor are used.
+
+        Returns
+        -------
+        tuple
+            A tuple of whether the password is verified (bool) and an updated hash (str) or ``None`` if the hash does not need updating.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.hashing import PasswordExecutor
+
+            password_executor = PasswordExecutor()
+            hashed_password = await password_executor.hash('msdss123')
+            verified, updated_hash = await password_executor.verify_and_update('msdss123', hashed_password)
+            print(verified)
+            password_executor.shutdown()
+        """
+        out = await self._run(verify_and_update_password, password, hashed_password, hash_settings or self.hash_settings)
+        return out
+
+    def get_stats(self):
+        """
+        Get latency and queue depth statistics for sizing the pool.
+
+        Returns
+        -------
+        dict
+            A dictionary with the following keys:
+
+            * ``max_workers`` (int): maximum number of workers in the pool
+            * ``pending`` (int): number of submitted operations that have not finished
+            * ``running`` (int): estimated number of operations being processed by workers
+            * ``queued`` (int): estimated number of operations waiting for a free worker (queue depth)
+            * ``completed`` (int): number of finished operations
+            * ``errors`` (int): number of failed operations
+            * ``latency_mean`` (float): mean seconds from submission to result
+            * ``latency_max`` (float): maximum seconds from submission to result
+            * ``latency_p50``, ``latency_p95``, ``latency_p99`` (float): latency percentiles in seconds over the most recent operations
+            * ``run_time_mean`` (float): mean seconds spent hashing inside a worker, excluding time waiting in the queue
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.hashing import PasswordExecutor
+            from pprint import pprint
+
+            password_executor = PasswordExecutor()
+            await password_executor.hash('msdss123')
+            pprint(password_executor.get_stats())
+            password_executor.shutdown()
+        """
+
+        # (PasswordExecutor_get_stats_percentiles) Calculate latency percentiles
+        latencies = sorted(self._latencies)
+        percentiles = {}
+        for p in (50, 95, 99):
+            key = f'latency_p{p}'
+            percentiles[key] = latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] if latencies else 0.0
+
+        # (PasswordExecutor_get_stats_return) Return stats
+        running = min(self._pending, self.max_workers)
+        out = dict(
+            max_workers=self.max_workers,
+            pending=self._pending,
+            running=running,
+            queued=self._pending - running,
+            completed=self._completed,
+            errors=self._errors,
+            latency_mean=self._latency_total / self._completed if self._completed else 0.0,
+            latency_max=self._latency_max,
+            run_time_mean=self._run_time_total / self._completed if self._completed else 0.0,
+            **percentiles
+        )
+        return out
+
+    def shutdown(self, wait=True):
+        """
+        Shut down the executor pool if it was created by this object.
+
+        Parameters
+        ----------
+        wait : bool
+            Whether to wait for pending operations to finish or not.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_users_api.hashing import PasswordExecutor
+
+            password_executor = PasswordExecutor()
+            password_executor.shutdown()
+        """
+        if self._owns_executor:
+            self.executor.shutdown(wait=wait)
\ No newline at end of file
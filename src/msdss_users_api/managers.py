@@ -1,11 +1,36 @@
+import fastapi_users.password
+
 from fastapi_users import BaseUserManager
+from fastapi_users.manager import UserAlreadyExists, UserNotExists
 
+from .adapters import normalize_email
+from .hashing import hash_password, verify_and_update_password
 from .models import UserCreate, UserDB
 
 class UserManager(BaseUserManager[UserCreate, UserDB]):
     """
     See `UserManager model <https://fastapi-users.github.io/fastapi-users/configuration/user-manager/>`_ from ``fastapi-users``.
 
+    * Password hashing and verification are awaited through :meth:`msdss_users_api.managers.UserManager.hash_password` and :meth:`msdss_users_api.managers.UserManager.verify_and_update_password`
+    * Passwords stored with outdated ``hash_settings``, such as a lower or higher cost factor, are rehashed when their user logs in
+    * When a password is reset or changed, or a user is deactivated, all tokens, refresh tokens, and sessions of the user are revoked with :meth:`msdss_users_api.managers.UserManager.revoke_user`
+
+    Attributes
+    ----------
+    hash_settings : dict or None
+        Keyword arguments passed to :class:`passlib:passlib.context.CryptContext`, such as from :func:`msdss_users_api.hashing.get_hash_settings`.
+        If ``None``, the settings of the ``password_executor`` or of ``fastapi-users`` are used.
+    password_executor : :class:`msdss_users_api.hashing.PasswordExecutor` or None
+        Executor pool to hash and verify passwords outside of the event loop. If ``None``, passwords are hashed on the event loop.
+    metrics : :class:`msdss_users_api.metrics.Metrics` or None
+        Metrics to time password hashing and count password authentications in. If ``None``, nothing is recorded.
+    revocation : :class:`msdss_users_api.revocation.RevocationList` or None
+        List of revoked tokens to revoke all tokens of a user in when their password is reset or changed, or they are deactivated. If ``None``, tokens stay valid until they expire.
+    refresh_token_db : :class:`msdss_users_api.adapters.RefreshTokenDatabase` or None
+        Refresh tokens to revoke all refresh tokens of a user in when their password is reset or changed, or they are deactivated. If ``None``, refresh tokens stay valid until they expire.
+    session_store : :class:`msdss_users_api.sessions.SessionStoreMixin` or None
+        Store of cookie sessions to delete all sessions of a user from when their password is reset or changed, or they are deactivated. If ``None``, sessions stay valid until they expire.
+
     Example
     -------
     .. jupyter-execute::
@@ -15,4 +40,162 @@ class UserManager(BaseUserManager[UserCreate, UserDB]):
 
         pprint(dir(UserManager))
     """
-    user_db_model = UserDB
\ No newline at end of file
+    user_db_model = UserDB
+    hash_settings = None
+    password_executor = None
+    metrics = None
+    revocation = None
+    refresh_token_db = None
+    session_store = None
+
+    async def _hash_password(self, password):
+        if self.password_executor:
+            out = await self.password_executor.hash(password, self.hash_settings)
+        elif self.hash_settings:
+            out = hash_password(password, self.hash_settings)
+        else:
+            out = fastapi_users.password.get_password_hash(password)
+        return out
+
+    async def _verify_and_update_password(self, password, hashed_password):
+        if self.password_executor:
+            out = await self.password_executor.verify_and_update(password, hashed_password, self.hash_settings)
+        elif self.hash_settings:
+            out = verify_and_update_password(password, hashed_password, self.hash_settings)
+        else:
+            out = fastapi_users.password.verify_and_update_password(password, hashed_password)
+        return out
+
+    async def hash_password(self, password):
+        """
+        Hash a password with the ``password_executor`` if it is set.
+
+        Parameters
+        ----------
+        password : str
+            Plain text password to hash.
+
+        Returns
+        -------
+        str
+            The hashed password.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if self.metrics:
+            with self.metrics.password_duration.time(operation='hash'):
+                out = await self._hash_password(password)
+        else:
+            out = await self._hash_password(password)
+        return out
+
+    async def verify_and_update_password(self, password, hashed_password):
+        """
+        Verify a password with the ``password_executor`` if it is set.
+
+        Parameters
+        ----------
+        password : str
+            Plain text password to verify.
+        hashed_password : str
+            Stored hash to verify ``password`` against.
+
+        Returns
+        -------
+        tuple
+            A tuple of whether the password is verified (bool) and an updated hash (str) or ``None`` if the hash does not need updating.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if self.metrics:
+            with self.metrics.password_duration.time(operation='verify'):
+                out = await self._verify_and_update_password(password, hashed_password)
+        else:
+            out = await self._verify_and_update_password(password, hashed_password)
+        return out
+
+    async def revoke_user(self, user):
+        """
+        Revoke all tokens, refresh tokens, and sessions of a user with the ``revocation``, ``refresh_token_db``, and ``session_store`` that are set.
+
+        Parameters
+        ----------
+        user : :class:`msdss_users_api.models.UserDB`
+            User to revoke the tokens and sessions of.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if self.revocation is not None:
+            await self.revocation.revoke_user(user.id)
+        if self.refresh_token_db is not None:
+            await self.refresh_token_db.revoke_user(user.id)
+        if self.session_store is not None:
+            await self.session_store.delete_user(user.id)
+
+    async def create(self, user, safe=False, request=None):
+        await self.validate_password(user.password, user)
+
+        # (UserManager_create_exists) Check for existing user
+        existing_user = await self.user_db.get_by_email(user.email)
+        if existing_user is not None:
+            raise UserAlreadyExists()
+
+        # (UserManager_create_hash) Hash password and create user
+        hashed_password = await self.hash_password(user.password)
+        user_dict = user.create_update_dict() if safe else user.create_update_dict_superuser()
+        db_user = self.user_db_model(**user_dict, hashed_password=hashed_password)
+        out = await self.user_db.create(db_user)
+        await self.on_after_register(out, request)
+        return out
+
+    async def authenticate(self, credentials):
+        out = await self._authenticate(credentials)
+        if self.metrics:
+            self.metrics.authentication.inc(method='password', result='success' if out else 'failure')
+        return out
+
+    async def _authenticate(self, credentials):
+
+        # (UserManager_authenticate_user) Get user, hashing anyway to mitigate timing attacks
+        try:
+            user = await self.get_by_email(credentials.username)
+        except UserNotExists:
+            await self.hash_password(credentials.password)
+            return None
+
+        # (UserManager_authenticate_verify) Verify password and upgrade hash if needed
+        verified, updated_password_hash = await self.verify_and_update_password(credentials.password, user.hashed_password)
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            user.hashed_password = updated_password_hash
+            await self.user_db.update(user)
+        return user
+
+    async def _update(self, user, update_dict):
+        was_active = user.is_active
+        for field, value in update_dict.items():
+            if field == 'email' and normalize_email(value) == normalize_email(user.email):
+                user.email = value
+            elif field == 'email':
+                try:
+                    await self.get_by_email(value)
+                    raise UserAlreadyExists()
+                except UserNotExists:
+                    user.email = value
+                    user.is_verified = False
+            elif field == 'password':
+                await self.validate_password(value, user)
+                user.hashed_password = await self.hash_password(value)
+            else:
+                setattr(user, field, value)
+        out = await self.user_db.update(user)
+        if 'password' in update_dict or (was_active and not user.is_active):
+            await self.revoke_user(user)
+        return out
\ No newline at end of file
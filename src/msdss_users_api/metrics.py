@@ -0,0 +1,604 @@
+import bisect
+import math
+import threading
+import time
+
+from .defaults import *
+
+def _escape(value):
+    """
+    Escape a label value for Prometheus text.
+
+    Parameters
+    ----------
+    value : any
+        Label value, converted to a string.
+
+    Returns
+    -------
+    str
+        The label value with backslashes, double quotes, and newlines escaped.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import _escape
+
+        print(_escape('a "quoted" value'))
+    """
+    out = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return out
+
+def _format_labels(key):
+    """
+    Format a label key as Prometheus text.
+
+    Parameters
+    ----------
+    key : tuple
+        Sorted tuple of label name and value pairs.
+
+    Returns
+    -------
+    str
+        Labels in the form ``{name="value",...}``, or an empty string if there are no labels.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import _format_labels
+
+        print(_format_labels((('method', 'GET'), ('route', '/users/me'))))
+    """
+    if not key:
+        return ''
+    labels = ','.join(f'{k}="{_escape(v)}"' for k, v in key)
+    out = '{' + labels + '}'
+    return out
+
+def _format_value(value):
+    """
+    Format a sample value as Prometheus text.
+
+    Parameters
+    ----------
+    value : int or float
+        Sample value.
+
+    Returns
+    -------
+    str
+        The value, with ``+Inf`` for infinity and integers without decimals.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import _format_value
+
+        print(_format_value(float('inf')))
+        print(_format_value(3))
+    """
+    if value == math.inf:
+        out = '+Inf'
+    elif isinstance(value, int) or float(value).is_integer():
+        out = str(int(value))
+    else:
+        out = repr(float(value))
+    return out
+
+class _Timer:
+    """
+    Context manager observing the seconds spent inside it in a :class:`msdss_users_api.metrics.Histogram`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Counter:
+    """
+    Counter of a total that only goes up, with one total for each set of labels.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, such as ``msdss_users_authentication_total``.
+    description : str
+        Description of the metric for the ``# HELP`` line.
+
+    Attributes
+    ----------
+    name : str
+        Name from parameter ``name``.
+    description : str
+        Description from parameter ``description``.
+    kind : str
+        Prometheus metric type, ``counter``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import Counter
+
+        counter = Counter('logins_total', 'Number of logins.')
+        counter.inc(result='success')
+        counter.inc(result='failure')
+        counter.inc(result='success')
+        print(counter.render())
+    """
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase the total for a set of labels.
+
+        Parameters
+        ----------
+        amount : int or float
+            Amount to add to the total.
+        **labels
+            Label names and values of the total.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """
+        Set the total for a set of labels, such as from statistics counted elsewhere.
+
+        Parameters
+        ----------
+        value : int or float
+            Total to set.
+        **labels
+            Label names and values of the total.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        """
+        Render the metric in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            Lines with the ``# HELP``, ``# TYPE``, and a sample for each set of labels.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in values]
+        out = '\n'.join(lines)
+        return out
+
+class Gauge(Counter):
+    """
+    Gauge of a value that can go up and down, with one value for each set of labels.
+
+    * Extends :class:`msdss_users_api.metrics.Counter`, using :meth:`msdss_users_api.metrics.Counter.set` to update values
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import Gauge
+
+        gauge = Gauge('connections', 'Number of connections.')
+        gauge.set(3, state='in_use')
+        gauge.set(7, state='idle')
+        print(gauge.render())
+    """
+    kind = 'gauge'
+
+class Histogram:
+    """
+    Histogram of observed values in cumulative buckets, with one histogram for each set of labels.
+
+    Parameters
+    ----------
+    name : str
+        Name of the metric, such as ``msdss_users_request_duration_seconds``.
+    description : str
+        Description of the metric for the ``# HELP`` line.
+    buckets : list(float)
+        Upper bounds of the buckets. A ``+Inf`` bucket is always added.
+
+    Attributes
+    ----------
+    name : str
+        Name from parameter ``name``.
+    description : str
+        Description from parameter ``description``.
+    buckets : tuple(float)
+        Sorted upper bounds from parameter ``buckets``.
+    kind : str
+        Prometheus metric type, ``histogram``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import Histogram
+
+        histogram = Histogram('hash_seconds', 'Seconds spent hashing.', buckets=[0.1, 0.5])
+        histogram.observe(0.05, operation='hash')
+        histogram.observe(0.3, operation='hash')
+        with histogram.time(operation='verify'):
+            pass
+        print(histogram.render())
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_METRICS_SETTINGS['buckets']):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(b for b in buckets if b != math.inf))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Add an observed value to the histogram for a set of labels.
+
+        Parameters
+        ----------
+        value : float
+            Observed value, such as a number of seconds.
+        **labels
+            Label names and values of the histogram.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """
+        Get a context manager that observes the number of seconds spent inside it.
+
+        Parameters
+        ----------
+        **labels
+            Label names and values of the histogram.
+
+        Returns
+        -------
+        context manager
+            Context manager to use in a ``with`` block.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = _Timer(self, labels)
+        return out
+
+    def render(self):
+        """
+        Render the metric in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            Lines with the ``# HELP``, ``# TYPE``, and the cumulative ``_bucket``, ``_sum``, and ``_count`` samples for each set of labels.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket_key = key + (('le', _format_value(bound)),)
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_key)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        out = '\n'.join(lines)
+        return out
+
+class Metrics:
+    """
+    In-process registry of the users API metrics, rendered in the Prometheus text format without external dependencies.
+
+    * Request latency is observed by :class:`msdss_users_api.metrics.MetricsMiddleware` for each route path, such as ``/users/{id}``
+    * Password hashing and verification are timed by :class:`msdss_users_api.managers.UserManager`
+    * Token decoding is timed by :class:`msdss_users_api.authentication.ClaimsAuthenticationMixin`
+    * Queries are timed by :class:`msdss_users_api.pool.PooledDatabase` and :class:`msdss_users_api.pool.AsyncEngineDatabase`
+    * Pool utilization is collected from the ``get_stats`` method of watched databases each time the metrics are rendered
+    * Metrics are local to each process, so each worker of a multi-process server reports its own
+
+    Parameters
+    ----------
+    buckets : list(float)
+        Upper bounds in seconds of the buckets for the latency histograms.
+    prefix : str
+        Prefix added to the name of each metric.
+
+    Attributes
+    ----------
+    request_duration : :class:`msdss_users_api.metrics.Histogram`
+        Seconds to respond to requests, with labels ``method``, ``route``, and ``status``. Requests not matching a route have route ``unmatched``.
+    password_duration : :class:`msdss_users_api.metrics.Histogram`
+        Seconds spent hashing (``operation="hash"``) and verifying (``operation="verify"``) passwords, including time waiting for the password executor.
+    token_decode_duration : :class:`msdss_users_api.metrics.Histogram`
+        Seconds spent decoding tokens, with label ``backend`` for the name of the authentication backend.
+    query_duration : :class:`msdss_users_api.metrics.Histogram`
+        Seconds spent running queries, including acquiring a connection, with label ``operation`` such as ``fetch_one``.
+    authentication : :class:`msdss_users_api.metrics.Counter`
+        Number of authentication attempts, with labels ``method`` (``password`` or ``token``) and ``result`` (``success`` or ``failure``).
+    pool_connections : :class:`msdss_users_api.metrics.Gauge`
+        Number of pool connections, with labels ``pool`` and ``state`` (``in_use``, ``idle``, ``size``, ``max_size``, or ``waiters``).
+    pool_acquires : :class:`msdss_users_api.metrics.Counter`
+        Number of connections acquired from the pool, with label ``pool``.
+    pool_timeouts : :class:`msdss_users_api.metrics.Counter`
+        Number of timeouts waiting for a pool connection, with label ``pool``.
+    metrics : list
+        All of the metrics above, in the order they are rendered.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.metrics import Metrics
+
+        metrics = Metrics()
+        metrics.authentication.inc(method='password', result='success')
+        with metrics.password_duration.time(operation='hash'):
+            pass
+        print(metrics.render())
+    """
+    def __init__(
+        self,
+        buckets=DEFAULT_METRICS_SETTINGS['buckets'],
+        prefix=DEFAULT_METRICS_SETTINGS['prefix']):
+        self.request_duration = Histogram(f'{prefix}request_duration_seconds', 'Seconds to respond to requests by route.', buckets)
+        self.password_duration = Histogram(f'{prefix}password_duration_seconds', 'Seconds spent hashing and verifying passwords.', buckets)
+        self.token_decode_duration = Histogram(f'{prefix}token_decode_duration_seconds', 'Seconds spent decoding authentication tokens.', buckets)
+        self.query_duration = Histogram(f'{prefix}query_duration_seconds', 'Seconds spent running database queries, including connection acquires.', buckets)
+        self.authentication = Counter(f'{prefix}authentication_total', 'Number of authentication attempts by method and result.')
+        self.pool_connections = Gauge(f'{prefix}pool_connections', 'Number of database pool connections by state.')
+        self.pool_acquires = Counter(f'{prefix}pool_acquires_total', 'Number of connections acquired from the database pool.')
+        self.pool_timeouts = Counter(f'{prefix}pool_timeouts_total', 'Number of timeouts waiting for a database pool connection.')
+        self.metrics = [
+            self.request_duration,
+            self.password_duration,
+            self.token_decode_duration,
+            self.query_duration,
+            self.authentication,
+            self.pool_connections,
+            self.pool_acquires,
+            self.pool_timeouts
+        ]
+        self._pools = {}
+
+    def collect_pools(self):
+        """
+        Update the pool metrics from the ``get_stats`` method of each watched database.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        for name, async_database in list(self._pools.items()):
+            stats = async_database.get_stats()
+            for state in ('in_use', 'idle', 'size', 'max_size', 'waiters'):
+                if stats.get(state) is not None:
+                    self.pool_connections.set(stats[state], pool=name, state=state)
+            self.pool_acquires.set(stats['acquires'], pool=name)
+            self.pool_timeouts.set(stats['timeouts'], pool=name)
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text format, collecting the pool metrics first.
+
+        Returns
+        -------
+        str
+            Metrics in the Prometheus text exposition format (version ``0.0.4``).
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        self.collect_pools()
+        out = '\n'.join(metric.render() for metric in self.metrics) + '\n'
+        return out
+
+    def watch_pool(self, async_database, name='users'):
+        """
+        Time the queries of a database and collect its pool utilization when rendering.
+
+        Parameters
+        ----------
+        async_database : :class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase`
+            Database with a ``get_stats`` method and a ``metrics`` attribute.
+        name : str
+            Value of the ``pool`` label for the database.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+
+        Example
+        -------
+        .. jupyter-execute::
+
+            from msdss_base_database import Database
+            from msdss_users_api.metrics import Metrics
+            from msdss_users_api.pool import PooledDatabase
+
+            database_engine = Database()._connection
+            async_database = PooledDatabase(str(database_engine.url))
+
+            metrics = Metrics()
+            metrics.watch_pool(async_database)
+            print(metrics.pool_acquires.render())
+        """
+        async_database.metrics = self
+        self._pools[name] = async_database
+
+class MetricsMiddleware:
+    """
+    ASGI middleware observing the latency of each HTTP request in :attr:`msdss_users_api.metrics.Metrics.request_duration`.
+
+    * Requests are labelled by the path of their matched route (e.g. ``/users/{id}``) rather than the requested path, so that the number of label values stays bounded
+    * Routes are looked up from the endpoint chosen by the router, so only the first request to each endpoint searches the routes of the app
+
+    Parameters
+    ----------
+    app : ASGI app
+        App to wrap.
+    metrics : :class:`msdss_users_api.metrics.Metrics`
+        Metrics to observe request latency in.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from fastapi import FastAPI
+        from msdss_users_api.metrics import Metrics, MetricsMiddleware
+
+        metrics = Metrics()
+        api = FastAPI()
+        api.add_middleware(MetricsMiddleware, metrics=metrics)
+    """
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+        self._routes = {}
+
+    def _get_route(self, scope):
+        """
+        Get the path of the route matched for a request.
+
+        Parameters
+        ----------
+        scope : dict
+            ASGI scope of the request after it was routed.
+
+        Returns
+        -------
+        str
+            Path of the matched route, or ``unmatched`` if no route was matched.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        out = self._routes.get(endpoint)
+        if out is None:
+            app = scope.get('app')
+            routes = getattr(getattr(app, 'router', app), 'routes', [])
+            self._routes = {getattr(route, 'endpoint', None): route.path for route in routes if hasattr(route, 'path')}
+            out = self._routes.get(endpoint, 'unmatched')
+        return out
+
+    async def __call__(self, scope, receive, send):
+
+        # (MetricsMiddleware_call_skip) Only time http requests
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        # (MetricsMiddleware_call_status) Record response status
+        status = [500]
+        async def send_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        # (MetricsMiddleware_call_time) Time request by route
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            self.metrics.request_duration.observe(
+                time.perf_counter() - start,
+                method=scope['method'],
+                route=self._get_route(scope),
+                status=status[0])
\ No newline at end of file
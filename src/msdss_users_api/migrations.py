@@ -0,0 +1,425 @@
+import contextlib
+import datetime
+import sqlalchemy
+import threading
+
+from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
+
+from .adapters import normalize_email
+from .models import Base, RefreshTokenTable, RevokedTokenTable, SessionTable, UserTable
+
+MigrationBase: DeclarativeMeta = declarative_base()
+
+class SchemaVersionTable(MigrationBase):
+    """
+    Table recording the migrations applied to the users schema, with one row for each applied version.
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.migrations import SchemaVersionTable
+
+        table = SchemaVersionTable.__table__
+        for c in table.c:
+            print(c)
+    """
+    __tablename__ = 'user_schema_version'
+    version = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=False)
+    description = sqlalchemy.Column(sqlalchemy.String(length=255), nullable=False)
+    applied_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+@contextlib.contextmanager
+def _begin(database_engine):
+    """
+    Begin a transaction on an engine, or use the open transaction of a connection.
+
+    Parameters
+    ----------
+    database_engine : :func:`sqlalchemy:sqlalchemy.create_engine` or :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        SQLAlchemy engine, or a connection with an open transaction such as the one passed to :meth:`sqlalchemy:sqlalchemy.ext.asyncio.AsyncConnection.run_sync`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    if isinstance(database_engine, sqlalchemy.engine.Connection):
+        yield database_engine
+    else:
+        with database_engine.begin() as connection:
+            yield connection
+
+def _add_email_normalized(connection, Base, UserTable, batch_size=1000):
+    """
+    Migration adding the ``email_normalized`` column to the user table, filling it in batches, and creating its unique index.
+
+    * Emails are normalized with :func:`msdss_users_api.adapters.normalize_email` so that existing rows match new writes
+    * A ``RuntimeError`` is raised if emails only differ by case, as they must be merged or removed before the unique index can be created
+
+    Parameters
+    ----------
+    connection : :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        Connection with an open transaction to apply the migration with.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+    batch_size : int
+        Number of rows to fill at a time.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    table = UserTable.__table__
+    if 'email_normalized' not in table.c:
+        return
+
+    # (_add_email_normalized_column) Add column if it does not exist
+    columns = [c['name'] for c in sqlalchemy.inspect(connection).get_columns(table.name)]
+    if 'email_normalized' not in columns:
+        quote = connection.dialect.identifier_preparer.quote
+        column_type = table.c.email_normalized.type.compile(dialect=connection.dialect)
+        connection.execute(sqlalchemy.text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote("email_normalized")} {column_type}'))
+
+    # (_add_email_normalized_fill) Fill normalized emails in batches
+    select_query = sqlalchemy.select([table.c.id, table.c.email]).where(table.c.email_normalized.is_(None)).limit(batch_size)
+    update_query = table.update().where(table.c.id == sqlalchemy.bindparam('_id')).values(email_normalized=sqlalchemy.bindparam('_email_normalized'))
+    while True:
+        rows = connection.execute(select_query).fetchall()
+        if not rows:
+            break
+        connection.execute(update_query, [{'_id': row.id, '_email_normalized': normalize_email(row.email)} for row in rows])
+
+    # (_add_email_normalized_duplicates) Check for emails that only differ by case
+    count = sqlalchemy.func.count()
+    duplicates_query = sqlalchemy.select([table.c.email_normalized]).group_by(table.c.email_normalized).having(count > 1).limit(10)
+    duplicates = [row.email_normalized for row in connection.execute(duplicates_query)]
+    if duplicates:
+        raise RuntimeError(f'Users have emails that only differ by case, merge or delete them before migrating: {", ".join(duplicates)}')
+
+    # (_add_email_normalized_index) Create unique index
+    _create_user_indexes(connection, Base, UserTable)
+
+def _create_refresh_token_table(connection, Base, UserTable):
+    """
+    Migration creating the refresh token table and its indexes if they do not exist. See :class:`msdss_users_api.models.RefreshTokenTable`.
+
+    Parameters
+    ----------
+    connection : :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        Connection with an open transaction to apply the migration with.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    RefreshTokenTable.__table__.create(connection, checkfirst=True)
+
+def _create_revoked_token_table(connection, Base, UserTable):
+    """
+    Migration creating the revoked token table and its indexes if they do not exist. See :class:`msdss_users_api.models.RevokedTokenTable`.
+
+    Parameters
+    ----------
+    connection : :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        Connection with an open transaction to apply the migration with.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    RevokedTokenTable.__table__.create(connection, checkfirst=True)
+
+def _create_session_table(connection, Base, UserTable):
+    """
+    Migration creating the cookie session table and its indexes if they do not exist. See :class:`msdss_users_api.models.SessionTable`.
+
+    Parameters
+    ----------
+    connection : :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        Connection with an open transaction to apply the migration with.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    SessionTable.__table__.create(connection, checkfirst=True)
+
+def _create_user_indexes(connection, Base, UserTable):
+    """
+    Migration creating the indexes of the user table that do not exist, such as those for filtered keyset pagination of users.
+
+    * Indexes on columns that do not exist yet are skipped, as they are created by the migration adding their columns
+
+    Parameters
+    ----------
+    connection : :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        Connection with an open transaction to apply the migration with.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    table = UserTable.__table__
+    columns = [c['name'] for c in sqlalchemy.inspect(connection).get_columns(table.name)]
+    for index in table.indexes:
+        if all(c.name in columns for c in index.columns):
+            index.create(connection, checkfirst=True)
+
+def _create_user_tables(connection, Base, UserTable):
+    """
+    Migration creating the user tables if they do not exist, so that databases created before versioned migrations are adopted as is.
+
+    Parameters
+    ----------
+    connection : :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        Connection with an open transaction to apply the migration with.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    Base.metadata.create_all(connection, checkfirst=True)
+
+MIGRATIONS = [
+    dict(version=1, description='create user tables', apply=_create_user_tables),
+    dict(version=2, description='create user list indexes', apply=_create_user_indexes),
+    dict(version=3, description='add normalized user emails', apply=_add_email_normalized),
+    dict(version=4, description='create refresh token table', apply=_create_refresh_token_table),
+    dict(version=5, description='create session table', apply=_create_session_table),
+    dict(version=6, description='create revoked token table', apply=_create_revoked_token_table)
+]
+
+_checked_schemas = set()
+_checked_schemas_lock = threading.Lock()
+
+def check_schema(
+    database_engine,
+    Base=Base,
+    UserTable=UserTable,
+    migrations=MIGRATIONS,
+    migrate=True):
+    """
+    Check that the users schema is up to date, applying pending migrations if it is behind.
+
+    * An up to date schema only costs one query for its version, and the result is remembered for the rest of the process
+    * Use :func:`msdss_users_api.migrations.migrate_schema` or ``msdss-users migrate`` to apply migrations ahead of starting the API
+
+    Parameters
+    ----------
+    database_engine : :func:`sqlalchemy:sqlalchemy.create_engine` or :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        SQLAlchemy engine, or a connection with an open transaction such as the one passed to :meth:`sqlalchemy:sqlalchemy.ext.asyncio.AsyncConnection.run_sync`.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+    migrations : list(dict)
+        Migrations with keys ``version`` (int), ``description`` (str), and ``apply`` (func). See :data:`msdss_users_api.migrations.MIGRATIONS`.
+    migrate : bool
+        Whether to apply pending migrations or not. If ``False`` and the schema is behind, a ``RuntimeError`` is raised.
+
+    Return
+    ------
+    int
+        The schema version of the database.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.migrations import check_schema
+
+        database_engine = Database()._connection
+        version = check_schema(database_engine)
+        print(version)
+    """
+
+    # (check_schema_cache) Skip schemas already checked in this process
+    latest = max(m['version'] for m in migrations)
+    key = (str(database_engine.engine.url), UserTable.__table__.name, latest)
+    if key in _checked_schemas:
+        return latest
+
+    # (check_schema_version) Get version and migrate if behind
+    out = get_schema_version(database_engine)
+    if out < latest:
+        if not migrate:
+            raise RuntimeError(f'Users schema version {out} is behind version {latest}, run msdss-users migrate to apply pending migrations')
+        migrate_schema(database_engine, Base=Base, UserTable=UserTable, migrations=migrations)
+        out = get_schema_version(database_engine)
+
+    # (check_schema_return) Remember the checked schema
+    with _checked_schemas_lock:
+        _checked_schemas.add(key)
+    return out
+
+def get_pending_migrations(database_engine, migrations=MIGRATIONS):
+    """
+    Get migrations that have not been applied to a database.
+
+    Parameters
+    ----------
+    database_engine : :func:`sqlalchemy:sqlalchemy.create_engine` or :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        SQLAlchemy engine, or a connection with an open transaction such as the one passed to :meth:`sqlalchemy:sqlalchemy.ext.asyncio.AsyncConnection.run_sync`.
+    migrations : list(dict)
+        Migrations with keys ``version`` (int), ``description`` (str), and ``apply`` (func). See :data:`msdss_users_api.migrations.MIGRATIONS`.
+
+    Return
+    ------
+    list(dict)
+        Migrations with a version greater than the schema version of the database, in order of version.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.migrations import get_pending_migrations
+
+        database_engine = Database()._connection
+        pending = get_pending_migrations(database_engine)
+        print([m['description'] for m in pending])
+    """
+    version = get_schema_version(database_engine)
+    out = sorted([m for m in migrations if m['version'] > version], key=lambda m: m['version'])
+    return out
+
+def get_schema_version(database_engine):
+    """
+    Get the schema version of the users tables in a database.
+
+    Parameters
+    ----------
+    database_engine : :func:`sqlalchemy:sqlalchemy.create_engine` or :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        SQLAlchemy engine, or a connection with an open transaction such as the one passed to :meth:`sqlalchemy:sqlalchemy.ext.asyncio.AsyncConnection.run_sync`.
+
+    Return
+    ------
+    int
+        The highest applied migration version, or ``0`` if no migrations were applied.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.migrations import get_schema_version
+
+        database_engine = Database()._connection
+        version = get_schema_version(database_engine)
+        print(version)
+    """
+    query = sqlalchemy.select(sqlalchemy.func.max(SchemaVersionTable.version))
+
+    # (get_schema_version_connection) Check for the version table first inside an open transaction, which a failed query would abort
+    if isinstance(database_engine, sqlalchemy.engine.Connection):
+        has_table = sqlalchemy.inspect(database_engine).has_table(SchemaVersionTable.__tablename__)
+        out = database_engine.execute(query).scalar() if has_table else None
+        return out if out else 0
+
+    # (get_schema_version_engine) Query the version, checking for a missing version table only after the query fails
+    try:
+        with database_engine.connect() as connection:
+            out = connection.execute(query).scalar()
+    except sqlalchemy.exc.DBAPIError:
+        if sqlalchemy.inspect(database_engine).has_table(SchemaVersionTable.__tablename__):
+            raise
+        out = None
+    out = out if out else 0
+    return out
+
+def migrate_schema(
+    database_engine,
+    Base=Base,
+    UserTable=UserTable,
+    migrations=MIGRATIONS,
+    show=False):
+    """
+    Apply pending migrations to the users schema.
+
+    * Each migration is applied and recorded in :class:`msdss_users_api.migrations.SchemaVersionTable` in its own transaction, or in the open transaction if a connection is passed
+
+    Parameters
+    ----------
+    database_engine : :func:`sqlalchemy:sqlalchemy.create_engine` or :class:`sqlalchemy:sqlalchemy.engine.Connection`
+        SQLAlchemy engine, or a connection with an open transaction such as the one passed to :meth:`sqlalchemy:sqlalchemy.ext.asyncio.AsyncConnection.run_sync`.
+    Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
+        The base class of the user tables.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+    migrations : list(dict)
+        Migrations with keys ``version`` (int), ``description`` (str), and ``apply`` (func). See :data:`msdss_users_api.migrations.MIGRATIONS`.
+    show : bool
+        Whether to print applied migrations or not.
+
+    Return
+    ------
+    list(int)
+        Versions of the applied migrations.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.migrations import migrate_schema
+
+        database_engine = Database()._connection
+        applied = migrate_schema(database_engine, show=True)
+    """
+
+    # (migrate_schema_table) Create version table
+    with _begin(database_engine) as connection:
+        MigrationBase.metadata.create_all(connection, checkfirst=True)
+
+    # (migrate_schema_apply) Apply and record each pending migration
+    out = []
+    for migration in get_pending_migrations(database_engine, migrations=migrations):
+        with _begin(database_engine) as connection:
+            migration['apply'](connection, Base, UserTable)
+            connection.execute(SchemaVersionTable.__table__.insert().values(
+                version=migration['version'],
+                description=migration['description']
+            ))
+        out.append(migration['version'])
+        if show:
+            print(f'Applied migration {migration["version"]}: {migration["description"]}')
+    return out
\ No newline at end of file
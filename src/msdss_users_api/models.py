@@ -1,7 +1,9 @@
 import fastapi_users
 import fastapi_users.models
 import fastapi_users.db
+import sqlalchemy
 
+from fastapi_users_db_sqlalchemy import GUID
 from sqlalchemy.ext.declarative import DeclarativeMeta, declarative_base
 
 class User(fastapi_users.models.BaseUser):
@@ -73,6 +75,9 @@ class UserTable(Base, fastapi_users.db.SQLAlchemyBaseUserTable):
     """
     See `UserTable model <https://fastapi-users.github.io/fastapi-users/configuration/databases/sqlalchemy/>`_ from ``fastapi-users``.
 
+    * Adds indexes on ``is_active``, ``is_superuser``, and ``is_verified`` with ``id`` for filtered keyset pagination. See :meth:`msdss_users_api.adapters.UserDatabase.get_page`
+    * Adds an ``email_normalized`` column with a unique index for case insensitive email lookups. See :func:`msdss_users_api.adapters.normalize_email`
+
     Example
     -------
     .. jupyter-execute::
@@ -85,4 +90,80 @@ class UserTable(Base, fastapi_users.db.SQLAlchemyBaseUserTable):
         for c in columns:
             print(c)
     """
-    pass
+    email_normalized = sqlalchemy.Column(sqlalchemy.String(length=320), nullable=True)
+    __table_args__ = (
+        sqlalchemy.Index('ix_user_email_normalized', 'email_normalized', unique=True),
+        sqlalchemy.Index('ix_user_is_active_id', 'is_active', 'id'),
+        sqlalchemy.Index('ix_user_is_superuser_id', 'is_superuser', 'id'),
+        sqlalchemy.Index('ix_user_is_verified_id', 'is_verified', 'id')
+    )
+
+
+class RefreshTokenTable(Base):
+    """
+    Table of refresh tokens, storing only a SHA-256 hash of each token so that leaked rows cannot be used.
+
+    * Tokens are looked up by their hash with the primary key index. See :class:`msdss_users_api.adapters.RefreshTokenDatabase`
+    * ``user_id`` is indexed to revoke all tokens of a user, and ``expires_at`` is indexed to delete expired tokens in batches
+    * Tokens are deleted with their user by the foreign key on databases that enforce it
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.models import RefreshTokenTable
+
+        table = RefreshTokenTable.__table__
+        for c in table.c:
+            print(c)
+    """
+    __tablename__ = 'user_refresh_token'
+    token_hash = sqlalchemy.Column(sqlalchemy.String(length=64), primary_key=True)
+    user_id = sqlalchemy.Column(GUID, sqlalchemy.ForeignKey('user.id', ondelete='cascade'), nullable=False, index=True)
+    expires_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False, index=True)
+    revoked = sqlalchemy.Column(sqlalchemy.Boolean, nullable=False, default=False)
+
+class SessionTable(Base):
+    """
+    Table of server-side cookie sessions, storing only a SHA-256 hash of each session id so that leaked rows cannot be used.
+
+    * Sessions are looked up by the hash of their id with the primary key index. See :class:`msdss_users_api.sessions.SQLSessionStore`
+    * ``user_id`` is indexed to revoke all sessions of a user, and ``expires_at`` is indexed to delete expired sessions in batches
+    * Sessions are deleted with their user by the foreign key on databases that enforce it
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.models import SessionTable
+
+        table = SessionTable.__table__
+        for c in table.c:
+            print(c)
+    """
+    __tablename__ = 'user_session'
+    session_hash = sqlalchemy.Column(sqlalchemy.String(length=64), primary_key=True)
+    user_id = sqlalchemy.Column(GUID, sqlalchemy.ForeignKey('user.id', ondelete='cascade'), nullable=False, index=True)
+    expires_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False, index=True)
+
+class RevokedTokenTable(Base):
+    """
+    Table of revoked JSON Web Tokens (JWTs), keyed by their token id (``jti``) or by ``user:<id>`` for all tokens of a user issued before ``revoked_at``.
+
+    * Entries are looked up by key with the primary key index, only when the in-process Bloom filter of :class:`msdss_users_api.revocation.RevocationList` may contain the key
+    * ``revoked_at`` is indexed to load only new entries into the Bloom filters of each process, and ``expires_at`` is indexed to delete entries of expired tokens in batches
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.models import RevokedTokenTable
+
+        table = RevokedTokenTable.__table__
+        for c in table.c:
+            print(c)
+    """
+    __tablename__ = 'user_revoked_token'
+    token_key = sqlalchemy.Column(sqlalchemy.String(length=64), primary_key=True)
+    expires_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False, index=True)
+    revoked_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False, index=True)
\ No newline at end of file
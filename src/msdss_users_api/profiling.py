@@ -0,0 +1,415 @@
+import contextlib
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import time
+import tracemalloc
+
+from starlette.requests import Request
+
+from .defaults import *
+
+def _get_profile_report(profiler, seconds, limit=DEFAULT_PROFILING_SETTINGS['limit'], categories=DEFAULT_PROFILING_SETTINGS['categories']):
+    """
+    Get a text report of a finished ``cProfile`` profile.
+
+    * Time in each category is the own time (``tottime``) of functions whose file or name contains one of the category markers
+    * Work run in thread or process pools, such as a :class:`msdss_users_api.hashing.PasswordExecutor` or the ``aiosqlite`` thread, is not profiled and shows up as waiting time
+
+    Parameters
+    ----------
+    profiler : :class:`cProfile.Profile`
+        Profiler that was enabled for a request.
+    seconds : float
+        Wall time of the request in seconds.
+    limit : int
+        Number of functions to show in the statistics and the call tree.
+    categories : dict
+        Dictionary of category names (e.g. ``hashing``) and lists of markers to match against function files and names (e.g. ``passlib``).
+
+    Returns
+    -------
+    str
+        Report with the wall time, profiled time in each category, the functions with the most cumulative time, and the functions they called.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import cProfile
+        import json
+        from msdss_users_api.profiling import _get_profile_report
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        json.dumps(list(range(1000)))
+        profiler.disable()
+        print(_get_profile_report(profiler, 0.001, limit=5)[:500])
+    """
+
+    # (_get_profile_report_categories) Sum own time of functions in each category
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    totals = dict.fromkeys(categories, 0.0)
+    for (filename, _, name), (_, _, tottime, _, _) in stats.stats.items():
+        location = f'{filename}:{name}'.replace('\\', '/')
+        for category, markers in categories.items():
+            if any(marker in location for marker in markers):
+                totals[category] += tottime
+                break
+
+    # (_get_profile_report_summary) Write summary
+    stream.write(f'Wall time: {seconds:.6f} secs\n')
+    stream.write(f'Profiled time: {stats.total_tt:.6f} secs\n')
+    for category, total in totals.items():
+        stream.write(f'Time in {category}: {total:.6f} secs\n')
+    stream.write('\n')
+
+    # (_get_profile_report_stats) Write top functions and their callees
+    stats.sort_stats('cumulative')
+    stats.print_stats(limit)
+    stats.print_callees(limit)
+    out = stream.getvalue()
+    return out
+
+def _get_tracemalloc_report(before, after, previous=None, limit=DEFAULT_PROFILING_SETTINGS['limit']):
+    """
+    Get a text report comparing ``tracemalloc`` snapshots taken around a request.
+
+    Parameters
+    ----------
+    before : :class:`tracemalloc.Snapshot`
+        Snapshot taken before the request.
+    after : :class:`tracemalloc.Snapshot`
+        Snapshot taken after the request.
+    previous : :class:`tracemalloc.Snapshot` or None
+        Snapshot taken after the previous profiled request of the same process, to show memory growth of the worker in between. If ``None``, growth is not shown.
+    limit : int
+        Number of source lines to show in each comparison.
+
+    Returns
+    -------
+    str
+        Report with the traced memory, the lines allocating the most memory during the request, and the lines with the most growth since ``previous``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import tracemalloc
+        from msdss_users_api.profiling import _get_tracemalloc_report
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        data = [str(i) for i in range(10000)]
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        print(_get_tracemalloc_report(before, after, limit=3))
+    """
+    stream = io.StringIO()
+    current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+    stream.write(f'Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n')
+    comparisons = [('Allocated during request', before)]
+    if previous is not None:
+        comparisons.append(('Growth since previous snapshot', previous))
+    for title, snapshot in comparisons:
+        stream.write(f'\n{title}:\n')
+        for stat in after.compare_to(snapshot, 'lineno')[:limit]:
+            stream.write(f'{stat}\n')
+    out = stream.getvalue()
+    return out
+
+def _take_snapshot():
+    """
+    Take a ``tracemalloc`` snapshot without the allocations of ``tracemalloc`` itself.
+
+    Returns
+    -------
+    :class:`tracemalloc.Snapshot`
+        Snapshot of the traced memory blocks.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    out = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ))
+    return out
+
+def create_superuser_check(fastapi_users_objects):
+    """
+    Create a function that checks if a request is authenticated as an active superuser.
+
+    Parameters
+    ----------
+    fastapi_users_objects : dict
+        Dictionary returned from :func:`msdss_users_api.tools.create_fastapi_users_objects`.
+
+    Returns
+    -------
+    func
+        Async function passed a :class:`starlette:starlette.requests.Request` and returning ``True`` if a cookie or JWT of the request belongs to an active superuser.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.profiling import create_superuser_check
+        from msdss_users_api.tools import create_fastapi_users_objects
+
+        fastapi_users_objects = create_fastapi_users_objects(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret', # CHANGE TO STRONG PHRASE
+                verification_token_secret='verify-secret' # CHANGE TO STRONG PHRASE
+            ),
+            jwt_settings=dict(secret='jwt-secret'), # CHANGE TO STRONG PHRASE
+            cookie_settings=dict(secret='cookie-secret') # CHANGE TO STRONG PHRASE
+        )
+        is_superuser = create_superuser_check(fastapi_users_objects)
+    """
+    backends = [b for b in (fastapi_users_objects['auth']['cookie'], fastapi_users_objects['auth']['jwt']) if b is not None]
+    get_user_db = contextlib.asynccontextmanager(fastapi_users_objects['dependencies']['get_user_db'])
+    get_user_manager = contextlib.asynccontextmanager(fastapi_users_objects['dependencies']['get_user_manager'])
+    async def out(request):
+        async with get_user_db() as user_db:
+            async with get_user_manager(user_db) as user_manager:
+                for backend in backends:
+                    credentials = await backend.scheme(request)
+                    user = await backend(credentials, user_manager) if credentials else None
+                    if user is not None and user.is_active and user.is_superuser:
+                        return True
+        return False
+    return out
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling single requests on demand.
+
+    * A request is profiled if it has the ``header`` (default ``X-Profile``) with a mode and is authorized by the ``secret_header`` (default ``X-Profile-Secret``) matching ``secret``, or by ``authorize``
+    * Modes are ``cprofile`` for a ``cProfile`` call tree with the time spent in hashing, database, token, and serialization code, ``tracemalloc`` for the memory allocated during the request and since the previous ``tracemalloc`` request of the worker,
+      and ``tracemalloc-stop`` to report once more and stop tracing memory. Memory tracing stays on between ``tracemalloc`` and ``tracemalloc-stop`` requests and slows down the worker
+    * If ``output_dir`` is ``None``, the report replaces the response body, with the original status in header ``X-Profile-Status``.
+      Otherwise the response is returned as is, and the report and profile (``.prof`` for ``pstats`` and tools such as ``snakeviz``, or ``.snapshot`` for ``tracemalloc``) are stored in ``output_dir`` and named in header ``X-Profile-File``
+    * Authorized requests with an unknown mode get a ``400`` response listing the modes, and unauthorized ones are served normally
+    * Requests without the header only pay for a scan of the request headers. Only one request is profiled at a time in each process, and others are served normally meanwhile
+    * ``cProfile`` profiles everything running on the event loop while the request is handled, including other concurrent requests
+
+    Parameters
+    ----------
+    app : ASGI app
+        App to wrap.
+    secret : str or None
+        Secret that authorizes profiling if sent in the ``secret_header``. If ``None``, only ``authorize`` is used.
+    authorize : func or None
+        Async function passed a :class:`starlette:starlette.requests.Request` that returns ``True`` if profiling is allowed, such as from :func:`msdss_users_api.profiling.create_superuser_check`.
+        It is only called for requests with the ``header``. If ``None``, only ``secret`` is used.
+    output_dir : str or None
+        Folder to store profiles in. If ``None``, profiles are returned in the response.
+    limit : int
+        Number of functions or source lines to show in reports.
+    header : str
+        Name of the header with the profiling mode.
+    secret_header : str
+        Name of the header with the profiling secret.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from fastapi import FastAPI
+        from msdss_users_api.profiling import ProfilingMiddleware
+
+        api = FastAPI()
+        api.add_middleware(ProfilingMiddleware, secret='profile-secret') # CHANGE TO STRONG PHRASE
+
+        # Profile a request with headers:
+        # X-Profile: cprofile
+        # X-Profile-Secret: profile-secret
+    """
+    modes = ('cprofile', 'tracemalloc', 'tracemalloc-stop')
+
+    def __init__(
+        self,
+        app,
+        secret=None,
+        authorize=None,
+        output_dir=DEFAULT_PROFILING_SETTINGS['output_dir'],
+        limit=DEFAULT_PROFILING_SETTINGS['limit'],
+        header=DEFAULT_PROFILING_SETTINGS['header'],
+        secret_header=DEFAULT_PROFILING_SETTINGS['secret_header']):
+        if secret is None and authorize is None:
+            raise ValueError('Profiling requires a secret or an authorize function')
+        self.app = app
+        self.secret = secret
+        self.authorize = authorize
+        self.output_dir = output_dir
+        self.limit = limit
+        self._header = header.lower().encode('latin-1')
+        self._secret_header = secret_header.lower().encode('latin-1')
+        self._active = False
+        self._snapshot = None
+
+    async def _is_authorized(self, scope):
+        """
+        Check if a request is allowed to be profiled.
+
+        Parameters
+        ----------
+        scope : dict
+            ASGI scope of the request.
+
+        Returns
+        -------
+        bool
+            Whether the request has the secret or passes ``authorize``.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if self.secret is not None:
+            for name, value in scope['headers']:
+                if name == self._secret_header and hmac.compare_digest(value, self.secret.encode('utf-8')):
+                    return True
+        out = bool(self.authorize and await self.authorize(Request(scope)))
+        return out
+
+    async def _profile(self, mode, scope, receive, messages):
+        """
+        Run a request while profiling it.
+
+        Parameters
+        ----------
+        mode : str
+            One of ``cprofile``, ``tracemalloc``, or ``tracemalloc-stop``.
+        scope, receive
+            ASGI scope and receive function of the request.
+        messages : list
+            List to buffer the response messages in.
+
+        Returns
+        -------
+        tuple
+            A tuple of the text report (str) and a function passed a file path without extension to store the profile in, returning the stored file path.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        async def send_buffered(message):
+            messages.append(message)
+
+        # (ProfilingMiddleware_profile_cprofile) Profile calls
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_buffered)
+            finally:
+                profiler.disable()
+            report = _get_profile_report(profiler, time.perf_counter() - start, limit=self.limit)
+            def store(path):
+                profiler.dump_stats(path + '.prof')
+                return path + '.prof'
+            return report, store
+
+        # (ProfilingMiddleware_profile_tracemalloc) Snapshot memory
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before = _take_snapshot()
+        try:
+            await self.app(scope, receive, send_buffered)
+        finally:
+            after = _take_snapshot()
+        report = ('Started tracing memory\n' if started else '') + _get_tracemalloc_report(before, after, self._snapshot, limit=self.limit)
+        self._snapshot = after
+        if mode == 'tracemalloc-stop':
+            tracemalloc.stop()
+            self._snapshot = None
+            report += '\nStopped tracing memory\n'
+        def store(path):
+            after.dump(path + '.snapshot')
+            return path + '.snapshot'
+        return report, store
+
+    async def __call__(self, scope, receive, send):
+
+        # (ProfilingMiddleware_call_mode) Look for profiling header
+        mode = None
+        if scope['type'] == 'http' and not self._active:
+            for name, value in scope['headers']:
+                if name == self._header:
+                    mode = value.decode('latin-1').strip().lower()
+                    break
+        if mode is None or not await self._is_authorized(scope) or self._active:
+            await self.app(scope, receive, send)
+            return
+
+        # (ProfilingMiddleware_call_invalid) Reject unknown modes
+        if mode not in self.modes:
+            body = f'Unknown profiling mode {mode}, must be one of {", ".join(self.modes)}'.encode('utf-8')
+            headers = [
+                (b'content-type', b'text/plain; charset=utf-8'),
+                (b'content-length', str(len(body)).encode('latin-1'))
+            ]
+            await send(dict(type='http.response.start', status=400, headers=headers))
+            await send(dict(type='http.response.body', body=body))
+            return
+
+        # (ProfilingMiddleware_call_profile) Profile request and buffer response
+        self._active = True
+        messages = []
+        try:
+            report, store = await self._profile(mode, scope, receive, messages)
+        finally:
+            self._active = False
+        start = next(m for m in messages if m['type'] == 'http.response.start')
+        headers = [(k, v) for k, v in start.get('headers', []) if k != b'content-length']
+
+        # (ProfilingMiddleware_call_store) Store profile and send original response
+        if self.output_dir is not None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = re.sub(r'[^A-Za-z0-9]+', '-', scope['path']).strip('-') or 'root'
+            path = os.path.join(self.output_dir, f'{mode}-{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10**9:09d}-{scope["method"].lower()}-{path}')
+            with open(path + '.txt', 'w') as f:
+                f.write(report)
+            filename = os.path.basename(store(path))
+            body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+            headers += [(b'content-length', str(len(body)).encode('latin-1')), (b'x-profile-file', filename.encode('latin-1'))]
+            await send(dict(start, headers=headers))
+            await send(dict(type='http.response.body', body=body))
+            return
+
+        # (ProfilingMiddleware_call_return) Send report instead of response
+        body = report.encode('utf-8')
+        headers = [
+            (b'content-type', b'text/plain; charset=utf-8'),
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'x-profile-status', str(start['status']).encode('latin-1'))
+        ]
+        await send(dict(type='http.response.start', status=200, headers=headers))
+        await send(dict(type='http.response.body', body=body))
\ No newline at end of file
@@ -0,0 +1,477 @@
+import asyncio
+import datetime
+import hashlib
+import math
+import sqlalchemy
+import time
+
+from .defaults import *
+
+def _to_timestamp(value):
+    """
+    Convert a naive UTC datetime, as stored in the users database, to a POSIX timestamp.
+
+    Parameters
+    ----------
+    value : :class:`datetime.datetime`
+        Naive datetime in UTC.
+
+    Return
+    ------
+    float
+        Seconds since the epoch.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    out = value.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return out
+
+class BloomFilter:
+    """
+    Fixed size bit array answering whether a key may have been added, with a small false positive rate, or was definitely not added.
+
+    * Adding and checking a key costs one BLAKE2b digest and ``hashes`` bit operations, whatever the number of keys
+    * Memory is about ``-capacity * ln(error_rate) / ln(2)^2`` bits, e.g. 18 KB for 10000 keys at 0.1%
+    * Keys cannot be removed, see :class:`msdss_users_api.revocation.RevocationList` for dropping expired keys
+
+    Parameters
+    ----------
+    capacity : int
+        Number of keys the filter is sized for. More keys can be added, raising the false positive rate above ``error_rate``.
+    error_rate : float
+        False positive rate when ``capacity`` keys are added.
+
+    Attributes
+    ----------
+    count : int
+        Number of keys added.
+    hashes : int
+        Number of bits set for each key.
+    size : int
+        Number of bits in the filter.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.revocation import BloomFilter
+
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        bloom.add('a')
+        print('a' in bloom)
+        print('b' in bloom)
+    """
+    def __init__(self, capacity=DEFAULT_REVOCATION_SETTINGS['capacity'], error_rate=DEFAULT_REVOCATION_SETTINGS['error_rate']):
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def __contains__(self, key):
+        for i in self._get_positions(key):
+            if not self._bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def _get_positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        out = [(h1 + i * h2) % self.size for i in range(self.hashes)]
+        return out
+
+    def add(self, key):
+        """
+        Add a key to the filter.
+
+        Parameters
+        ----------
+        key : str
+            Key to add.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        for i in self._get_positions(key):
+            self._bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+class RevocationList:
+    """
+    List of revoked JSON Web Tokens (JWTs) stored in the users database, with in-process Bloom filters in front so that checking a token that was not revoked needs no I/O.
+
+    * Tokens are revoked by their id (``jti`` claim) until they expire, such as on logout, or all tokens of a user issued (``iat`` claim) up to now are revoked, such as after a password reset
+    * Revocations are stored in a :class:`msdss_users_api.models.RevokedTokenTable` and loaded into each process.
+      Token ids are added to Bloom filters: a token whose id is not in the filters is not revoked, which costs a few hashes. Only possible matches (revoked tokens and about ``error_rate`` of the others) are confirmed with one primary key query
+    * Revocations of all tokens of a user are kept in memory as the time they were made, so tokens of users who reset their password are checked against their ``iat`` claim without a query
+    * Filters are updated incrementally: :meth:`msdss_users_api.revocation.RevocationList.sync` only loads revocations made since the last sync, using the ``revoked_at`` index.
+      Revocations made in this process apply immediately, and those made by other workers or servers apply within ``sync_interval`` seconds
+    * Filters are grouped into ``buckets`` by expiry time, each covering ``lifetime_seconds / buckets`` seconds, so a bucket is dropped as a whole once all of its tokens expired instead of rebuilding the filters.
+      Rows of expired tokens are deleted in batches at each sync
+    * Tokens without a ``jti`` claim, such as those issued before revocation was enabled, can only be revoked with the tokens of their user
+
+    Parameters
+    ----------
+    database : :class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase`
+        Async database to run queries with.
+    revoked_tokens : :class:`sqlalchemy:sqlalchemy.schema.Table`
+        SQLAlchemy revoked tokens table. See :class:`msdss_users_api.models.RevokedTokenTable`.
+    lifetime_seconds : int
+        Longest lifetime of the tokens, for which revocations of all tokens of a user are kept.
+    buckets : int
+        Number of expiry time buckets of Bloom filters.
+    capacity : int
+        Number of revoked tokens each bucket is sized for. See :class:`msdss_users_api.revocation.BloomFilter`.
+    error_rate : float
+        False positive rate of each bucket at ``capacity`` revoked tokens, which is the share of tokens that are not revoked but still need a query.
+    sync_interval : float
+        Number of seconds between syncs of the Bloom filters with the database.
+    sync_overlap : float
+        Number of seconds before the last sync to load revocations from again, so that revocations committed late or by servers with a slightly different clock are not missed.
+    batch_size : int
+        Number of expired revocations to delete in each query.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.models import RevokedTokenTable
+        from msdss_users_api.pool import PooledDatabase
+        from msdss_users_api.revocation import RevocationList
+
+        database_engine = Database()._connection
+        async_database = PooledDatabase(str(database_engine.url))
+        revocation = RevocationList(async_database, RevokedTokenTable.__table__, lifetime_seconds=900)
+    """
+    def __init__(
+        self,
+        database,
+        revoked_tokens,
+        lifetime_seconds=DEFAULT_JWT_SETTINGS['lifetime_seconds'],
+        buckets=DEFAULT_REVOCATION_SETTINGS['buckets'],
+        capacity=DEFAULT_REVOCATION_SETTINGS['capacity'],
+        error_rate=DEFAULT_REVOCATION_SETTINGS['error_rate'],
+        sync_interval=DEFAULT_REVOCATION_SETTINGS['sync_interval'],
+        sync_overlap=DEFAULT_REVOCATION_SETTINGS['sync_overlap'],
+        batch_size=DEFAULT_REVOCATION_SETTINGS['batch_size']):
+        self.database = database
+        self.revoked_tokens = revoked_tokens
+        self.lifetime_seconds = lifetime_seconds
+        self.buckets = buckets
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self.batch_size = batch_size
+        self._bucket_seconds = max(1.0, lifetime_seconds / buckets)
+        self._filters = {}
+        self._users = {}
+        self._synced_at = None
+        self._sync_task = None
+        self._stats = dict(checks=0, filtered=0, lookups=0, false_positives=0, revoked=0, synced=0, syncs=0, sync_errors=0, dropped=0, deleted=0)
+
+    def _add(self, key, expires, revoked_at):
+
+        # (RevocationList_add_user) Keep the latest revocation of all tokens of a user in memory
+        if key.startswith('user:'):
+            user_id = key[5:]
+            previous = self._users.get(user_id)
+            if previous is None or previous[0] < revoked_at:
+                self._users[user_id] = (revoked_at, expires)
+            return
+
+        # (RevocationList_add_token) Add token ids to the filter of their expiry bucket
+        bucket = int(expires // self._bucket_seconds)
+        if bucket not in self._filters:
+            self._filters[bucket] = BloomFilter(self.capacity, self.error_rate)
+        self._filters[bucket].add(key)
+
+    def _drop_expired(self):
+        now = time.time()
+        expired = [bucket for bucket in self._filters if (bucket + 1) * self._bucket_seconds <= now]
+        for bucket in expired:
+            del self._filters[bucket]
+        self._stats['dropped'] += len(expired)
+        for user_id in [user_id for user_id, (revoked_at, expires) in self._users.items() if expires <= now]:
+            del self._users[user_id]
+
+    def _may_contain(self, key, expires=None):
+
+        # (RevocationList_may_contain_bucket) Check only the bucket of the expiry time if it is known
+        if expires is not None:
+            bloom = self._filters.get(int(expires // self._bucket_seconds))
+            out = bloom is not None and key in bloom
+            return out
+
+        # (RevocationList_may_contain_all) Check all buckets otherwise
+        out = any(key in bloom for bloom in self._filters.values())
+        return out
+
+    async def _revoke(self, keys, expires):
+        now = datetime.datetime.utcnow()
+        table = self.revoked_tokens
+        async with self.database.transaction():
+            await self.database.execute(table.delete().where(table.c.token_key.in_(keys)))
+            await self.database.execute_many(table.insert(), [dict(
+                token_key=key,
+                expires_at=datetime.datetime.utcfromtimestamp(expires),
+                revoked_at=now
+            ) for key in keys])
+        for key in keys:
+            self._add(key, expires, _to_timestamp(now))
+        self._stats['revoked'] += len(keys)
+
+    async def delete_expired(self, batch_size=DEFAULT_REVOCATION_SETTINGS['batch_size']):
+        """
+        Delete revocations of expired tokens in batches, so that each delete only holds locks on a few rows.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of revocations to delete in each query.
+
+        Returns
+        -------
+        int
+            Number of deleted revocations.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = 0
+        now = datetime.datetime.utcnow()
+        table = self.revoked_tokens
+        while True:
+            query = sqlalchemy.select(table.c.token_key).where(table.c.expires_at < now).limit(batch_size)
+            keys = [row['token_key'] for row in await self.database.fetch_all(query)]
+            if keys:
+                await self.database.execute(table.delete().where(table.c.token_key.in_(keys)))
+                out += len(keys)
+            if len(keys) < batch_size:
+                break
+        self._stats['deleted'] += out
+        return out
+
+    def get_stats(self):
+        """
+        Get statistics of the revocation list.
+
+        Returns
+        -------
+        dict
+            A dictionary with keys:
+
+            * ``checks``: tokens checked
+            * ``filtered``: tokens found not revoked by the Bloom filters without a query
+            * ``lookups``: tokens confirmed with a query
+            * ``false_positives``: confirmed tokens that were not revoked
+            * ``revoked``: revocations made in this process
+            * ``synced``, ``syncs``, and ``sync_errors``: revocations loaded, syncs, and failed syncs
+            * ``dropped``: buckets of expired tokens dropped
+            * ``deleted``: rows of expired tokens deleted
+            * ``buckets`` and ``keys``: current number of buckets and of keys added to their filters, counting keys loaded again by overlapping syncs
+            * ``users``: current number of users with all of their tokens revoked
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = dict(
+            **self._stats,
+            buckets=len(self._filters),
+            keys=sum(bloom.count for bloom in self._filters.values()),
+            users=len(self._users)
+        )
+        return out
+
+    async def is_revoked(self, claims):
+        """
+        Check whether a decoded token was revoked.
+
+        Parameters
+        ----------
+        claims : dict
+            Claims of the decoded token, using ``jti``, ``exp``, ``user_id``, and ``iat``.
+
+        Returns
+        -------
+        bool
+            ``True`` if the token was revoked by its id, or if it was issued before or when the tokens of its user were revoked.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        self._stats['checks'] += 1
+
+        # (RevocationList_is_revoked_user) Check the issue time against revocations of all tokens of the user in memory
+        user = self._users.get(str(claims.get('user_id')))
+        if user is not None and user[1] > time.time():
+            iat = claims.get('iat')
+            if iat is None or iat <= user[0]:
+                return True
+
+        # (RevocationList_is_revoked_filter) Check the token id in the Bloom filters without I/O
+        jti = claims.get('jti')
+        if jti is None or not self._may_contain(jti, claims.get('exp')):
+            self._stats['filtered'] += 1
+            return False
+
+        # (RevocationList_is_revoked_lookup) Confirm possible matches with the database
+        self._stats['lookups'] += 1
+        table = self.revoked_tokens
+        query = sqlalchemy.select(table.c.expires_at).where(table.c.token_key == jti)
+        expires_at = await self.database.fetch_val(query)
+        out = expires_at is not None and expires_at > datetime.datetime.utcnow()
+        if not out:
+            self._stats['false_positives'] += 1
+        return out
+
+    async def revoke_token(self, claims):
+        """
+        Revoke a decoded token until it expires, such as on logout.
+
+        Parameters
+        ----------
+        claims : dict
+            Claims of the decoded token, using ``jti`` and ``exp``.
+
+        Returns
+        -------
+        bool
+            ``True`` if the token was revoked, or ``False`` if it has no ``jti`` claim, in which case use :meth:`msdss_users_api.revocation.RevocationList.revoke_user`.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        jti = claims.get('jti')
+        if jti is None:
+            return False
+        expires = claims.get('exp') or time.time() + self.lifetime_seconds
+        await self._revoke([jti], expires)
+        return True
+
+    async def revoke_user(self, user_id):
+        """
+        Revoke all tokens of a user issued up to now, such as after a password reset or change.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID` or str
+            Id of the user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self._revoke(['user:' + str(user_id)], time.time() + self.lifetime_seconds)
+
+    async def revoke_users(self, user_ids):
+        """
+        Revoke all tokens of many users issued up to now in one transaction, such as after deactivating them in bulk.
+
+        Parameters
+        ----------
+        user_ids : list(:class:`uuid.UUID` or str)
+            Ids of the users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if user_ids:
+            await self._revoke(['user:' + str(user_id) for user_id in user_ids], time.time() + self.lifetime_seconds)
+
+    async def run_sync(self):
+        """
+        Sync the Bloom filters, drop expired buckets, and delete expired revocations every ``sync_interval`` seconds until cancelled.
+
+        * Errors are counted in the ``sync_errors`` statistic and the next sync runs as usual
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+                await self.delete_expired(self.batch_size)
+            except Exception:
+                self._stats['sync_errors'] += 1
+
+    def start_sync(self):
+        """
+        Start the background sync task on the running event loop if it is not running.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.get_running_loop().create_task(self.run_sync())
+
+    async def stop_sync(self):
+        """
+        Stop the background sync task if it is running.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        task = self._sync_task
+        self._sync_task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def sync(self):
+        """
+        Add revocations made since the last sync to the Bloom filters and revoked users, and drop expired ones.
+
+        * The first sync loads all revocations of tokens that have not expired
+
+        Returns
+        -------
+        int
+            Number of revocations loaded.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        now = datetime.datetime.utcnow()
+        table = self.revoked_tokens
+
+        # (RevocationList_sync_query) Load revocations of unexpired tokens made since the last sync
+        query = sqlalchemy.select(table.c.token_key, table.c.expires_at, table.c.revoked_at).where(table.c.expires_at > now)
+        if self._synced_at is not None:
+            query = query.where(table.c.revoked_at > self._synced_at - datetime.timedelta(seconds=self.sync_overlap))
+        rows = await self.database.fetch_all(query)
+
+        # (RevocationList_sync_add) Add revocations to the filters of their buckets or to the revoked users
+        self._drop_expired()
+        for row in rows:
+            self._add(row['token_key'], _to_timestamp(row['expires_at']), _to_timestamp(row['revoked_at']))
+        self._synced_at = now
+        self._stats['synced'] += len(rows)
+        self._stats['syncs'] += 1
+        out = len(rows)
+        return out
\ No newline at end of file
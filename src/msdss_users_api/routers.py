@@ -1,12 +1,120 @@
+import functools
+import inspect
+import pydantic
+
 from copy import deepcopy
-from fastapi import APIRouter, Depends, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import APIRoute
+from typing import List, Optional
 
 from .defaults import *
 from .tools import *
 
+def _get_fast_content(content, model):
+    """
+    Get the JSON content of a route response from its response model without validating it again.
+
+    * Only fields of ``model`` are kept, so that fields such as ``hashed_password`` of :class:`msdss_users_api.models.UserDB` are not returned
+    * Values of fields that are response models themselves, or lists of them, are converted with their own fields
+
+    Parameters
+    ----------
+    content : :class:`pydantic:pydantic.BaseModel` or dict
+        Content returned from a route, such as a :class:`msdss_users_api.models.UserDB`.
+    model : :class:`pydantic:pydantic.BaseModel`
+        Response model of the route, such as :class:`msdss_users_api.models.User`.
+
+    Return
+    ------
+    dict
+        Values of the fields of ``model`` in ``content``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    get = content.get if isinstance(content, dict) else functools.partial(getattr, content)
+    out = {}
+    for name, field in model.__fields__.items():
+        value = get(name, field.default)
+        if inspect.isclass(field.type_) and issubclass(field.type_, pydantic.BaseModel) and value is not None:
+            value = [_get_fast_content(v, field.type_) for v in value] if isinstance(value, (list, tuple)) else _get_fast_content(value, field.type_)
+        out[field.alias] = value
+    return out
+
+def _include_auth_router(router, auth_router, settings, login_throttle=None):
+    """
+    Include an auth router, adding a login throttle to its login route only.
+
+    Parameters
+    ----------
+    router : :class:`fastapi:fastapi.routing.APIRouter`
+        Router to include the auth routes in.
+    auth_router : :class:`fastapi:fastapi.routing.APIRouter`
+        Auth router from :meth:`fastapi_users:fastapi_users.FastAPIUsers.get_auth_router`.
+    settings : dict
+        Keyword arguments passed to :meth:`fastapi:fastapi.routing.APIRouter.include_router`.
+    login_throttle : :class:`msdss_users_api.throttling.LoginThrottle` or None
+        Dependency run before the password is verified on the login route. If ``None``, all routes are included as is.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    if login_throttle is None:
+        router.include_router(auth_router, **settings)
+        return
+
+    # (_include_auth_router_split) Split login route from other auth routes
+    login_router = APIRouter()
+    other_router = APIRouter()
+    for route in auth_router.routes:
+        (login_router if getattr(route, 'path', None) == '/login' else other_router).routes.append(route)
+
+    # (_include_auth_router_include) Include login route with throttle
+    login_settings = dict(settings)
+    login_settings['dependencies'] = list(settings.get('dependencies', [])) + [Depends(login_throttle)]
+    router.include_router(login_router, **login_settings)
+    router.include_router(other_router, **settings)
+
+def _use_fast_responses(router):
+    """
+    Make the routes of a router return their content as ``orjson`` encoded responses without validating it again against their response models.
+
+    * Routes keep their response models, so the open api spec is unchanged
+    * Content is converted with :func:`msdss_users_api.routers._get_fast_content`, so it must already be valid for the response model, such as a :class:`msdss_users_api.models.UserDB` for a :class:`msdss_users_api.models.User`
+    * Routes that return responses, such as ``204`` responses, are not changed
+
+    Parameters
+    ----------
+    router : :class:`fastapi:fastapi.routing.APIRouter`
+        Router whose routes are changed before it is included.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    for route in router.routes:
+        if not isinstance(route, APIRoute) or route.response_model is None or not inspect.iscoroutinefunction(route.endpoint):
+            continue
+
+        # (_use_fast_responses_endpoint) Wrap endpoint, keeping its signature for dependencies
+        endpoint = route.endpoint
+        @functools.wraps(endpoint)
+        async def fast_endpoint(*args, _endpoint=endpoint, _model=route.response_model, _status_code=route.status_code or 200, **kwargs):
+            content = await _endpoint(*args, **kwargs)
+            if isinstance(content, Response):
+                return content
+            out = ORJSONResponse(_get_fast_content(content, _model), status_code=_status_code)
+            return out
+        route.endpoint = fast_endpoint
+
 def get_users_router(
     fastapi_users_objects=None,
     route_settings=DEFAULT_USERS_ROUTE_SETTINGS,
+    login_throttle=None,
+    fast_responses=False,
     *args, **kwargs):
     """
     Get a users router.
@@ -23,6 +131,8 @@ def get_users_router(
         * ``_enable`` (bool): Whether this route should be included or not
         * ``_get_user`` (dict or None): Additional arguments passed to the :meth:`msdss_users_api.msdss_users_api.core.UsersAPI.get_current_user` function for the route - if ``None``, a dependency will not be added
         * ``_enable_refresh (bool): Only applies to ``jwt`` route - whether to include a jwt refresh route or not
+        * If ``fastapi_users_objects`` has a ``refresh_token_db``, the ``jwt`` route also has ``POST /refresh-token`` exchanging a refresh token for a new access token (and a rotated refresh token), and ``POST /revoke`` revoking a refresh token
+        * ``_enable_list`` (bool): Only applies to ``users`` route - whether to include a ``GET`` route listing pages of users for superusers or not, see :meth:`msdss_users_api.adapters.UserDatabase.get_page`
         * ``**kwargs``: Additional arguments passed to the :meth:`fastapi:fastapi.FastAPI.include_router` method for this route
         
         The default settings are:
@@ -36,6 +146,12 @@ def get_users_router(
         
         Any unspecified settings will be replaced by their defaults.
 
+    login_throttle : :class:`msdss_users_api.throttling.LoginThrottle` or None
+        Dependency limiting attempts on the ``jwt`` and ``cookie`` login routes before any password is verified. If ``None``, login attempts are not limited.
+    fast_responses : bool
+        Whether to encode responses with ``orjson`` and skip validating users again against the ``User`` response model or not.
+        Users returned by routes already come from :class:`msdss_users_api.models.UserDB`, so only their ``User`` fields are copied. See :func:`msdss_users_api.routers._use_fast_responses`.
+        Requires ``orjson`` (``pip install msdss-users-api[fast]``).
     *args, **kwargs
         Additional arguments passed to :class:`fastapi:fastapi.routing.APIRouter`.
     
@@ -102,8 +218,11 @@ def get_users_router(
     # (get_users_router_api) Create users api objs
     users_api = fastapi_users_objects['FastAPIUsers']
     jwt = fastapi_users_objects['auth']['jwt']
+    refresh_token_db = fastapi_users_objects['auth'].get('refresh_token_db')
     cookie = fastapi_users_objects['auth']['cookie']
     UserManager = fastapi_users_objects['models']['UserManager']
+    User = fastapi_users_objects['models']['User']
+    get_user_manager = fastapi_users_objects['dependencies']['get_user_manager']
 
     # (get_users_router_defaults) Merge defaults and user params 
     settings = deepcopy(DEFAULT_USERS_ROUTE_SETTINGS)
@@ -119,6 +238,16 @@ def get_users_router(
         del v['_get_user']
         enable[k] = v.pop('_enable')
     enable_jwt_refresh = settings['jwt'].pop('_enable_refresh', True)
+    enable_users_list = settings['users'].pop('_enable_list', True)
+
+    # (get_users_router_fast) Encode auth responses with orjson if needed
+    if fast_responses:
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError('Fast responses require orjson, install it with pip install msdss-users-api[fast]')
+        for k in ['jwt', 'cookie']:
+            settings[k]['default_response_class'] = ORJSONResponse
 
     # (get_users_route_jwt) Add jwt auth route
     if enable['jwt']:
@@ -130,15 +259,36 @@ def get_users_router(
         if enable_jwt_refresh:
             @jwt_router.post('/refresh')
             async def refresh_jwt(response: Response, user=Depends(users_api.current_user(active=True))):
-                return await jwt.get_login_response(user, response, UserManager)
+                out = dict(access_token=await jwt._generate_token(user), token_type='bearer')
+                return out
+
+        # (get_users_route_jwt_refresh_token) Create refresh token exchange and revoke routes
+        if refresh_token_db is not None:
+
+            class RefreshTokenBody(pydantic.BaseModel):
+                refresh_token: str
+
+            @jwt_router.post('/refresh-token')
+            async def exchange_refresh_token(body: RefreshTokenBody):
+                exchanged = await refresh_token_db.exchange(body.refresh_token)
+                if exchanged is None:
+                    raise HTTPException(status_code=400, detail='REFRESH_TOKEN_INVALID')
+                user, refresh_token = exchanged
+                out = dict(access_token=await jwt._generate_token(user), token_type='bearer', refresh_token=refresh_token)
+                return out
+
+            @jwt_router.post('/revoke', status_code=204)
+            async def revoke_refresh_token(body: RefreshTokenBody):
+                await refresh_token_db.revoke(body.refresh_token)
+                return Response(status_code=204)
 
         # (get_users_route_jwt_include) Include jwt route
-        out.include_router(jwt_router, **settings['jwt'])
+        _include_auth_router(out, jwt_router, settings['jwt'], login_throttle)
 
     # (get_users_route_auth_cookie) Add cookie auth route
     if enable['cookie']:
         auth_cookie_router = users_api.get_auth_router(cookie)
-        out.include_router(auth_cookie_router, **settings['cookie'])
+        _include_auth_router(out, auth_cookie_router, settings['cookie'], login_throttle)
 
     # (get_users_route_register) Add register router
     if enable['register']:
@@ -146,6 +296,8 @@ def get_users_router(
             settings['register']['dependencies'] = settings['register'].get('dependencies', [])
             settings['register']['dependencies'].append(Depends(get_user['register']))
         register_router = users_api.get_register_router()
+        if fast_responses:
+            _use_fast_responses(register_router)
         out.include_router(register_router, **settings['register'])
 
     # (get_users_route_verify) Add verify router
@@ -154,6 +306,8 @@ def get_users_router(
             settings['verify']['dependencies'] = settings['verify'].get('dependencies', [])
             settings['verify']['dependencies'].append(Depends(get_user['verify']))
         verify_router = users_api.get_verify_router()
+        if fast_responses:
+            _use_fast_responses(verify_router)
         out.include_router(verify_router, **settings['verify'])
     
     # (get_users_route_reset) Add reset password router
@@ -162,6 +316,8 @@ def get_users_router(
             settings['reset']['dependencies'] = settings['reset'].get('dependencies', [])
             settings['reset']['dependencies'].append(Depends(get_user['reset']))
         reset_router = users_api.get_reset_password_router()
+        if fast_responses:
+            _use_fast_responses(reset_router)
         out.include_router(reset_router, **settings['reset'])
 
     # (get_users_route_users) Add users router
@@ -170,6 +326,35 @@ def get_users_router(
             settings['users']['dependencies'] = settings['users'].get('dependencies', [])
             settings['users']['dependencies'].append(Depends(get_user['users']))
         users_router = users_api.get_users_router()
+
+        # (get_users_route_users_list) Create keyset paginated users list route for superusers
+        if enable_users_list:
+            UserPage = pydantic.create_model('UserPage', items=(List[User], ...), next_cursor=(Optional[str], None))
+
+            @users_router.get('', response_model=UserPage, dependencies=[Depends(users_api.current_user(active=True, superuser=True))], name='users:users')
+            async def list_users(
+                limit: int = Query(DEFAULT_USER_LIST_SETTINGS['limit'], ge=1, le=DEFAULT_USER_LIST_SETTINGS['max_limit']),
+                cursor: Optional[str] = None,
+                is_active: Optional[bool] = None,
+                is_superuser: Optional[bool] = None,
+                is_verified: Optional[bool] = None,
+                email_prefix: Optional[str] = None,
+                user_manager=Depends(get_user_manager)):
+                try:
+                    items, next_cursor = await user_manager.user_db.get_page(
+                        limit=limit,
+                        cursor=cursor,
+                        is_active=is_active,
+                        is_superuser=is_superuser,
+                        is_verified=is_verified,
+                        email_prefix=email_prefix)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                return dict(items=items, next_cursor=next_cursor)
+
+        # (get_users_route_users_include) Include users route
+        if fast_responses:
+            _use_fast_responses(users_router)
         out.include_router(users_router, **settings['users'])
 
     return out
@@ -0,0 +1,270 @@
+import importlib
+import json
+import os
+
+from .defaults import *
+
+def _check_server_option(name, value, module):
+    """
+    Check that an optional server implementation is installed.
+
+    Parameters
+    ----------
+    name : str
+        Name of the ``uvicorn`` option, such as ``loop`` or ``http``.
+    value : str
+        Value of the option, such as ``uvloop`` or ``httptools``.
+    module : str
+        Name of the module that the value requires.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    if value == module:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            raise ImportError(f'Server option {name}={value} requires {module}, install it with pip install msdss-users-api[server]')
+
+def _get_start_kwargs(start_args_env=DEFAULT_SERVER_SETTINGS['start_args_env']):
+    """
+    Get the ``msdss-users start`` arguments passed to server workers in an environment variable.
+
+    Parameters
+    ----------
+    start_args_env : str
+        Name of the environment variable holding the arguments as JSON.
+
+    Return
+    ------
+    dict
+        Arguments of :func:`msdss_users_api.server.create_app`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    if start_args_env not in os.environ:
+        raise RuntimeError(f'Server workers require the {start_args_env} environment variable, start them with msdss-users start or msdss_users_api.server.run_server')
+    out = json.loads(os.environ[start_args_env])
+    return out
+
+def create_app(start_kwargs=None):
+    """
+    Create the app of a users API server from ``msdss-users start`` arguments.
+
+    * Used as the ``uvicorn`` app factory of each worker started by :func:`msdss_users_api.server.run_server`, so that each worker process creates its own :class:`msdss_users_api.core.UsersAPI` with its own connection pool, password hashing pool, user cache, and login throttle
+    * Arguments only hold plain values (e.g. ``user_cache_size`` instead of a :class:`msdss_users_api.cache.UserCache`), so they can be passed to workers as JSON
+
+    Parameters
+    ----------
+    start_kwargs : dict or None
+        Arguments of the ``msdss-users start`` command except server options, such as ``jwt_lifetime``, ``hash_executor``, ``user_cache_size``, and ``pool_max_size``,
+        plus ``env_file`` and ``key_path``. If ``None``, they are read from the environment variable named ``start_args_env`` in :data:`msdss_users_api.defaults.DEFAULT_SERVER_SETTINGS`.
+
+    Return
+    ------
+    :class:`fastapi:fastapi.FastAPI`
+        The app of the users API.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. code-block:: python
+
+        from msdss_users_api.server import create_app
+
+        app = create_app(dict(env_file='./.env', jwt_lifetime=900, user_cache_size=10000))
+
+    Run workers directly with ``uvicorn`` after setting ``MSDSS_USERS_START_ARGS`` (e.g. to ``{"env_file": "./.env"}``):
+
+    >>> uvicorn msdss_users_api.server:create_app --factory --workers 4
+    """
+    from msdss_base_database import Database, DatabaseDotEnv
+    from .cache import UserCache
+    from .cli import _parse_route_settings
+    from .core import UsersAPI
+    from .env import UsersDotEnv
+    from .hashing import PasswordExecutor
+    from .throttling import LoginThrottle, RedisTokenBucketStore
+
+    # (create_app_kwargs) Get arguments
+    kwargs = dict(start_kwargs) if start_kwargs is not None else _get_start_kwargs()
+
+    # (create_app_env) Set env and database
+    env_kwargs = dict(
+        env_file=kwargs.pop('env_file', './.env'),
+        key_path=kwargs.pop('key_path', None)
+    )
+    kwargs['env'] = UsersDotEnv(**env_kwargs)
+    kwargs['database'] = Database(env=DatabaseDotEnv(**env_kwargs))
+
+    # (create_app_settings) Convert route settings
+    cli_route_settings = kwargs.pop('set', None)
+    kwargs['users_router_settings'] = dict(
+        route_settings=_parse_route_settings(cli_route_settings) if cli_route_settings else {}
+    )
+
+    # (create_app_hashing) Create password hashing pool
+    hash_executor = kwargs.pop('hash_executor', None)
+    hash_workers = kwargs.pop('hash_workers', None)
+    kwargs['password_executor'] = PasswordExecutor(hash_executor, max_workers=hash_workers) if hash_executor else None
+
+    # (create_app_hasher) Extract password hasher settings
+    hasher_settings = {k[5:]: kwargs.pop(k) for k in ('hash_memory_cost', 'hash_parallelism') if k in kwargs}
+    kwargs['hasher_settings'] = {k: v for k, v in hasher_settings.items() if v is not None}
+
+    # (create_app_cache) Create user cache
+    user_cache_size = kwargs.pop('user_cache_size', 0)
+    user_cache_ttl = kwargs.pop('user_cache_ttl', DEFAULT_USER_CACHE_SETTINGS['ttl'])
+    kwargs['user_cache'] = UserCache(max_size=user_cache_size, ttl=user_cache_ttl) if user_cache_size > 0 else None
+
+    # (create_app_throttle) Create login throttle
+    throttle_kwargs = {k[9:]: kwargs.pop(k) for k in list(kwargs) if k.startswith('throttle_')}
+    throttle_redis = throttle_kwargs.pop('redis', None)
+    throttle_store = RedisTokenBucketStore(throttle_redis) if throttle_redis else None
+    kwargs['login_throttle'] = LoginThrottle(store=throttle_store, **throttle_kwargs) if kwargs.pop('throttle', False) else None
+
+    # (create_app_pool) Extract connection pool settings
+    kwargs['pool_settings'] = {k[5:]: kwargs.pop(k) for k in list(kwargs) if k.startswith('pool_')}
+    kwargs['pool_settings'] = {k: v for k, v in kwargs['pool_settings'].items() if v is not None}
+
+    # (create_app_sessions) Extract session settings
+    session_path = kwargs.pop('session_path', DEFAULT_SESSION_SETTINGS['path'])
+    kwargs['session_settings'] = dict(path=session_path) if kwargs.get('sessions') == 'kv' else {}
+
+    # (create_app_revocation) Extract token revocation settings
+    revocation_sync_interval = kwargs.pop('revocation_sync_interval', DEFAULT_REVOCATION_SETTINGS['sync_interval'])
+    kwargs['revocation_settings'] = dict(sync_interval=revocation_sync_interval)
+
+    # (create_app_profiling) Extract profiling settings
+    kwargs['profiling_settings'] = dict(output_dir=kwargs.pop('profile_dir', None))
+
+    # (create_app_return) Create users api
+    out = UsersAPI(**kwargs).api
+    return out
+
+def run_server(
+    start_kwargs={},
+    host='127.0.0.1',
+    port=8000,
+    log_level='info',
+    workers=DEFAULT_SERVER_SETTINGS['workers'],
+    loop=DEFAULT_SERVER_SETTINGS['loop'],
+    http=DEFAULT_SERVER_SETTINGS['http'],
+    timeout_keep_alive=DEFAULT_SERVER_SETTINGS['timeout_keep_alive'],
+    backlog=DEFAULT_SERVER_SETTINGS['backlog'],
+    limit_max_requests=DEFAULT_SERVER_SETTINGS['limit_max_requests'],
+    limit_max_requests_jitter=DEFAULT_SERVER_SETTINGS['limit_max_requests_jitter'],
+    timeout_graceful_shutdown=DEFAULT_SERVER_SETTINGS['timeout_graceful_shutdown'],
+    start_args_env=DEFAULT_SERVER_SETTINGS['start_args_env'],
+    **kwargs):
+    """
+    Run a users API server with one or more worker processes.
+
+    * With one worker, the app is created and served in this process
+    * With more workers, ``uvicorn`` starts (pre-forks) ``workers`` processes sharing one socket, each creating its own app with :func:`msdss_users_api.server.create_app`, and restarts workers that exit.
+      Password hashing, which is CPU bound, then runs on all cores instead of one
+    * Pending schema migrations are applied once before workers start if ``migrate`` is not ``False`` in ``start_kwargs``, so workers do not race to apply them
+    * If ``hash_executor`` is ``process`` and ``hash_workers`` is not set in ``start_kwargs``, each worker gets an equal share of the cpus for hashing instead of one process per cpu
+    * In-process state such as the user cache and login throttle is not shared between workers. Use ``throttle_redis`` to share login limits
+    * ``limit_max_requests`` gracefully restarts each worker after that many requests (plus up to ``limit_max_requests_jitter`` so that workers do not restart together),
+      which bounds memory growth from fragmentation or leaks in long running workers
+
+    Parameters
+    ----------
+    start_kwargs : dict
+        Arguments passed to :func:`msdss_users_api.server.create_app`.
+    host : str
+        Address to host the server.
+    port : int
+        Port to host the server.
+    log_level : str
+        Level of verbose messages to display.
+    workers : int
+        Number of worker processes.
+    loop : str
+        One of ``auto``, ``asyncio``, or ``uvloop``. ``uvloop`` requires ``pip install msdss-users-api[server]``.
+    http : str
+        One of ``auto``, ``h11``, or ``httptools``. ``httptools`` requires ``pip install msdss-users-api[server]``.
+    timeout_keep_alive : int
+        Seconds to keep idle connections open for reuse by clients.
+    backlog : int
+        Maximum number of connections waiting to be accepted.
+    limit_max_requests : int or None
+        Number of requests after which each worker is restarted. If ``None``, workers are not restarted.
+    limit_max_requests_jitter : int
+        Maximum random number of requests added to ``limit_max_requests`` for each worker. Values other than ``0`` require ``uvicorn>=0.41`` (Python 3.10 or later).
+    timeout_graceful_shutdown : int or None
+        Seconds to wait for open requests to finish when a worker stops. If ``None``, wait until they finish.
+    start_args_env : str
+        Name of the environment variable used to pass ``start_kwargs`` to workers.
+    **kwargs
+        Additional arguments passed to :func:`uvicorn.run`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. code-block:: python
+
+        from msdss_users_api.server import run_server
+
+        # Serve with 4 workers on uvloop and httptools, restarting each worker after about 10000 requests
+        run_server(
+            dict(env_file='./.env', hash_executor='thread'),
+            workers=4,
+            loop='uvloop',
+            http='httptools',
+            limit_max_requests=10000,
+            limit_max_requests_jitter=1000
+        )
+    """
+    import uvicorn
+
+    # (run_server_check) Check optional server implementations
+    _check_server_option('loop', loop, 'uvloop')
+    _check_server_option('http', http, 'httptools')
+
+    # (run_server_options) Set server options
+    server_kwargs = dict(
+        host=host,
+        port=port,
+        log_level=log_level,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=timeout_keep_alive,
+        backlog=backlog,
+        limit_max_requests=limit_max_requests,
+        timeout_graceful_shutdown=timeout_graceful_shutdown,
+        **kwargs
+    )
+    if limit_max_requests_jitter:
+        server_kwargs['limit_max_requests_jitter'] = limit_max_requests_jitter
+
+    # (run_server_single) Serve in this process with one worker
+    if workers <= 1:
+        uvicorn.run(create_app(start_kwargs), **server_kwargs)
+        return
+
+    # (run_server_migrate) Apply pending migrations once before starting workers
+    start_kwargs = dict(start_kwargs)
+    if start_kwargs.get('migrate', True):
+        from msdss_base_database import Database, DatabaseDotEnv
+        from .migrations import migrate_schema
+        database = Database(env=DatabaseDotEnv(env_file=start_kwargs.get('env_file', './.env'), key_path=start_kwargs.get('key_path')))
+        migrate_schema(database._connection)
+
+    # (run_server_hashing) Share cpus between hashing pools of workers
+    if start_kwargs.get('hash_executor') == 'process' and not start_kwargs.get('hash_workers'):
+        start_kwargs['hash_workers'] = max(1, (os.cpu_count() or 1) // workers)
+
+    # (run_server_workers) Serve with worker processes, each creating its own app
+    os.environ[start_args_env] = json.dumps(start_kwargs)
+    uvicorn.run('msdss_users_api.server:create_app', factory=True, workers=workers, **server_kwargs)
\ No newline at end of file
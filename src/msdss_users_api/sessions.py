@@ -0,0 +1,756 @@
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import heapq
+import secrets
+import sqlite3
+import sqlalchemy
+import threading
+import time
+import uuid
+
+from .adapters import hash_token
+from .defaults import *
+
+class SessionStoreMixin:
+    """
+    Mixin for cookie session stores, adding a background task that deletes expired sessions in batches.
+
+    * Stores implement the coroutines ``create(user_id, lifetime_seconds)``, ``get(session_id)``, ``delete(session_id)``, ``delete_user(user_id)``, and ``delete_expired(batch_size)``
+    * Sessions of many users are deleted with :meth:`msdss_users_api.sessions.SessionStoreMixin.delete_users`, which stores can override with a single query
+    * Session ids are short opaque random strings, so cookies stay small and checking one is a single lookup instead of a signature check
+    * The cleanup task is started and stopped, and the store closed, with the app by :class:`msdss_users_api.core.UsersAPI`
+
+    Attributes
+    ----------
+    batch_size : int
+        Number of expired sessions to delete at a time.
+    cleanup_interval : float
+        Number of seconds between cleanups.
+    id_bytes : int
+        Number of random bytes in each session id.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    batch_size = DEFAULT_SESSION_SETTINGS['batch_size']
+    cleanup_interval = DEFAULT_SESSION_SETTINGS['cleanup_interval']
+    id_bytes = DEFAULT_SESSION_SETTINGS['id_bytes']
+
+    def _create_id(self):
+        out = secrets.token_urlsafe(self.id_bytes)
+        return out
+
+    def _get_cleanup_stats(self):
+        out = dict(
+            cleanups=self._cleanups,
+            cleanup_deleted=self._cleanup_deleted,
+            cleanup_errors=self._cleanup_errors
+        )
+        return out
+
+    def _init_cleanup(self, batch_size=DEFAULT_SESSION_SETTINGS['batch_size'], cleanup_interval=DEFAULT_SESSION_SETTINGS['cleanup_interval'], id_bytes=DEFAULT_SESSION_SETTINGS['id_bytes']):
+        self.batch_size = batch_size
+        self.cleanup_interval = cleanup_interval
+        self.id_bytes = id_bytes
+        self._cleanup_task = None
+        self._cleanups = 0
+        self._cleanup_deleted = 0
+        self._cleanup_errors = 0
+
+    def close(self):
+        """
+        Release the connections and threads of the store. Stores without any do nothing.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        pass
+
+    async def delete_users(self, user_ids):
+        """
+        Delete all sessions of many users, such as after deactivating them in bulk.
+
+        Parameters
+        ----------
+        user_ids : list(:class:`uuid.UUID`)
+            Ids of the users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        for user_id in user_ids:
+            await self.delete_user(user_id)
+
+    async def run_cleanup(self):
+        """
+        Delete expired sessions every ``cleanup_interval`` seconds until cancelled.
+
+        * Errors are counted in the ``cleanup_errors`` statistic and the next cleanup runs as usual
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                self._cleanup_deleted += await self.delete_expired(self.batch_size)
+                self._cleanups += 1
+            except Exception:
+                self._cleanup_errors += 1
+
+    def start_cleanup(self):
+        """
+        Start the background cleanup task on the running event loop if it is not running.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.get_running_loop().create_task(self.run_cleanup())
+
+    async def stop_cleanup(self):
+        """
+        Stop the background cleanup task if it is running.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        task = self._cleanup_task
+        self._cleanup_task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+class MemorySessionStore(SessionStoreMixin):
+    """
+    In-process store of cookie sessions with a least recently used (LRU) size limit.
+
+    * Looking up, creating, and revoking a session are O(1), and revoking all sessions of a user is O(number of sessions of the user)
+    * Expiry times are kept in a heap, so each cleanup batch only visits expired sessions
+    * The store is local to each process, so sessions created by one worker of a multi-process server are unknown to the others, and all sessions are lost on restart.
+      Use :class:`msdss_users_api.sessions.SQLSessionStore` or :class:`msdss_users_api.sessions.KeyValueSessionStore` with multiple workers
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of sessions to keep. The least recently used sessions are dropped first, logging out their users.
+    batch_size : int
+        Number of expired sessions to delete at a time.
+    cleanup_interval : float
+        Number of seconds between cleanups.
+    id_bytes : int
+        Number of random bytes in each session id.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import uuid
+        from msdss_users_api.sessions import MemorySessionStore
+        from pprint import pprint
+
+        store = MemorySessionStore(max_size=1000)
+        user_id = uuid.uuid4()
+        session_id = await store.create(user_id, lifetime_seconds=3600)
+        print(await store.get(session_id) == user_id)
+        await store.delete(session_id)
+        pprint(store.get_stats())
+    """
+    def __init__(
+        self,
+        max_size=DEFAULT_SESSION_SETTINGS['max_size'],
+        batch_size=DEFAULT_SESSION_SETTINGS['batch_size'],
+        cleanup_interval=DEFAULT_SESSION_SETTINGS['cleanup_interval'],
+        id_bytes=DEFAULT_SESSION_SETTINGS['id_bytes']):
+        self._init_cleanup(batch_size=batch_size, cleanup_interval=cleanup_interval, id_bytes=id_bytes)
+        self.max_size = max_size
+        self._sessions = collections.OrderedDict()
+        self._users = {}
+        self._expiries = []
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._expirations = 0
+
+    def _remove(self, session_id):
+        user_id, _ = self._sessions.pop(session_id)
+        user_sessions = self._users[user_id]
+        user_sessions.discard(session_id)
+        if not user_sessions:
+            del self._users[user_id]
+
+    async def create(self, user_id, lifetime_seconds):
+        """
+        Create a session for a user.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+        lifetime_seconds : int
+            Number of seconds the session is valid for.
+
+        Returns
+        -------
+        str
+            The opaque session id.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = self._create_id()
+        expires = time.time() + lifetime_seconds
+        with self._lock:
+
+            # (MemorySessionStore_create_evict) Drop least recently used session if full
+            if len(self._sessions) >= self.max_size:
+                self._remove(next(iter(self._sessions)))
+                self._evictions += 1
+
+            # (MemorySessionStore_create_add) Add session and its expiry
+            self._sessions[out] = (user_id, expires)
+            self._users.setdefault(user_id, set()).add(out)
+            heapq.heappush(self._expiries, (expires, out))
+
+            # (MemorySessionStore_create_compact) Rebuild expiries if removed sessions dominate the heap
+            if len(self._expiries) > 2 * self.max_size:
+                self._expiries = [(expires, k) for k, (_, expires) in self._sessions.items()]
+                heapq.heapify(self._expiries)
+        return out
+
+    async def delete(self, session_id):
+        """
+        Delete a session, logging it out.
+
+        Parameters
+        ----------
+        session_id : str
+            Id of the session.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    async def delete_expired(self, batch_size=DEFAULT_SESSION_SETTINGS['batch_size']):
+        """
+        Delete expired sessions in batches, releasing the lock and yielding to the event loop between batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of expired sessions to delete at a time.
+
+        Returns
+        -------
+        int
+            Number of deleted sessions.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = 0
+        now = time.time()
+        while True:
+            deleted = 0
+            with self._lock:
+                for _ in range(batch_size):
+                    if not self._expiries or self._expiries[0][0] > now:
+                        break
+                    expires, session_id = heapq.heappop(self._expiries)
+                    entry = self._sessions.get(session_id)
+                    if entry is not None and entry[1] == expires:
+                        self._remove(session_id)
+                        deleted += 1
+                done = not self._expiries or self._expiries[0][0] > now
+            out += deleted
+            self._expirations += deleted
+            if done:
+                break
+            await asyncio.sleep(0)
+        return out
+
+    async def delete_user(self, user_id):
+        """
+        Delete all sessions of a user, such as after a password change.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        with self._lock:
+            for session_id in list(self._users.get(user_id, ())):
+                self._remove(session_id)
+
+    async def get(self, session_id):
+        """
+        Get the user of a session.
+
+        Parameters
+        ----------
+        session_id : str
+            Id of the session.
+
+        Returns
+        -------
+        :class:`uuid.UUID` or None
+            Id of the user, or ``None`` if the session does not exist or expired.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._sessions.move_to_end(session_id)
+        out = entry[0]
+        return out
+
+    def get_stats(self):
+        """
+        Get statistics of the store.
+
+        Returns
+        -------
+        dict
+            A dictionary with keys ``sessions`` (number of sessions held), ``users`` (number of users with sessions), ``evictions`` (sessions dropped for space),
+            ``expirations`` (expired sessions deleted), and ``cleanups``, ``cleanup_deleted``, and ``cleanup_errors`` of the background cleanup.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = dict(
+            sessions=len(self._sessions),
+            users=len(self._users),
+            evictions=self._evictions,
+            expirations=self._expirations,
+            **self._get_cleanup_stats()
+        )
+        return out
+
+class SQLSessionStore(SessionStoreMixin):
+    """
+    Store of cookie sessions in the users database, so that sessions are shared by all workers and servers and survive restarts.
+
+    * Sessions are stored as hashes of their ids in a :class:`msdss_users_api.models.SessionTable`, so looking one up is one query on the primary key index
+    * Expired sessions are deleted in batches using the ``expires_at`` index, each batch in its own short query
+
+    Parameters
+    ----------
+    database : :class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase`
+        Async database to run queries with.
+    sessions : :class:`sqlalchemy:sqlalchemy.schema.Table`
+        SQLAlchemy sessions table. See :class:`msdss_users_api.models.SessionTable`.
+    batch_size : int
+        Number of expired sessions to delete in each query.
+    cleanup_interval : float
+        Number of seconds between cleanups.
+    id_bytes : int
+        Number of random bytes in each session id.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_base_database import Database
+        from msdss_users_api.models import SessionTable
+        from msdss_users_api.pool import PooledDatabase
+        from msdss_users_api.sessions import SQLSessionStore
+
+        database_engine = Database()._connection
+        async_database = PooledDatabase(str(database_engine.url))
+        store = SQLSessionStore(async_database, SessionTable.__table__)
+    """
+    def __init__(
+        self,
+        database,
+        sessions,
+        batch_size=DEFAULT_SESSION_SETTINGS['batch_size'],
+        cleanup_interval=DEFAULT_SESSION_SETTINGS['cleanup_interval'],
+        id_bytes=DEFAULT_SESSION_SETTINGS['id_bytes']):
+        self._init_cleanup(batch_size=batch_size, cleanup_interval=cleanup_interval, id_bytes=id_bytes)
+        self.database = database
+        self.sessions = sessions
+
+    async def create(self, user_id, lifetime_seconds):
+        """
+        Create a session for a user. See :meth:`msdss_users_api.sessions.MemorySessionStore.create`.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+        lifetime_seconds : int
+            Number of seconds the session is valid for.
+
+        Returns
+        -------
+        str
+            The opaque session id. Only its hash is stored.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = self._create_id()
+        await self.database.execute(self.sessions.insert(), dict(
+            session_hash=hash_token(out),
+            user_id=user_id,
+            expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=lifetime_seconds)
+        ))
+        return out
+
+    async def delete(self, session_id):
+        """
+        Delete a session, logging it out.
+
+        Parameters
+        ----------
+        session_id : str
+            Id of the session.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self.database.execute(self.sessions.delete().where(self.sessions.c.session_hash == hash_token(session_id)))
+
+    async def delete_expired(self, batch_size=DEFAULT_SESSION_SETTINGS['batch_size']):
+        """
+        Delete expired sessions in batches, so that each delete only holds locks on a few rows.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of sessions to delete in each query.
+
+        Returns
+        -------
+        int
+            Number of deleted sessions.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = 0
+        now = datetime.datetime.utcnow()
+        while True:
+            query = sqlalchemy.select(self.sessions.c.session_hash).where(self.sessions.c.expires_at < now).limit(batch_size)
+            session_hashes = [row['session_hash'] for row in await self.database.fetch_all(query)]
+            if session_hashes:
+                await self.database.execute(self.sessions.delete().where(self.sessions.c.session_hash.in_(session_hashes)))
+                out += len(session_hashes)
+            if len(session_hashes) < batch_size:
+                break
+        return out
+
+    async def delete_user(self, user_id):
+        """
+        Delete all sessions of a user, such as after a password change.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self.database.execute(self.sessions.delete().where(self.sessions.c.user_id == user_id))
+
+    async def delete_users(self, user_ids):
+        """
+        Delete all sessions of many users in one query, such as after deactivating them in bulk.
+
+        Parameters
+        ----------
+        user_ids : list(:class:`uuid.UUID`)
+            Ids of the users.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        if user_ids:
+            await self.database.execute(self.sessions.delete().where(self.sessions.c.user_id.in_(user_ids)))
+
+    async def get(self, session_id):
+        """
+        Get the user of a session.
+
+        Parameters
+        ----------
+        session_id : str
+            Id of the session.
+
+        Returns
+        -------
+        :class:`uuid.UUID` or None
+            Id of the user, or ``None`` if the session does not exist or expired.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        query = sqlalchemy.select(self.sessions.c.user_id, self.sessions.c.expires_at).where(self.sessions.c.session_hash == hash_token(session_id))
+        row = await self.database.fetch_one(query)
+        if row is None or row['expires_at'] <= datetime.datetime.utcnow():
+            return None
+        out = row['user_id']
+        return out
+
+    def get_stats(self):
+        """
+        Get statistics of the background cleanup.
+
+        Returns
+        -------
+        dict
+            A dictionary with keys ``cleanups``, ``cleanup_deleted``, and ``cleanup_errors``.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = self._get_cleanup_stats()
+        return out
+
+class KeyValueSessionStore(SessionStoreMixin):
+    """
+    Store of cookie sessions in a local key-value file, standing in for a shared key-value service so that all workers on one machine share sessions without using the users database.
+
+    * The file is a SQLite database in write-ahead log mode with one table of keys (hashes of session ids), user ids, and expiry times, indexed by key, user id, and expiry time
+    * Each process uses one connection in its own thread, so lookups do not block the event loop
+    * Replace it with a store of the same methods to use a networked key-value service across machines
+
+    Parameters
+    ----------
+    path : str
+        Path of the key-value file, created if it does not exist.
+    batch_size : int
+        Number of expired sessions to delete at a time.
+    cleanup_interval : float
+        Number of seconds between cleanups.
+    id_bytes : int
+        Number of random bytes in each session id.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import os
+        import tempfile
+        import uuid
+        from msdss_users_api.sessions import KeyValueSessionStore
+
+        store = KeyValueSessionStore(os.path.join(tempfile.gettempdir(), 'sessions.db'))
+        session_id = await store.create(uuid.uuid4(), lifetime_seconds=3600)
+        print(await store.get(session_id))
+        store.close()
+    """
+    def __init__(
+        self,
+        path=DEFAULT_SESSION_SETTINGS['path'],
+        batch_size=DEFAULT_SESSION_SETTINGS['batch_size'],
+        cleanup_interval=DEFAULT_SESSION_SETTINGS['cleanup_interval'],
+        id_bytes=DEFAULT_SESSION_SETTINGS['id_bytes']):
+        self._init_cleanup(batch_size=batch_size, cleanup_interval=cleanup_interval, id_bytes=id_bytes)
+        self.path = path
+        self._connection = None
+        self._executor = None
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS session (key TEXT PRIMARY KEY, user_id TEXT NOT NULL, expires REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS ix_session_user_id ON session (user_id)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS ix_session_expires ON session (expires)')
+        out = self._connection
+        return out
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='msdss-users-sessions')
+        out = self._executor
+        return out
+
+    async def _run(self, statement, parameters=(), fetch=False):
+        def run():
+            cursor = self._connect().execute(statement, parameters)
+            return cursor.fetchone() if fetch else cursor.rowcount
+        out = await asyncio.get_running_loop().run_in_executor(self._get_executor(), run)
+        return out
+
+    def close(self):
+        """
+        Close the connection to the key-value file and stop its thread. They are opened again if the store is used after closing.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        def close():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        if self._executor is not None:
+            self._executor.submit(close).result()
+            self._executor.shutdown()
+            self._executor = None
+
+    async def create(self, user_id, lifetime_seconds):
+        """
+        Create a session for a user. See :meth:`msdss_users_api.sessions.MemorySessionStore.create`.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+        lifetime_seconds : int
+            Number of seconds the session is valid for.
+
+        Returns
+        -------
+        str
+            The opaque session id. Only its hash is stored.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = self._create_id()
+        await self._run('INSERT INTO session (key, user_id, expires) VALUES (?, ?, ?)', (hash_token(out), str(user_id), time.time() + lifetime_seconds))
+        return out
+
+    async def delete(self, session_id):
+        """
+        Delete a session, logging it out.
+
+        Parameters
+        ----------
+        session_id : str
+            Id of the session.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self._run('DELETE FROM session WHERE key = ?', (hash_token(session_id),))
+
+    async def delete_expired(self, batch_size=DEFAULT_SESSION_SETTINGS['batch_size']):
+        """
+        Delete expired sessions in batches, so that other workers can write between batches.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of sessions to delete at a time.
+
+        Returns
+        -------
+        int
+            Number of deleted sessions.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = 0
+        now = time.time()
+        while True:
+            deleted = await self._run('DELETE FROM session WHERE key IN (SELECT key FROM session WHERE expires < ? LIMIT ?)', (now, batch_size))
+            out += deleted
+            if deleted < batch_size:
+                break
+        return out
+
+    async def delete_user(self, user_id):
+        """
+        Delete all sessions of a user, such as after a password change.
+
+        Parameters
+        ----------
+        user_id : :class:`uuid.UUID`
+            Id of the user.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        await self._run('DELETE FROM session WHERE user_id = ?', (str(user_id),))
+
+    async def get(self, session_id):
+        """
+        Get the user of a session.
+
+        Parameters
+        ----------
+        session_id : str
+            Id of the session.
+
+        Returns
+        -------
+        :class:`uuid.UUID` or None
+            Id of the user, or ``None`` if the session does not exist or expired.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        row = await self._run('SELECT user_id FROM session WHERE key = ? AND expires > ?', (hash_token(session_id), time.time()), fetch=True)
+        out = uuid.UUID(row[0]) if row else None
+        return out
+
+    def get_stats(self):
+        """
+        Get statistics of the background cleanup.
+
+        Returns
+        -------
+        dict
+            A dictionary with keys ``cleanups``, ``cleanup_deleted``, and ``cleanup_errors``.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = self._get_cleanup_stats()
+        return out
\ No newline at end of file
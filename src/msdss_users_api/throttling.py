@@ -0,0 +1,320 @@
+import math
+import threading
+import time
+
+from fastapi import HTTPException, Request
+
+from .adapters import normalize_email
+from .defaults import *
+
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+class TokenBucketStore:
+    """
+    In-process token buckets split into shards, each with its own lock and lazy eviction.
+
+    * A bucket holds up to ``capacity`` tokens and refills at ``rate`` tokens per second. Each request takes ``cost`` tokens and is rejected if there are not enough
+    * Buckets are only refilled when they are used, so idle keys cost no work
+    * Each shard is swept for full buckets, which are the same as missing buckets, at most once every ``sweep_interval`` seconds when it is used,
+      so eviction work is spread across shards and requests instead of stalling one of them
+    * If a shard holds its share of ``max_keys``, its least recently used bucket is dropped for each new key
+    * The store is local to each process, so each worker of a multi-process server has its own limits. Use :class:`msdss_users_api.throttling.RedisTokenBucketStore` to share them
+
+    Parameters
+    ----------
+    shards : int
+        Number of shards to split keys into.
+    max_keys : int
+        Maximum number of buckets to keep across all shards.
+    sweep_interval : float
+        Minimum number of seconds between sweeps of each shard.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.throttling import TokenBucketStore
+        from pprint import pprint
+
+        store = TokenBucketStore()
+        for _ in range(3):
+            print(await store.take('ip:127.0.0.1', rate=1, capacity=2))
+        pprint(store.get_stats())
+    """
+    def __init__(
+        self,
+        shards=DEFAULT_THROTTLE_SETTINGS['shards'],
+        max_keys=DEFAULT_THROTTLE_SETTINGS['max_keys'],
+        sweep_interval=DEFAULT_THROTTLE_SETTINGS['sweep_interval']):
+        self.shards = [{} for _ in range(shards)]
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._shard_max_keys = max(1, max_keys // shards)
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._next_sweeps = [0.0] * shards
+        self._allowed = 0
+        self._throttled = 0
+        self._evictions = 0
+
+    def _sweep(self, index, now):
+        """
+        Remove full buckets from a shard.
+
+        Parameters
+        ----------
+        index : int
+            Index of the shard, whose lock must be held.
+        now : float
+            Current time from :func:`time.monotonic`.
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        shard = self.shards[index]
+        full = [key for key, (_, _, full_at) in shard.items() if full_at <= now]
+        for key in full:
+            del shard[key]
+        self._evictions += len(full)
+        self._next_sweeps[index] = now + self.sweep_interval
+
+    def get_stats(self):
+        """
+        Get statistics of the store.
+
+        Returns
+        -------
+        dict
+            A dictionary with keys ``keys`` (number of buckets held), ``allowed`` and ``throttled`` (number of takes), and ``evictions`` (number of buckets removed).
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        out = dict(
+            keys=sum(len(shard) for shard in self.shards),
+            allowed=self._allowed,
+            throttled=self._throttled,
+            evictions=self._evictions
+        )
+        return out
+
+    async def take(self, key, rate, capacity, cost=1):
+        """
+        Take tokens from the bucket of a key.
+
+        Parameters
+        ----------
+        key : str
+            Key of the bucket, such as ``ip:127.0.0.1``.
+        rate : float
+            Number of tokens added to the bucket each second.
+        capacity : float
+            Maximum number of tokens in the bucket, which is the largest burst allowed.
+        cost : float
+            Number of tokens to take.
+
+        Returns
+        -------
+        tuple
+            A tuple of whether the tokens were taken (bool) and the number of seconds until they can be taken if not (float).
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        index = hash(key) % len(self.shards)
+        shard = self.shards[index]
+        now = time.monotonic()
+        with self._locks[index]:
+
+            # (TokenBucketStore_take_sweep) Lazily evict full buckets from the shard
+            if now >= self._next_sweeps[index]:
+                self._sweep(index, now)
+
+            # (TokenBucketStore_take_evict) Drop least recently used bucket if the shard is full
+            entry = shard.pop(key, None)
+            if entry is None and len(shard) >= self._shard_max_keys:
+                del shard[next(iter(shard))]
+                self._evictions += 1
+
+            # (TokenBucketStore_take_refill) Refill bucket for the time since it was last used
+            tokens = capacity if entry is None else min(capacity, entry[0] + (now - entry[1]) * rate)
+
+            # (TokenBucketStore_take_return) Take tokens if there are enough
+            if tokens >= cost:
+                tokens -= cost
+                self._allowed += 1
+                out = (True, 0.0)
+            else:
+                self._throttled += 1
+                out = (False, (cost - tokens) / rate)
+            shard[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return out
+
+class RedisTokenBucketStore:
+    """
+    Token buckets kept in Redis, so that limits are shared by all workers and servers using it.
+
+    * Requires the optional ``redis`` package (``pip install msdss-users-api[redis]``)
+    * Each take is one atomic script call using the clock of the Redis server, and buckets expire once they would be full again
+
+    Parameters
+    ----------
+    url : str
+        Url of the Redis server.
+    prefix : str
+        Prefix added to bucket keys.
+    client : :class:`redis.asyncio.Redis` or None
+        Redis client to use. If ``None``, one is created from ``url``.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. code-block:: python
+
+        from msdss_users_api.throttling import LoginThrottle, RedisTokenBucketStore
+
+        store = RedisTokenBucketStore('redis://localhost:6379/0')
+        throttle = LoginThrottle(store=store)
+    """
+    def __init__(
+        self,
+        url=DEFAULT_THROTTLE_SETTINGS['redis_url'],
+        prefix=DEFAULT_THROTTLE_SETTINGS['redis_prefix'],
+        client=None):
+        if client is None:
+            try:
+                import redis.asyncio
+            except ImportError:
+                raise ImportError('Sharing throttling limits requires redis, install it with pip install msdss-users-api[redis]')
+            client = redis.asyncio.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, key, rate, capacity, cost=1):
+        """
+        Take tokens from the bucket of a key. See :meth:`msdss_users_api.throttling.TokenBucketStore.take`.
+
+        Parameters
+        ----------
+        key : str
+            Key of the bucket, such as ``ip:127.0.0.1``.
+        rate : float
+            Number of tokens added to the bucket each second.
+        capacity : float
+            Maximum number of tokens in the bucket, which is the largest burst allowed.
+        cost : float
+            Number of tokens to take.
+
+        Returns
+        -------
+        tuple
+            A tuple of whether the tokens were taken (bool) and the number of seconds until they can be taken if not (float).
+
+        Author
+        ------
+        Richard Wen <rrwen.dev@gmail.com>
+        """
+        allowed, retry_after = await self._script(keys=[self.prefix + key], args=[rate, capacity, cost])
+        out = (bool(int(allowed)), float(retry_after))
+        return out
+
+class LoginThrottle:
+    """
+    Dependency limiting login attempts for each client ip address and each email with token buckets.
+
+    * Added to the login routes by :func:`msdss_users_api.routers.get_users_router`, where it runs before the password is verified, so throttled attempts cost no hashing
+    * Each attempt takes a token from the bucket of its ip address and then from the bucket of its email, and is rejected with status ``429`` and a ``Retry-After`` header if either is empty
+    * Emails are normalized with :func:`msdss_users_api.adapters.normalize_email`, so case variations share one bucket
+    * The ip address is the client of the connection. Behind a proxy, run the server with forwarded headers enabled (e.g. ``--proxy-headers`` for ``uvicorn``) so that it is the original client
+    * Email limits also slow down the real owner of an email under attack, so keep them looser than ip limits
+
+    Parameters
+    ----------
+    store : :class:`msdss_users_api.throttling.TokenBucketStore` or :class:`msdss_users_api.throttling.RedisTokenBucketStore` or None
+        Store of the token buckets. If ``None``, an in-process :class:`msdss_users_api.throttling.TokenBucketStore` is created.
+    ip_rate : float or None
+        Number of attempts each ip address regains per second. If ``None``, ip addresses are not limited.
+    ip_capacity : float
+        Number of attempts each ip address can make at once.
+    email_rate : float or None
+        Number of attempts each email regains per second. If ``None``, emails are not limited.
+    email_capacity : float
+        Number of attempts each email can make at once.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.throttling import LoginThrottle
+
+        # Allow bursts of 20 attempts per ip and 10 per email, regaining 1 per sec and 1 per 10 secs
+        throttle = LoginThrottle(ip_rate=1, ip_capacity=20, email_rate=0.1, email_capacity=10)
+    """
+    def __init__(
+        self,
+        store=None,
+        ip_rate=DEFAULT_THROTTLE_SETTINGS['ip_rate'],
+        ip_capacity=DEFAULT_THROTTLE_SETTINGS['ip_capacity'],
+        email_rate=DEFAULT_THROTTLE_SETTINGS['email_rate'],
+        email_capacity=DEFAULT_THROTTLE_SETTINGS['email_capacity']):
+        self.store = store if store is not None else TokenBucketStore()
+        self.limits = []
+        if ip_rate:
+            self.limits.append(('ip', ip_rate, ip_capacity))
+        if email_rate:
+            self.limits.append(('email', email_rate, email_capacity))
+
+    async def __call__(self, request: Request):
+
+        # (LoginThrottle_call_keys) Get client ip address and email of the login form
+        values = {}
+        values['ip'] = request.client.host if request.client else None
+        if any(kind == 'email' for kind, _, _ in self.limits):
+            username = (await request.form()).get('username')
+            values['email'] = normalize_email(username) if username else None
+
+        # (LoginThrottle_call_take) Take a token for each limit and reject attempt if any is empty
+        for kind, rate, capacity in self.limits:
+            if values[kind] is None:
+                continue
+            allowed, retry_after = await self.store.take(f'{kind}:{values[kind]}', rate, capacity)
+            if not allowed:
+                raise HTTPException(
+                    status_code=429,
+                    detail='LOGIN_TOO_MANY_ATTEMPTS',
+                    headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
\ No newline at end of file
@@ -1,28 +1,258 @@
 from msdss_users_api.defaults import DEFAULT_COOKIE_SETTINGS, DEFAULT_JWT_SETTINGS
+import asyncio
 import pydantic
 import contextlib
+import csv
 import databases
+import functools
+import json
+import os
+import sqlalchemy
+import sys
 
 from fastapi import Depends
 from fastapi_users import FastAPIUsers
-from fastapi_users.authentication import CookieAuthentication, JWTAuthentication
-from fastapi_users.db import SQLAlchemyUserDatabase
 from fastapi_users.jwt import generate_jwt
 from fastapi_users.manager import UserAlreadyExists, UserNotExists
 from msdss_base_database import Database
 
+from .adapters import *
+from .authentication import *
+from .cache import *
 from .defaults import *
 from .env import *
+from .hashing import *
 from .managers import *
+from .migrations import *
 from .models import *
+from .pool import *
+from .revocation import *
+from .sessions import *
+
+def _create_user_revokers(async_database, UserDB=UserDB, UserTable=UserTable):
+    """
+    Create the objects used to revoke tokens and sessions of users from commands outside of the app.
+
+    Parameters
+    ----------
+    async_database : :class:`databases:databases.Database` or :class:`msdss_users_api.pool.AsyncEngineDatabase`
+        Async database of the users.
+    UserDB : :class:`msdss_users_api.models.UserDB`
+        The user database model.
+    UserTable : :class:`msdss_users_api.models.UserTable`
+        The user table model.
+
+    Return
+    ------
+    dict
+        Keyword arguments for :func:`msdss_users_api.tools.create_user_manager` with keys:
+
+        * ``revocation`` (:class:`msdss_users_api.revocation.RevocationList`): revoked tokens, kept for the longest default lifetime of the jwt and cookie tokens
+        * ``refresh_token_db`` (:class:`msdss_users_api.adapters.RefreshTokenDatabase`): refresh tokens
+        * ``session_store`` (:class:`msdss_users_api.sessions.SQLSessionStore`): ``sql`` sessions, as ``memory`` and ``kv`` sessions are only reachable from the app
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    lifetime_seconds = max(DEFAULT_JWT_SETTINGS['lifetime_seconds'], DEFAULT_COOKIE_SETTINGS['lifetime_seconds'])
+    out = dict(
+        revocation=RevocationList(async_database, RevokedTokenTable.__table__, lifetime_seconds=lifetime_seconds),
+        refresh_token_db=RefreshTokenDatabase(UserDB, async_database, RefreshTokenTable.__table__, UserTable.__table__),
+        session_store=create_session_store('sql', async_database=async_database)
+    )
+    return out
+
+def _get_env_hash_settings(env):
+    """
+    Get password hashing settings from the ``hasher``, ``hash_rounds``, ``hash_memory_cost``, and ``hash_parallelism`` variables of a loaded env.
+
+    Parameters
+    ----------
+    env : :class:`msdss_users_api.env.UsersDotEnv`
+        Env with loaded variables.
+
+    Return
+    ------
+    dict
+        Keyword arguments for :class:`passlib:passlib.context.CryptContext`. See :func:`msdss_users_api.hashing.create_hash_settings` and :func:`msdss_users_api.hashing.get_hash_settings`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+    """
+    hasher = env.get('hasher')
+    rounds = env.get('hash_rounds')
+    if hasher is not None:
+        hasher_settings = {k: env.get(f'hash_{k}') for k in ('memory_cost', 'parallelism')}
+        out = create_hash_settings(hasher, rounds=rounds, **{k: v for k, v in hasher_settings.items() if v is not None})
+    else:
+        out = get_hash_settings(rounds)
+    return out
+
+@contextlib.asynccontextmanager
+async def _get_user_manager(user_manager=None, user_db_context_kwargs={}, user_manager_context_kwargs={}):
+    """
+    Context manager yielding a connected user manager, reusing one if it is given.
+
+    Parameters
+    ----------
+    user_manager : :class:`msdss_users_api.managers.UserManager` or None
+        User manager with a connected database to reuse as is, such as the one used for all commands of ``msdss-users batch``.
+        If ``None``, a user manager is created from the other parameters and its database is connected on enter and disconnected on exit.
+        The created user manager revokes tokens, refresh tokens, and ``sql`` sessions of users in the database when their password is reset or they are deactivated. See :func:`msdss_users_api.tools._create_user_revokers`.
+    user_db_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+    user_manager_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import _get_user_manager
+
+        # Create user manager secrets
+        kwargs = dict(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret',
+                verification_token_secret='verification-secret'
+            )
+        )
+
+        # Get a connected user manager
+        async with _get_user_manager(user_manager_context_kwargs=kwargs) as user_manager:
+            print(user_manager)
+    """
+
+    # (_get_user_manager_reuse) Use given user manager
+    if user_manager is not None:
+        yield user_manager
+        return
+
+    # (_get_user_manager_context) Get db and manager context functions
+    user_db_context = create_user_db_context(**user_db_context_kwargs)
+    get_user_db_context = user_db_context['get_user_db_context']
+    get_user_db = user_db_context['get_user_db']
+    async_database = user_db_context['async_database']
+
+    # (_get_user_manager_revoke) Revoke tokens and sessions of users when their password is reset or they are deactivated
+    user_manager_context_kwargs = dict(user_manager_context_kwargs)
+    user_manager_settings = dict(user_manager_context_kwargs.get('user_manager_settings', {}))
+    revokers = _create_user_revokers(
+        async_database,
+        UserDB=user_db_context_kwargs.get('UserDB', UserDB),
+        UserTable=user_db_context_kwargs.get('UserTable', UserTable))
+    for k, v in revokers.items():
+        user_manager_settings.setdefault(k, v)
+    user_manager_context_kwargs['user_manager_settings'] = user_manager_settings
+    get_user_manager_context = create_user_manager_context(get_user_db=get_user_db, **user_manager_context_kwargs)
+
+    # (_get_user_manager_run) Connect and yield user manager
+    try:
+        async with get_user_db_context() as user_db:
+            async with get_user_manager_context(user_db) as out:
+                await async_database.connect()
+                yield out
+    finally:
+        await async_database.disconnect()
+
+def _is_integrity_error(error):
+    """
+    Check if an error is a unique or other integrity constraint violation from the database driver or from ``sqlalchemy``.
+
+    * Drivers raise their own exception classes, so they are matched by the ``IntegrityError`` name of PEP 249 or the ``IntegrityConstraintViolationError`` base class of ``asyncpg``
+
+    Parameters
+    ----------
+    error : Exception
+        Error raised by a query.
+
+    Returns
+    -------
+    bool
+        Whether the error is an integrity constraint violation or not.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        import sqlite3
+        from msdss_users_api.tools import _is_integrity_error
+
+        print(_is_integrity_error(sqlite3.IntegrityError('UNIQUE constraint failed')))
+        print(_is_integrity_error(ConnectionError('connection lost')))
+    """
+    names = {c.__name__ for c in type(error).__mro__}
+    out = isinstance(error, sqlalchemy.exc.IntegrityError) or bool(names & {'IntegrityError', 'IntegrityConstraintViolationError'})
+    return out
+
+def _read_user_rows(path, format=None):
+    """
+    Stream rows of users from a CSV or JSON lines file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to read, or ``-`` to read from standard input.
+    format : str or None
+        One of ``csv`` or ``jsonl``. If ``None``, the format is taken from the file extension, defaulting to ``csv``.
+
+    Returns
+    -------
+    generator
+        Generator of tuples with the line number and a dictionary of non empty values for each user.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import _read_user_rows
+
+        with open('users.jsonl', 'w') as f:
+            f.write('{"email": "test@example.com", "password": "msdss123"}\\n')
+
+        for line, row in _read_user_rows('users.jsonl'):
+            print(line, row)
+    """
+
+    # (_read_user_rows_format) Get format from file extension
+    if format is None:
+        format = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+    if format not in ('csv', 'jsonl'):
+        raise ValueError(f'Unsupported format {format}, must be one of csv or jsonl')
+
+    # (_read_user_rows_read) Stream rows from the file
+    with (contextlib.nullcontext(sys.stdin) if path == '-' else open(path, newline='', encoding='utf-8')) as f:
+        if format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {k: v for k, v in row.items() if v not in (None, '')}
+        else:
+            for line, text in enumerate(f, start=1):
+                if text.strip():
+                    yield line, {k: v for k, v in json.loads(text).items() if v is not None}
 
 def create_fastapi_users_objects(
     user_manager_settings={},
     jwt_settings=DEFAULT_JWT_SETTINGS,
     cookie_settings=DEFAULT_COOKIE_SETTINGS,
-    database=Database(),
+    database=None,
     enable_cookie=True,
     enable_jwt=True,
+    enable_stateless=False,
     cookie=None,
     jwt=None,
     Base=Base,
@@ -31,7 +261,22 @@ def create_fastapi_users_objects(
     UserUpdate=UserUpdate,
     UserDB=UserDB,
     UserTable=UserTable,
-    UserManager=None):
+    UserManager=None,
+    password_executor=None,
+    user_cache=None,
+    migrate=True,
+    pool_settings={},
+    backend='databases',
+    metrics=None,
+    enable_refresh_tokens=False,
+    refresh_token_settings={},
+    sessions=None,
+    session_settings={},
+    enable_revocation=False,
+    revocation_settings={},
+    hash_settings=None,
+    hasher=None,
+    hasher_settings={}):
     """
     Creates all the needed dependencies and models to build a `FastAPIUsers object <https://fastapi-users.github.io/fastapi-users/configuration/routers/>`_.
 
@@ -81,17 +326,20 @@ def create_fastapi_users_objects(
             for k, v in DEFAULT_JWT_SETTINGS.items():
                 print(f'{k} = {v}')
 
-    database : :class:`msdss_base_database:msdss_base_database.core.Database`
-        Database to use for managing users.
+    database : :class:`msdss_base_database:msdss_base_database.core.Database` or None
+        Database to use for managing users. If ``None``, one is created from environment variables when the function is called.
     enable_cookie : bool
         Whether to enable cookie based authentication or not.
     enable_jwt : bool
         Whether to enable JSON Web Token (JWT) based authentication or not.
+    enable_stateless : bool
+        Whether to add the ``email``, ``is_active``, ``is_superuser``, and ``is_verified`` user attributes to tokens and create a stateless authenticator that trusts them without a database lookup.
+        See :func:`msdss_users_api.authentication.create_stateless_authenticator`.
     cookie : :class:`fastapi_users:fastapi_users.authentication.CookieAuthentication` or None
-        A cookie authentication object from FastAPI Users. If ``None``, one will be created from parameter ``cookie_settings``.
+        A cookie authentication object from FastAPI Users. If ``None``, a :class:`msdss_users_api.authentication.ClaimsCookieAuthentication` will be created from parameter ``cookie_settings``.
         See `CookieAuthentication <https://fastapi-users.github.io/fastapi-users/configuration/authentication/cookie/>`_.
     jwt : :class:`fastapi_users:fastapi_users.authentication.JWTAuthentication` or None
-        A JSON Web Token (JWT) authentication object from FastAPI Users. If ``None``, one will be created from parameter ``jwt_settings``.
+        A JSON Web Token (JWT) authentication object from FastAPI Users. If ``None``, a :class:`msdss_users_api.authentication.ClaimsJWTAuthentication` will be created from parameter ``jwt_settings``.
         See `JWTAuthentication <https://fastapi-users.github.io/fastapi-users/configuration/authentication/jwt/>`_.
     Base : class
         Class returned from :func:`sqlalchemy:sqlalchemy.orm.declarative_base`.
@@ -108,6 +356,58 @@ def create_fastapi_users_objects(
     UserManager : :class:`msdss_users_api.managers.UserManager` or None
         UserManager model for FastAPI Users. See :class:`msdss_users_api.managers.UserManager`.
         If ``None``, one will be created using :func:`msdss_users_api.tools.create_user_manager`
+    password_executor : :class:`msdss_users_api.hashing.PasswordExecutor` or None
+        Executor pool to hash and verify passwords outside of the event loop. Passed to :func:`msdss_users_api.tools.create_user_manager` if parameter ``UserManager`` is ``None``.
+        If ``None``, passwords are hashed on the event loop.
+    user_cache : :class:`msdss_users_api.cache.UserCache` or None
+        Cache of users keyed by id, used to skip the database lookup for authenticated users. See :func:`msdss_users_api.tools.create_user_db_func`.
+        If ``None``, every authenticated request queries the database.
+    migrate : bool
+        Whether to apply pending schema migrations if the database is behind or not. See :func:`msdss_users_api.tools.create_user_db_func`.
+    pool_settings : dict
+        Keyword arguments passed to :class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase` to configure the async connection pool,
+        such as ``min_size``, ``max_size``, ``acquire_timeout``, ``recycle``, ``statement_cache_size``, and ``warm_up``.
+    backend : str
+        One of the following for running user queries and schema changes:
+
+        * ``databases``: queries use a :class:`msdss_users_api.pool.PooledDatabase` and schema changes use the synchronous engine of parameter ``database``
+        * ``sqlalchemy``: queries and schema changes share one :class:`msdss_users_api.pool.AsyncEngineDatabase`, and the connections of the synchronous engine are closed.
+          Schema changes then run when the async database connects. Requires the async driver of the database (e.g. ``asyncpg`` for PostgreSQL)
+
+    metrics : :class:`msdss_users_api.metrics.Metrics` or None
+        Metrics to time password hashing, token decoding, and queries in, and to collect pool utilization and authentication counts in.
+        If ``None``, nothing is recorded.
+    enable_refresh_tokens : bool
+        Whether to return an opaque refresh token from JWT logins, stored as a hash in a :class:`msdss_users_api.models.RefreshTokenTable`, or not.
+        Requires ``jwt`` to be a :class:`msdss_users_api.authentication.ClaimsJWTAuthentication`. All refresh tokens of a user are revoked when their password is reset or changed.
+        See :class:`msdss_users_api.adapters.RefreshTokenDatabase`.
+    refresh_token_settings : dict
+        Keyword arguments passed to :class:`msdss_users_api.adapters.RefreshTokenDatabase`, such as ``lifetime_seconds`` and ``rotate``.
+    sessions : str or None
+        Store of server-side sessions for cookie authentication, where cookies only hold an opaque session id that is deleted on logout. One of:
+
+        * ``memory``: in-process store with a size limit, see :class:`msdss_users_api.sessions.MemorySessionStore`
+        * ``sql``: indexed table in the users database, see :class:`msdss_users_api.sessions.SQLSessionStore`
+        * ``kv``: local key-value file shared by the workers of one machine, see :class:`msdss_users_api.sessions.KeyValueSessionStore`
+
+        If ``None``, cookies hold signed tokens. Only applies if parameter ``cookie`` is ``None``. See :class:`msdss_users_api.authentication.SessionCookieAuthentication`.
+    session_settings : dict
+        Keyword arguments passed to the session store, such as ``max_size`` for ``memory``, ``path`` for ``kv``, and ``batch_size`` and ``cleanup_interval`` for all stores.
+    enable_revocation : bool
+        Whether to keep a list of revoked tokens in a :class:`msdss_users_api.models.RevokedTokenTable` with in-process Bloom filters in front, or not.
+        Tokens of :class:`msdss_users_api.authentication.ClaimsAuthenticationMixin` backends are then revoked on logout (adding a logout route for JWTs), and all tokens of a user when their password is reset or changed.
+        Requires parameter ``UserManager`` to be ``None`` or to use the ``revocation`` attribute of :class:`msdss_users_api.managers.UserManager`. See :class:`msdss_users_api.revocation.RevocationList`.
+    revocation_settings : dict
+        Keyword arguments passed to :class:`msdss_users_api.revocation.RevocationList`, such as ``capacity``, ``error_rate``, and ``sync_interval``.
+        ``lifetime_seconds`` defaults to the longest lifetime of the jwt and cookie tokens.
+    hash_settings : dict or None
+        Password hashing settings passed to :func:`msdss_users_api.tools.create_user_manager` if parameter ``UserManager`` is ``None``, such as from :func:`msdss_users_api.hashing.get_hash_settings`.
+        Passwords stored with other settings are rehashed at login. If ``None``, the settings of ``password_executor`` or of ``fastapi-users`` are used.
+    hasher : str or None
+        Password hashing scheme passed to :func:`msdss_users_api.tools.create_user_manager` if parameter ``UserManager`` is ``None``, one of ``bcrypt`` or ``argon2`` (Argon2id).
+        Hashes of both schemes are verified, and rehashed with ``hasher`` at login. Overrides parameter ``hash_settings``. See :func:`msdss_users_api.hashing.create_hash_settings`.
+    hasher_settings : dict
+        Keyword arguments passed to :func:`msdss_users_api.hashing.create_hash_settings`, such as ``rounds``, ``memory_cost``, and ``parallelism``.
 
     Returns
     -------
@@ -118,7 +418,7 @@ def create_fastapi_users_objects(
         * ``databases`` (dict): dictionary of database related objects
             * ``database`` (:class:`msdss_base_database:msdss_base_database.core.Database`): database object from parameter ``database``
             * ``database_engine`` (:func:`sqlalchemy:sqlalchemy.create_engine`): SQLAlchemy engine object
-            * ``async_database`` (:class:`databases:databases.Database`): Async database object
+            * ``async_database`` (:class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase`): Async database object with pool statistics from its ``get_stats`` method
         * ``dependencies`` (dict(func)): dictionary of dependencies
             * ``get_user_db`` (func): get_user_db function auto-configured - see :func:`msdss_users_api.tools.create_user_db_func`.
             * ``get_user_manager`` (func): get_user_manager function auto-configured - see :func`msdss_users_api.tools.create_user_manager_func`.
@@ -132,6 +432,15 @@ def create_fastapi_users_objects(
         * ``auth`` (dict): dictionary of auth related objects
             * ``jwt`` (:class:`fastapi_users:fastapi_users.authentication.JWTAuthentication`): see parameter ``jwt``
             * ``cookie`` (:class:`fastapi_users:fastapi_users.authentication.CookieAuthentication`): see parameter ``cookie``
+            * ``stateless_authenticator`` (:class:`fastapi_users:fastapi_users.authentication.Authenticator` or None): authenticator trusting token claims if parameter ``enable_stateless`` is ``True``
+            * ``refresh_token_db`` (:class:`msdss_users_api.adapters.RefreshTokenDatabase` or None): refresh token adapter if parameter ``enable_refresh_tokens`` is ``True``
+            * ``session_store`` (:class:`msdss_users_api.sessions.SessionStoreMixin` or None): session store if parameter ``sessions`` is set
+            * ``revocation_list`` (:class:`msdss_users_api.revocation.RevocationList` or None): list of revoked tokens if parameter ``enable_revocation`` is ``True``
+        * ``executors`` (dict): dictionary of executor pools
+            * ``password_executor`` (:class:`msdss_users_api.hashing.PasswordExecutor`): see parameter ``password_executor``
+        * ``caches`` (dict): dictionary of caches
+            * ``user_cache`` (:class:`msdss_users_api.cache.UserCache`): see parameter ``user_cache``
+        * ``metrics`` (:class:`msdss_users_api.metrics.Metrics` or None): see parameter ``metrics``
 
     Author
     ------
@@ -171,21 +480,61 @@ def create_fastapi_users_objects(
         jwt_settings[param] = jwt_settings.get(param, default)
 
     # (setup_fastapi_users_db) Setup database connections
+    database = database if database is not None else Database()
     database_engine = database._connection
-    async_database = databases.Database(str(database_engine.url))
+    if backend == 'databases':
+        async_database = PooledDatabase(str(database_engine.url), **pool_settings)
+    elif backend == 'sqlalchemy':
+        async_database = AsyncEngineDatabase(database_engine.url, **pool_settings)
+        database_engine.dispose()
+    else:
+        raise ValueError(f'Unsupported backend {backend}, must be one of databases or sqlalchemy')
     
     # (setup_fastapi_users_auth_combine) Combine cookie and jwt auth if needed
     auth = []
+    session_store = None
     if enable_cookie:
-        cookie = cookie if cookie else CookieAuthentication(**cookie_settings)
+        if not cookie and sessions:
+            session_store = create_session_store(sessions, async_database=async_database, **session_settings)
+            cookie = SessionCookieAuthentication(session_store, **cookie_settings)
+        cookie = cookie if cookie else ClaimsCookieAuthentication(include_claims=enable_stateless, **cookie_settings)
         auth.append(cookie)
     if enable_jwt:
-        jwt = jwt if jwt else JWTAuthentication(**jwt_settings)
+        jwt = jwt if jwt else ClaimsJWTAuthentication(include_claims=enable_stateless, **jwt_settings)
         auth.append(jwt)
+
+    # (setup_fastapi_users_refresh) Setup refresh tokens for jwt logins
+    refresh_token_db = None
+    if enable_refresh_tokens and jwt is not None:
+        if not isinstance(jwt, ClaimsJWTAuthentication):
+            raise ValueError('Refresh tokens require jwt to be a ClaimsJWTAuthentication')
+        refresh_token_db = RefreshTokenDatabase(UserDB, async_database, RefreshTokenTable.__table__, UserTable.__table__, **refresh_token_settings)
+        jwt.refresh_token_db = refresh_token_db
+
+    # (setup_fastapi_users_revocation) Check tokens against revoked tokens and revoke them on logout
+    revocation_list = None
+    if enable_revocation:
+        revocation_settings = dict(revocation_settings)
+        revocation_settings.setdefault('lifetime_seconds', max(
+            jwt_settings['lifetime_seconds'] or DEFAULT_JWT_SETTINGS['lifetime_seconds'],
+            cookie_settings['lifetime_seconds'] or DEFAULT_COOKIE_SETTINGS['lifetime_seconds']
+        ))
+        revocation_list = RevocationList(async_database, RevokedTokenTable.__table__, **revocation_settings)
+        for backend_auth in auth:
+            if isinstance(backend_auth, ClaimsAuthenticationMixin):
+                backend_auth.revocation = revocation_list
+                backend_auth.logout = True
+
+    # (setup_fastapi_users_metrics) Record metrics if needed
+    if metrics:
+        metrics.watch_pool(async_database)
+        for backend_auth in auth:
+            if isinstance(backend_auth, (ClaimsAuthenticationMixin, SessionCookieAuthentication)):
+                backend_auth.metrics = metrics
     
     # (setup_fastapi_users_func) Setup required functions
-    get_user_db = create_user_db_func(database_engine, async_database, Base=Base, UserTable=UserTable, UserDB=UserDB)
-    UserManager = UserManager if UserManager else create_user_manager(**user_manager_settings)
+    get_user_db = create_user_db_func(database_engine, async_database, Base=Base, UserTable=UserTable, UserDB=UserDB, user_cache=user_cache, migrate=migrate)
+    UserManager = UserManager if UserManager else create_user_manager(password_executor=password_executor, metrics=metrics, revocation=revocation_list, refresh_token_db=refresh_token_db, session_store=session_store, hash_settings=hash_settings, hasher=hasher, hasher_settings=hasher_settings, **user_manager_settings)
     get_user_manager = create_user_manager_func(get_user_db, UserManager)
 
     # (setup_fastapi_user_create) Create users api func
@@ -198,6 +547,9 @@ def create_fastapi_users_objects(
         UserDB
     )
 
+    # (setup_fastapi_users_stateless) Create authenticator trusting token claims
+    stateless_authenticator = create_stateless_authenticator(auth, get_user_manager, user_model=User) if enable_stateless else None
+
     # (setup_fastapi_users_return) Return users api and constructed objects
     out = dict(
         FastAPIUsers=fastapi_users,
@@ -220,21 +572,75 @@ def create_fastapi_users_objects(
         ),
         auth=dict(
             jwt=jwt,
-            cookie=cookie
-        )
+            cookie=cookie,
+            stateless_authenticator=stateless_authenticator,
+            refresh_token_db=refresh_token_db,
+            session_store=session_store,
+            revocation_list=revocation_list
+        ),
+        executors=dict(
+            password_executor=password_executor
+        ),
+        caches=dict(
+            user_cache=user_cache
+        ),
+        metrics=metrics
     )
     return out
 
+def create_session_store(sessions='memory', async_database=None, **kwargs):
+    """
+    Create a store of server-side cookie sessions.
+
+    Parameters
+    ----------
+    sessions : str
+        One of ``memory`` (:class:`msdss_users_api.sessions.MemorySessionStore`), ``sql`` (:class:`msdss_users_api.sessions.SQLSessionStore`),
+        or ``kv`` (:class:`msdss_users_api.sessions.KeyValueSessionStore`).
+    async_database : :class:`msdss_users_api.pool.PooledDatabase` or :class:`msdss_users_api.pool.AsyncEngineDatabase` or None
+        Async database of the users for ``sql`` sessions.
+    **kwargs
+        Additional arguments passed to the session store.
+
+    Return
+    ------
+    :class:`msdss_users_api.sessions.SessionStoreMixin`
+        The session store.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import create_session_store
+
+        store = create_session_store('memory', max_size=1000)
+    """
+    if sessions == 'memory':
+        out = MemorySessionStore(**kwargs)
+    elif sessions == 'sql':
+        if async_database is None:
+            raise ValueError('SQL sessions require an async_database')
+        out = SQLSessionStore(async_database, SessionTable.__table__, **kwargs)
+    elif sessions == 'kv':
+        out = KeyValueSessionStore(**kwargs)
+    else:
+        raise ValueError(f'Unsupported sessions {sessions}, must be one of memory, sql, or kv')
+    return out
+
 def create_user_db_context(
-    database=Database(),
+    database=None,
     *args, **kwargs):
     """
     Create a context manager for an auto-configured :func:`msdss_users_api.tools.create_user_db_func` function.
 
     Parameters
     ----------
-    database : :class:`msdss_base_database:msdss_base_database.core.Database`
-        Database to use for managing users.
+    database : :class:`msdss_base_database:msdss_base_database.core.Database` or None
+        Database to use for managing users. If ``None``, one is created from environment variables when the function is called.
     *args, **kwargs
         Additional arguments passed to :func:`msdss_users_api.tools.create_user_db_func`.
 
@@ -265,6 +671,7 @@ def create_user_db_context(
     """
     
     # (create_user_db_func_db) Create databases
+    database = database if database is not None else Database()
     database_engine = database._connection
     async_database = databases.Database(str(database_engine.url))
     
@@ -283,7 +690,9 @@ def create_user_db_func(
     async_database=None,
     Base=Base,
     UserTable=UserTable,
-    UserDB=UserDB):
+    UserDB=UserDB,
+    user_cache=None,
+    migrate=True):
     """
     Create a function to return the the database adapter dependency.
 
@@ -293,19 +702,26 @@ def create_user_db_func(
     ----------
     database_engine : :func:`sqlalchemy:sqlalchemy.create_engine`
         SQLAlchemy engine object.
-    async_database : :class:`databases:databases.Database` or None
+    async_database : :class:`databases:databases.Database` or :class:`msdss_users_api.pool.AsyncEngineDatabase` or None
         Async database object from ``databases``. If ``None``, one will be created from parameter ``database_engine``.
+        If it is a :class:`msdss_users_api.pool.AsyncEngineDatabase`, the schema is checked through it when it connects instead of through ``database_engine``.
     Base : :func:`sqlalchemy:sqlalchemy.orm.declarative_base`
         The base class from sqlalchemy. See :func:`sqlalchemy:sqlalchemy.orm.declarative_base`.
     UserTable : :class:`msdss_users_api.models.UserTable`
         The user table model to use for the database dependency. See :class:`msdss_users_api.models.UserTable`.
     UserDB : :class:`msdss_users_api.models.UserDB`
         The user database model for the database dependency. See :class:`msdss_users_api.models.UserDB`.
+    user_cache : :class:`msdss_users_api.cache.UserCache` or None
+        Cache of users keyed by id. Updates and deletes through the database adapter, such as from :class:`msdss_users_api.managers.UserManager`, :func:`msdss_users_api.tools.update_user`, and :func:`msdss_users_api.tools.delete_user`, invalidate cached users.
+        If ``None``, users are not cached.
+    migrate : bool
+        Whether to apply pending schema migrations if the database is behind or not. If ``False`` and the database is behind, a ``RuntimeError`` is raised.
+        The schema version is checked once per process with a single query. See :func:`msdss_users_api.migrations.check_schema`.
 
     Return
     ------
     func
-        A function yielding a :class:`fastapi_users:fastapi_users.db.SQLAlchemyUserDatabase`.
+        A function yielding a :class:`msdss_users_api.adapters.UserDatabase`.
 
     Author
     ------
@@ -330,18 +746,29 @@ def create_user_db_func(
     # (create_user_db_func_db) Get engine and async database
     async_database = async_database if async_database else databases.Database(str(database_engine.url))
 
-    # (create_user_db_func_table) Create user table in database
-    Base.metadata.create_all(database_engine)
+    # (create_user_db_func_table) Check user table schema version in database
+    if isinstance(async_database, AsyncEngineDatabase):
+        async_database.on_connect.append(functools.partial(check_schema, Base=Base, UserTable=UserTable, migrate=migrate))
+    else:
+        check_schema(database_engine, Base=Base, UserTable=UserTable, migrate=migrate)
     table = UserTable.__table__
 
     # (create_user_db_func_return) Return the get_user_db function
     async def out():
-        yield SQLAlchemyUserDatabase(UserDB, async_database, table)
+        yield UserDatabase(UserDB, async_database, table, user_cache=user_cache)
     return out
 
 def create_user_manager(
     reset_password_token_secret,
     verification_token_secret,
+    password_executor=None,
+    metrics=None,
+    revocation=None,
+    refresh_token_db=None,
+    session_store=None,
+    hash_settings=None,
+    hasher=None,
+    hasher_settings={},
     __base__=UserManager,
     *args, **kwargs):
     """
@@ -355,6 +782,24 @@ def create_user_manager(
         Secret to use for reset password token encryption.
     verification_token_secret : str
         Secret to use for verification tokens encryption.
+    password_executor : :class:`msdss_users_api.hashing.PasswordExecutor` or None
+        Executor pool to hash and verify passwords outside of the event loop. If ``None``, passwords are hashed on the event loop.
+    metrics : :class:`msdss_users_api.metrics.Metrics` or None
+        Metrics to time password hashing and count password authentications in. If ``None``, nothing is recorded.
+    revocation : :class:`msdss_users_api.revocation.RevocationList` or None
+        List of revoked tokens to revoke all tokens of a user in when their password is reset or changed. If ``None``, tokens stay valid until they expire.
+    refresh_token_db : :class:`msdss_users_api.adapters.RefreshTokenDatabase` or None
+        Refresh tokens to revoke all refresh tokens of a user in when their password is reset or changed. If ``None``, refresh tokens stay valid until they expire.
+    session_store : :class:`msdss_users_api.sessions.SessionStoreMixin` or None
+        Store of cookie sessions to delete all sessions of a user from when their password is reset or changed, or they are deactivated. If ``None``, sessions stay valid until they expire.
+    hash_settings : dict or None
+        Password hashing settings, such as from :func:`msdss_users_api.hashing.get_hash_settings`. Passwords stored with other settings are rehashed at login.
+        If ``None``, the settings of ``password_executor`` or of ``fastapi-users`` are used.
+    hasher : str or None
+        Password hashing scheme, one of ``bcrypt`` or ``argon2`` (Argon2id with memory, time, and parallelism costs). Hashes of both schemes are verified, and rehashed with ``hasher`` at login.
+        If set, overrides parameter ``hash_settings``. See :func:`msdss_users_api.hashing.create_hash_settings`.
+    hasher_settings : dict
+        Keyword arguments passed to :func:`msdss_users_api.hashing.create_hash_settings`, such as ``rounds``, ``memory_cost``, and ``parallelism``.
     __base__: :class:`msdss_users_api.managers.UserManager`
         The base user manager model from FastAPI Users. See :class:`msdss_users_api.managers.UserManager`.
     *args, **kwargs
@@ -376,11 +821,21 @@ def create_user_manager(
         from msdss_users_api.tools import create_user_manager
 
         UserManager = create_user_manager('msdss-reset-secret', 'msdss-verify-secret')
+
+        # Hash new passwords with argon2id using 64 MiB and 2 passes
+        UserManager = create_user_manager('msdss-reset-secret', 'msdss-verify-secret', hasher='argon2', hasher_settings=dict(rounds=2, memory_cost=65536))
     """
+    hash_settings = create_hash_settings(hasher, **hasher_settings) if hasher is not None else hash_settings
     out = pydantic.create_model(
         'UserManager',
         reset_password_token_secret=reset_password_token_secret,
         verification_token_secret=verification_token_secret,
+        password_executor=password_executor,
+        metrics=metrics,
+        revocation=revocation,
+        refresh_token_db=refresh_token_db,
+        session_store=session_store,
+        hash_settings=hash_settings,
         __base__=__base__,
         *args, **kwargs)
     return out
@@ -390,7 +845,7 @@ def create_user_manager_context(
     user_manager_settings={},
     UserManager=None,
     load_env=True,
-    env=UsersDotEnv()):
+    env=None):
     """
     Create a context manager for an auto-configured :func:`msdss_users_api.tools.create_user_manager_func` function.
 
@@ -410,8 +865,10 @@ def create_user_manager_context(
         The user manager model from FastAPI Users. See :class:`msdss_users_api.managers.UserManager` and :func:`msdss_users_api.tools.create_user_manager`. If ``None``, one will be created from ``user_manager_settings``.
     load_env : bool
         Whether to load variables from a file with environmental variables at ``env_file`` or not.
-    env : :class:`msdss_users_api.env.UsersDotEnv`
-        Object to load environment variables from. If the ``env_file`` and variable exists, it will overwrite parameters ``reset_password_token`` and ``verification_token_secret``.
+    env : :class:`msdss_users_api.env.UsersDotEnv` or None
+        Object to load environment variables from. If the ``env_file`` and variable exists, it will overwrite parameters ``reset_password_token`` and ``verification_token_secret``,
+        and set ``hash_settings`` from the ``hasher``, ``hash_rounds``, ``hash_memory_cost``, and ``hash_parallelism`` variables.
+        If ``None``, a default :class:`msdss_users_api.env.UsersDotEnv` is created when the function is called.
 
     Return
     ------
@@ -449,10 +906,12 @@ def create_user_manager_context(
     """
     
     # (get_user_manager_context_env) Load env vars
+    env = env if env is not None else UsersDotEnv()
     if env.exists() and load_env:
         env.load()
         user_manager_settings['reset_password_token_secret'] = env.get('reset_password_token_secret')
         user_manager_settings['verification_token_secret'] = env.get('verification_token_secret')
+        user_manager_settings['hash_settings'] = _get_env_hash_settings(env)
 
     # (get_user_manager_context_func) Create user manager func
     UserManager = UserManager if UserManager else create_user_manager(**user_manager_settings)
@@ -509,7 +968,60 @@ def create_user_manager_func(get_user_db, UserManager=UserManager):
         yield UserManager(user_db)
     return out
 
-async def delete_user(email, user_db_context_kwargs={}, user_manager_context_kwargs={}):
+async def delete_expired_refresh_tokens(
+    batch_size=DEFAULT_REFRESH_TOKEN_SETTINGS['batch_size'],
+    show=True,
+    user_db_context_kwargs={}):
+    """
+    Delete expired refresh tokens in batches, such as from a scheduled job.
+
+    * Each batch is selected with the ``expires_at`` index and deleted by primary key in its own short query. See :meth:`msdss_users_api.adapters.RefreshTokenDatabase.delete_expired`
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of tokens to delete in each query.
+    show : bool
+        Whether to print a summary to standard error or not.
+    user_db_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+
+    Return
+    ------
+    int
+        Number of deleted tokens.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import *
+
+        deleted = await delete_expired_refresh_tokens(batch_size=1000)
+    """
+
+    # (delete_expired_refresh_tokens_context) Get db context
+    user_db_context = create_user_db_context(**user_db_context_kwargs)
+    get_user_db_context = user_db_context['get_user_db_context']
+    async_database = user_db_context['async_database']
+
+    # (delete_expired_refresh_tokens_run) Delete expired tokens
+    try:
+        async with get_user_db_context() as user_db:
+            await async_database.connect()
+            refresh_token_db = RefreshTokenDatabase(user_db.user_db_model, async_database, RefreshTokenTable.__table__, user_db.users)
+            out = await refresh_token_db.delete_expired(batch_size=batch_size)
+    finally:
+        await async_database.disconnect()
+    if show:
+        print(f'Refresh tokens deleted {out}', file=sys.stderr)
+    return out
+
+async def delete_user(email, user_db_context_kwargs={}, user_manager_context_kwargs={}, user_manager=None):
     """
     Delete a user.
 
@@ -519,8 +1031,11 @@ async def delete_user(email, user_db_context_kwargs={}, user_manager_context_kwa
         Email for the user.
     user_db_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+        Include a ``user_cache`` (:class:`msdss_users_api.cache.UserCache`) to invalidate the cached user after the write.
     user_manager_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+    user_manager : :class:`msdss_users_api.managers.UserManager` or None
+        User manager with a connected database to reuse instead of creating one from ``user_db_context_kwargs`` and ``user_manager_context_kwargs``, so that many calls can share one connection.
 
     Author
     ------
@@ -547,27 +1062,148 @@ async def delete_user(email, user_db_context_kwargs={}, user_manager_context_kwa
         await delete_user('test@example.com', user_manager_context_kwargs=kwargs)
     """
 
-    # (delete_user_context) Get db and manager context functions
+    # (delete_user_run) Run delete user function
+    try:
+        async with _get_user_manager(user_manager, user_db_context_kwargs, user_manager_context_kwargs) as user_manager:
+            user = await user_manager.get_by_email(email)
+            await user_manager.delete(user)
+            print(f'User deleted {email}')
+    except UserNotExists:
+        print(f'User {email} does not exist')
+
+async def export_users(
+    path='-',
+    format=None,
+    include_hashed_password=False,
+    batch_size=DEFAULT_EXPORT_SETTINGS['batch_size'],
+    show=True,
+    user_db_context_kwargs={}):
+    """
+    Export users to a CSV, JSON lines, or Parquet file in keyset paged chunks.
+
+    * Each chunk is fetched with its own short query ordered by user id, so no long transaction is held and memory use does not depend on the number of users
+    * Parquet files require the optional ``pyarrow`` package (``pip install msdss-users-api[parquet]``) and are written with one row group per chunk
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write, or ``-`` to write to standard output.
+    format : str or None
+        One of ``csv``, ``jsonl``, or ``parquet``. If ``None``, the format is taken from the file extension, defaulting to ``csv``.
+    include_hashed_password : bool
+        Whether to include the ``hashed_password`` attribute.
+    batch_size : int
+        Number of users to fetch and write at a time.
+    show : bool
+        Whether to print a summary to standard error or not.
+    user_db_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+
+    Return
+    ------
+    int
+        Number of users exported.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import *
+
+        # Create user manager secrets
+        kwargs = dict(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret',
+                verification_token_secret='verification-secret'
+            )
+        )
+
+        # Export users
+        await register_user('test@example.com', 'msdss123', user_manager_context_kwargs=kwargs)
+        await export_users('users.jsonl')
+        await delete_user('test@example.com', user_manager_context_kwargs=kwargs)
+
+        # Show exported users
+        with open('users.jsonl') as f:
+            print(f.read())
+    """
+
+    # (export_users_format) Get format from file extension
+    if format is None:
+        extension = os.path.splitext(path)[1].lower()
+        format = 'jsonl' if extension in ('.jsonl', '.ndjson', '.json') else 'parquet' if extension == '.parquet' else 'csv'
+    if format not in ('csv', 'jsonl', 'parquet'):
+        raise ValueError(f'Unsupported format {format}, must be one of csv, jsonl, or parquet')
+    if format == 'parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Exporting to parquet requires pyarrow, install it with pip install msdss-users-api[parquet]')
+
+    # (export_users_context) Get db context
     user_db_context = create_user_db_context(**user_db_context_kwargs)
     get_user_db_context = user_db_context['get_user_db_context']
-    get_user_db = user_db_context['get_user_db']
-    async_database= user_db_context['async_database']
-    get_user_manager_context = create_user_manager_context(get_user_db=get_user_db, **user_manager_context_kwargs)
+    async_database = user_db_context['async_database']
+    out = 0
 
-    # (delete_user_run) Run delete user function
+    # (export_users_run) Fetch users after the last id of each chunk and write them
     try:
         async with get_user_db_context() as user_db:
-            async with get_user_manager_context(user_db) as user_manager:
-                await async_database.connect()
-                user = await user_manager.get_by_email(email)
-                await user_manager.delete(user)
-                print(f'User deleted {email}')
-    except UserNotExists:
-        print(f'User {email} does not exist')
+            await async_database.connect()
+            table = user_db.users
+            columns = [c for c in table.c if c.name != 'email_normalized' and (include_hashed_password or c.name != 'hashed_password')]
+            names = [c.name for c in columns]
+            if path == '-':
+                file = contextlib.nullcontext(sys.stdout.buffer if format == 'parquet' else sys.stdout)
+            elif format == 'parquet':
+                file = open(path, 'wb')
+            else:
+                file = open(path, 'w', newline='', encoding='utf-8')
+            with file as f:
+                csv_writer = csv.DictWriter(f, fieldnames=names) if format == 'csv' else None
+                parquet_writer = None
+                if csv_writer:
+                    csv_writer.writeheader()
+                last_id = None
+                while True:
+
+                    # (export_users_run_fetch) Fetch next chunk by keyset
+                    query = sqlalchemy.select(columns).order_by(table.c.id).limit(batch_size)
+                    if last_id is not None:
+                        query = query.where(table.c.id > last_id)
+                    rows = await async_database.fetch_all(query)
+                    if not rows:
+                        break
+                    last_id = rows[-1]['id']
+                    users = [{k: str(row[k]) if k == 'id' else row[k] for k in names} for row in rows]
+
+                    # (export_users_run_write) Write chunk
+                    if format == 'csv':
+                        csv_writer.writerows(users)
+                    elif format == 'jsonl':
+                        f.writelines(json.dumps(user, default=str) + '\n' for user in users)
+                    else:
+                        chunk = pyarrow.Table.from_pylist(users)
+                        parquet_writer = parquet_writer if parquet_writer else pyarrow.parquet.ParquetWriter(f, chunk.schema)
+                        parquet_writer.write_table(chunk)
+                    out += len(users)
+                if parquet_writer:
+                    parquet_writer.close()
     finally:
         await async_database.disconnect()
 
-async def get_user(email, show=False, include_hashed_password=False, user_db_context_kwargs={}, user_manager_context_kwargs={}):
+    # (export_users_return) Show and return number of users
+    if show:
+        print(f'Users exported {out}', file=sys.stderr)
+    return out
+
+async def get_user(email, show=False, include_hashed_password=False, user_db_context_kwargs={}, user_manager_context_kwargs={}, user_manager=None):
     """
     Get attributes for a user.
 
@@ -583,6 +1219,8 @@ async def get_user(email, show=False, include_hashed_password=False, user_db_con
         Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
     user_manager_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+    user_manager : :class:`msdss_users_api.managers.UserManager` or None
+        User manager with a connected database to reuse instead of creating one from ``user_db_context_kwargs`` and ``user_manager_context_kwargs``, so that many calls can share one connection.
 
     Author
     ------
@@ -617,35 +1255,183 @@ async def get_user(email, show=False, include_hashed_password=False, user_db_con
         await delete_user('test@example.com', user_manager_context_kwargs=kwargs)
     """
 
-    # (get_user_context) Get db and manager context functions
-    user_db_context = create_user_db_context(**user_db_context_kwargs)
-    get_user_db_context = user_db_context['get_user_db_context']
-    get_user_db = user_db_context['get_user_db']
-    async_database= user_db_context['async_database']
-    get_user_manager_context = create_user_manager_context(get_user_db=get_user_db, **user_manager_context_kwargs)
-
     # (get_user_run) Run get user function
     try:
-        async with get_user_db_context() as user_db:
-            async with get_user_manager_context(user_db) as user_manager:
+        async with _get_user_manager(user_manager, user_db_context_kwargs, user_manager_context_kwargs) as user_manager:
 
-                # (get_user_run_get) Connect and get the user from db
-                await async_database.connect()
-                out = await user_manager.get_by_email(email)
-
-                # (get_user_run_hash) Remove hashed password if needed
-                if not include_hashed_password:
-                    del out.hashed_password
-                
-                # (get_user_run_show) Print user attributes
-                if show:
-                    for k, v in out.dict().items():
-                        print(f'{k}: {v}')
-                return out
+            # (get_user_run_get) Get the user from db
+            out = await user_manager.get_by_email(email)
+
+            # (get_user_run_hash) Remove hashed password if needed
+            if not include_hashed_password:
+                del out.hashed_password
+            
+            # (get_user_run_show) Print user attributes
+            if show:
+                for k, v in out.dict().items():
+                    print(f'{k}: {v}')
+            return out
     except UserNotExists:
         print(f'User {email} does not exist')
+
+async def import_users(
+    path,
+    format=None,
+    batch_size=DEFAULT_IMPORT_SETTINGS['batch_size'],
+    password_executor=None,
+    show=True,
+    user_db_context_kwargs={}):
+    """
+    Import users from a CSV or JSON lines file in batches.
+
+    * Rows are streamed from the file, so memory use does not depend on the file size
+    * Plain text passwords are hashed in parallel across cores and each batch is written with a single multi-row ``INSERT``
+    * Rows that conflict with existing users or are invalid are reported and skipped without stopping the import. Other database errors stop the import
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to import, or ``-`` to read from standard input. Each row or JSON object can have the following keys:
+
+        * ``email`` (str): email for the user
+        * ``password`` (str): plain text password for the user, required if ``hashed_password`` is not set
+        * ``hashed_password`` (str): already hashed password for the user, used as is
+        * ``is_active``, ``is_superuser``, ``is_verified`` (bool): optional user attributes
+
+    format : str or None
+        One of ``csv`` or ``jsonl``. If ``None``, the format is taken from the file extension, defaulting to ``csv``.
+    batch_size : int
+        Number of rows to hash and insert at a time.
+    password_executor : :class:`msdss_users_api.hashing.PasswordExecutor` or None
+        Executor pool used to hash plain text passwords. If ``None``, a process pool with one worker per CPU is created for the import.
+    show : bool
+        Whether to print conflicts, invalid rows, and a summary or not.
+    user_db_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+
+    Return
+    ------
+    dict
+        A dictionary with the number of rows ``created``, the number of ``conflicts`` with existing users, and the number of ``invalid`` rows.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import *
+
+        # Create user manager secrets
+        kwargs = dict(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret',
+                verification_token_secret='verification-secret'
+            )
+        )
+
+        # Write a file of users
+        with open('users.csv', 'w') as f:
+            f.write('email,password,is_verified\\n')
+            f.write('test1@example.com,msdss123,true\\n')
+            f.write('test2@example.com,msdss123,false\\n')
+
+        # Import users
+        await import_users('users.csv')
+        await delete_user('test1@example.com', user_manager_context_kwargs=kwargs)
+        await delete_user('test2@example.com', user_manager_context_kwargs=kwargs)
+    """
+
+    # (import_users_context) Get db context and hashing pool
+    user_db_context = create_user_db_context(**user_db_context_kwargs)
+    get_user_db_context = user_db_context['get_user_db_context']
+    async_database = user_db_context['async_database']
+    owns_executor = password_executor is None
+    password_executor = PasswordExecutor('process') if owns_executor else password_executor
+    out = dict(created=0, conflicts=0, invalid=0)
+
+    # (import_users_report) Report skipped rows
+    def report(key, line, email, message):
+        out[key] += 1
+        if show:
+            print(f'Row {line}: {email} {message}')
+
+    # (import_users_batch) Insert a batch of users, skipping existing ones
+    async def insert_batch(user_db, batch):
+
+        # (import_users_batch_hash) Hash plain text passwords in parallel
+        passwords = [row['password'] for line, row in batch if 'hashed_password' not in row]
+        hashed = iter(await asyncio.gather(*[password_executor.hash(password) for password in passwords]))
+        hashed_passwords = [row['hashed_password'] if 'hashed_password' in row else next(hashed) for line, row in batch]
+
+        # (import_users_batch_validate) Validate users and drop duplicates within the batch
+        users = {}
+        for (line, row), hashed_password in zip(batch, hashed_passwords):
+            values = {k: v for k, v in row.items() if k not in ('password', 'hashed_password')}
+            email = values.get('email')
+            try:
+                user = user_db.user_db_model(hashed_password=hashed_password, **values)
+            except pydantic.ValidationError as e:
+                report('invalid', line, email, 'is invalid: ' + '; '.join(f"{'.'.join(str(l) for l in err['loc'])} {err['msg']}" for err in e.errors()))
+                continue
+            email = normalize_email(user.email)
+            if email in users:
+                report('conflicts', line, user.email, 'already exists')
+                continue
+            users[email] = (line, user_db._get_values(user))
+
+        # (import_users_batch_conflicts) Skip users that already exist
+        query = sqlalchemy.select([user_db.users.c.email_normalized]).where(user_db.users.c.email_normalized.in_(list(users)))
+        existing = {row['email_normalized'] for row in await async_database.fetch_all(query)}
+        for email in existing:
+            line, user = users.pop(email)
+            report('conflicts', line, user['email'], 'already exists')
+
+        # (import_users_batch_insert) Insert batch in one statement or row by row if a user was created concurrently
+        if users:
+            try:
+                async with async_database.transaction():
+                    await async_database.execute(user_db.users.insert().values([user for line, user in users.values()]))
+                out['created'] += len(users)
+            except Exception as e:
+                if not _is_integrity_error(e):
+                    raise
+                for line, user in users.values():
+                    try:
+                        await async_database.execute(user_db.users.insert().values(**user))
+                        out['created'] += 1
+                    except Exception as e:
+                        if not _is_integrity_error(e):
+                            raise
+                        report('conflicts', line, user['email'], 'already exists')
+
+    # (import_users_run) Stream rows and insert them in batches
+    try:
+        async with get_user_db_context() as user_db:
+            await async_database.connect()
+            batch = []
+            for line, row in _read_user_rows(path, format=format):
+                if 'password' not in row and 'hashed_password' not in row:
+                    report('invalid', line, row.get('email'), 'is invalid: password or hashed_password is required')
+                    continue
+                batch.append((line, row))
+                if len(batch) >= batch_size:
+                    await insert_batch(user_db, batch)
+                    batch = []
+            if batch:
+                await insert_batch(user_db, batch)
     finally:
         await async_database.disconnect()
+        if owns_executor:
+            password_executor.shutdown()
+
+    # (import_users_return) Show and return summary
+    if show:
+        print(f"Users imported {out['created']}, conflicts {out['conflicts']}, invalid {out['invalid']}")
+    return out
 
 async def register_user(
     email,
@@ -653,6 +1439,7 @@ async def register_user(
     superuser=False,
     user_db_context_kwargs={},
     user_manager_context_kwargs={},
+    user_manager=None,
     *args, **kwargs):
     """
     Register a user.
@@ -669,6 +1456,8 @@ async def register_user(
         Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
     user_manager_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+    user_manager : :class:`msdss_users_api.managers.UserManager` or None
+        User manager with a connected database to reuse instead of creating one from ``user_db_context_kwargs`` and ``user_manager_context_kwargs``, so that many calls can share one connection.
     *args, **kwargs
         Additional arguments passed to :class:`msdss_users_api.models.UserCreate`.
 
@@ -699,31 +1488,20 @@ async def register_user(
         await delete_user('test@example.com', user_manager_context_kwargs=kwargs)
     """
     
-    # (register_user_context) Get db and manager context functions
-    user_db_context = create_user_db_context(**user_db_context_kwargs)
-    get_user_db_context = user_db_context['get_user_db_context']
-    get_user_db = user_db_context['get_user_db']
-    async_database= user_db_context['async_database']
-    get_user_manager_context = create_user_manager_context(get_user_db=get_user_db, **user_manager_context_kwargs)
-
     # (register_user_run) Run create user function
     try:
-        async with get_user_db_context() as user_db:
-            async with get_user_manager_context(user_db) as user_manager:
-                await async_database.connect()
-                await user_manager.create(
-                    UserCreate(
-                        email=email,
-                        password=password,
-                        is_superuser=superuser,
-                        *args, **kwargs))
-                print(f'User created {email}')
+        async with _get_user_manager(user_manager, user_db_context_kwargs, user_manager_context_kwargs) as user_manager:
+            await user_manager.create(
+                UserCreate(
+                    email=email,
+                    password=password,
+                    is_superuser=superuser,
+                    *args, **kwargs))
+            print(f'User created {email}')
     except UserAlreadyExists:
         print(f'User {email} already exists')
-    finally:
-        await async_database.disconnect()
 
-async def reset_user_password(email, password, user_db_context_kwargs={}, user_manager_context_kwargs={}):
+async def reset_user_password(email, password, user_db_context_kwargs={}, user_manager_context_kwargs={}, user_manager=None):
     """
     Reset password for a user.
 
@@ -737,6 +1515,8 @@ async def reset_user_password(email, password, user_db_context_kwargs={}, user_m
         Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
     user_manager_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+    user_manager : :class:`msdss_users_api.managers.UserManager` or None
+        User manager with a connected database to reuse instead of creating one from ``user_db_context_kwargs`` and ``user_manager_context_kwargs``, so that many calls can share one connection.
 
     Author
     ------
@@ -766,45 +1546,35 @@ async def reset_user_password(email, password, user_db_context_kwargs={}, user_m
         await delete_user('test@example.com', user_manager_context_kwargs=kwargs)
     """
 
-    # (reset_user_password_context) Get db and manager context functions
-    user_db_context = create_user_db_context(**user_db_context_kwargs)
-    get_user_db_context = user_db_context['get_user_db_context']
-    get_user_db = user_db_context['get_user_db']
-    async_database= user_db_context['async_database']
-    get_user_manager_context = create_user_manager_context(get_user_db=get_user_db, **user_manager_context_kwargs)
-
     # (reset_user_password_run) Run password reset user function
     try:
-        async with get_user_db_context() as user_db:
-            async with get_user_manager_context(user_db) as user_manager:
+        async with _get_user_manager(user_manager, user_db_context_kwargs, user_manager_context_kwargs) as user_manager:
+
+            # (reset_user_password_run_user) Get user by email
+            user = await user_manager.get_by_email(email)
+
+            # (reset_user_password_run_token) Get forgot password token
+            token_data = {
+                "user_id": str(user.id),
+                "aud": user_manager.reset_password_token_audience,
+            }
+            token = generate_jwt(
+                token_data,
+                user_manager.reset_password_token_secret,
+                user_manager.reset_password_token_lifetime_seconds,
+            )
 
-                # (reset_user_password_run_user) Get user by email
-                await async_database.connect()
-                user = await user_manager.get_by_email(email)
-
-                # (reset_user_password_run_token) Get forgot password token
-                token_data = {
-                    "user_id": str(user.id),
-                    "aud": user_manager.reset_password_token_audience,
-                }
-                token = generate_jwt(
-                    token_data,
-                    user_manager.reset_password_token_secret,
-                    user_manager.reset_password_token_lifetime_seconds,
-                )
-
-                # (reset_user_password_run_reset) Reset password with token
-                await user_manager.reset_password(token, password)
-                print(f'User password reset {email}')
+            # (reset_user_password_run_reset) Reset password with token
+            await user_manager.reset_password(token, password)
+            print(f'User password reset {email}')
     except UserNotExists:
         print(f'User {email} does not exist')
-    finally:
-        await async_database.disconnect()
 
 async def update_user(
     email,
     user_db_context_kwargs={},
     user_manager_context_kwargs={},
+    user_manager=None,
     *args, **kwargs):
     """
     Update a user.
@@ -815,8 +1585,11 @@ async def update_user(
         Email for the user.
     user_db_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+        Include a ``user_cache`` (:class:`msdss_users_api.cache.UserCache`) to invalidate the cached user after the write.
     user_manager_context_kwargs : dict
         Arguments passed to :class:`msdss_users_api.tools.create_user_manager_context`.
+    user_manager : :class:`msdss_users_api.managers.UserManager` or None
+        User manager with a connected database to reuse instead of creating one from ``user_db_context_kwargs`` and ``user_manager_context_kwargs``, so that many calls can share one connection.
     *args, **kwargs
         Additional arguments passed to :class:`msdss_users_api.models.UserUpdate`.
 
@@ -854,27 +1627,125 @@ async def update_user(
         await delete_user('test@example.com', user_manager_context_kwargs=kwargs)
     """
     
-    # (register_user_context) Get db and manager context functions
+    # (register_user_run) Run create user function
+    try:
+        async with _get_user_manager(user_manager, user_db_context_kwargs, user_manager_context_kwargs) as user_manager:
+            user = await user_manager.get_by_email(email)
+            await user_manager.update(
+                UserUpdate(
+                    email=email,
+                    *args, **kwargs),
+                user
+            )
+            print(f'User updated {email}')
+    except UserNotExists:
+        print(f'User {email} does not exist')
+async def update_users(
+    values,
+    emails=None,
+    domain=None,
+    is_active=None,
+    is_superuser=None,
+    is_verified=None,
+    batch_size=DEFAULT_UPDATE_SETTINGS['batch_size'],
+    show=True,
+    user_db_context_kwargs={}):
+    """
+    Set ``is_active``, ``is_superuser``, or ``is_verified`` for many users at once, such as to deactivate all users of a domain.
+
+    * Users are updated with set-based ``UPDATE`` queries of up to ``batch_size`` users instead of one lookup and update per user, so that each query holds locks briefly. See :meth:`msdss_users_api.adapters.UserDatabase.update_many`
+    * At least one filter is required, so that all users are not updated by mistake
+    * Deactivated users have their tokens, refresh tokens, and ``sql`` sessions revoked with each batch. See :func:`msdss_users_api.tools._create_user_revokers`
+
+    Parameters
+    ----------
+    values : dict
+        Values to set, with keys ``is_active``, ``is_superuser``, or ``is_verified`` and bool values.
+    emails : iterable of str or None
+        Only update users with these emails, such as lines streamed from a file. If ``None``, do not filter on them.
+    domain : str or None
+        Only update users with emails in this domain (e.g. ``example.com``). If ``None``, do not filter on it.
+    is_active : bool or None
+        Only update users with this ``is_active`` value. If ``None``, do not filter on it.
+    is_superuser : bool or None
+        Only update users with this ``is_superuser`` value. If ``None``, do not filter on it.
+    is_verified : bool or None
+        Only update users with this ``is_verified`` value. If ``None``, do not filter on it.
+    batch_size : int
+        Max number of users to update in each query.
+    show : bool
+        Whether to print the number of updated users or not.
+    user_db_context_kwargs : dict
+        Arguments passed to :class:`msdss_users_api.tools.create_user_db_context`.
+        Include a ``user_cache`` (:class:`msdss_users_api.cache.UserCache`) to invalidate the cached users after the writes.
+
+    Return
+    ------
+    int
+        Number of updated users.
+
+    Author
+    ------
+    Richard Wen <rrwen.dev@gmail.com>
+
+    Example
+    -------
+
+    .. jupyter-execute::
+
+        from msdss_users_api.tools import *
+
+        # Create user manager secrets
+        kwargs = dict(
+            user_manager_settings=dict(
+                reset_password_token_secret='reset-secret',
+                verification_token_secret='verification-secret'
+            )
+        )
+
+        # Create test users
+        await register_user('test1@example.com', 'msdss123', user_manager_context_kwargs=kwargs)
+        await register_user('test2@example.com', 'msdss123', user_manager_context_kwargs=kwargs)
+
+        # Deactivate all users of a domain
+        updated = await update_users(dict(is_active=False), domain='example.com')
+
+        # Verify users from a list of emails
+        updated = await update_users(dict(is_verified=True), emails=['test1@example.com'])
+        await delete_user('test1@example.com', user_manager_context_kwargs=kwargs)
+        await delete_user('test2@example.com', user_manager_context_kwargs=kwargs)
+    """
+
+    # (update_users_filter) Require a filter
+    if emails is None and not domain and all(v is None for v in (is_active, is_superuser, is_verified)):
+        raise ValueError('At least one of emails, domain, is_active, is_superuser, or is_verified is required to filter users')
+
+    # (update_users_context) Get db context
     user_db_context = create_user_db_context(**user_db_context_kwargs)
     get_user_db_context = user_db_context['get_user_db_context']
-    get_user_db = user_db_context['get_user_db']
-    async_database= user_db_context['async_database']
-    get_user_manager_context = create_user_manager_context(get_user_db=get_user_db, **user_manager_context_kwargs)
+    async_database = user_db_context['async_database']
 
-    # (register_user_run) Run create user function
+    # (update_users_run) Update users in batches
     try:
         async with get_user_db_context() as user_db:
-            async with get_user_manager_context(user_db) as user_manager:
-                await async_database.connect()
-                user = await user_manager.get_by_email(email)
-                await user_manager.update(
-                    UserUpdate(
-                        email=email,
-                        *args, **kwargs),
-                    user
-                )
-                print(f'User updated {email}')
-    except UserNotExists:
-        print(f'User {email} does not exist')
+            await async_database.connect()
+            out = await user_db.update_many(
+                values,
+                emails=emails,
+                domain=domain,
+                is_active=is_active,
+                is_superuser=is_superuser,
+                is_verified=is_verified,
+                batch_size=batch_size,
+                **_create_user_revokers(
+                    async_database,
+                    UserDB=user_db_context_kwargs.get('UserDB', UserDB),
+                    UserTable=user_db_context_kwargs.get('UserTable', UserTable))
+            )
     finally:
-        await async_database.disconnect()
\ No newline at end of file
+        await async_database.disconnect()
+
+    # (update_users_return) Show and return number of users
+    if show:
+        print(f'Users updated {out}')
+    return out
\ No newline at end of file